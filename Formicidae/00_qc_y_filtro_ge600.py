@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+
+"""
+Control de calidad y filtro del FASTA crudo en una sola pasada.
+
+Genera el subconjunto formicidae_ge600.* (fasta, ids, labels, metadata) que
+antes salía de un filtro de largo >= 600 hecho a mano, y además descarta
+secuencias con muchas bases ambiguas, con gaps o con codones stop.
+
+Por secuencia se calcula:
+- length:      largo sin gaps,
+- ambig_frac:  fracción de N / códigos IUPAC (todo lo que no es ACGT) sin gaps,
+- gap_frac:    fracción de '-' y '.' sobre el largo crudo,
+- stops:       codones stop (TAA, TAG: código mitocondrial de invertebrados)
+               en el mejor de los 3 marcos de lectura directos.
+
+El archivo se lee en bloques de bytes cortados en límites de registro; cada
+bloque se procesa en un proceso del Pool con operaciones vectorizadas sobre
+todo el bloque (no secuencia por secuencia) y los resultados se escriben en
+orden a medida que llegan.
+
+Los formicidae_ge600.* que ya están en el repositorio salieron del filtro
+hecho a mano; para no pisarlos sin querer, el script no escribe sobre salidas
+existentes salvo con --force (o con otro --out-prefix).
+
+Uso:
+  python 00_qc_y_filtro_ge600.py --fasta ../Raw/COI.fasta --meta ../Raw/COI.metadata.tsv --family Formicidae
+  python 00_qc_y_filtro_ge600.py --family Formicidae --out-prefix formicidae_ge600_qc
+"""
+
+import argparse
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+# ==========================
+# CONFIGURACIÓN
+# ==========================
+
+RAW_FASTA = "../Raw/COI.fasta"
+RAW_META = "../Raw/COI.metadata.tsv"   # columnas seq_id ... order family genus species
+FAMILY = None                          # p.ej. "Formicidae"; None = todas
+OUT_PREFIX = "formicidae_ge600"
+QC_FILE = None                         # TSV opcional con las métricas de todas las secuencias
+
+MIN_LEN = 600
+MAX_AMBIG_FRAC = 0.01
+MAX_GAP_FRAC = 0.05
+MAX_STOPS = 0
+
+MOTIVOS = ("length", "ambig", "gap", "stops")
+
+BLOCK_BYTES = 16 * 1024 * 1024   # bytes de FASTA por bloque enviado a cada proceso
+N_PROCS = None                   # None = todos los núcleos
+
+# Tablas de bytes
+IS_GAP = np.zeros(256, dtype=bool)
+IS_GAP[[ord("-"), ord(".")]] = True
+IS_ACGT = np.zeros(256, dtype=bool)
+for b in "ACGTacgt":
+    IS_ACGT[ord(b)] = True
+UPPER = np.arange(256, dtype=np.uint8)
+UPPER[ord("a"):ord("z") + 1] -= 32
+
+# ==========================
+# LECTURA
+# ==========================
+
+def leer_metadata(path, family):
+    """seq_id -> (fila completa, label) filtrando por familia si se pide."""
+    meta = {}
+    with open(path) as f:
+        header = f.readline().rstrip("\n").split("\t")
+        try:
+            id_idx = header.index("seq_id")
+            fam_idx = header.index("family")
+            gen_idx = header.index("genus")
+            ord_idx = header.index("order")
+        except ValueError:
+            raise SystemExit("ERROR: La metadata debe tener columnas 'seq_id', 'order', 'family' y 'genus' separadas por TAB.")
+        for line in f:
+            if not line.strip():
+                continue
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) <= max(id_idx, fam_idx, gen_idx, ord_idx):
+                continue
+            if family is not None and cols[fam_idx] != family:
+                continue
+            label = f"{cols[gen_idx]}|{cols[gen_idx]}|{cols[fam_idx]}|{cols[ord_idx]}"
+            meta[cols[id_idx]] = ("\t".join(cols), label)
+    return meta
+
+
+def bloques_de_registros(path, size):
+    """Bloques de bytes del FASTA que empiezan en '>' y terminan antes del siguiente '>'."""
+    with open(path, "rb") as f:
+        resto = b""
+        while True:
+            data = f.read(size)
+            if not data:
+                break
+            buf = resto + data
+            cut = buf.rfind(b"\n>")
+            if cut < 0:
+                resto = buf
+                continue
+            yield buf[:cut + 1]
+            resto = buf[cut + 1:]
+        if resto.strip():
+            yield resto
+
+# ==========================
+# QC VECTORIZADO POR BLOQUE
+# ==========================
+
+PERMITIDOS = None  # IDs a evaluar por proceso (None = todos)
+FILTROS = None     # umbrales por proceso (se cargan en el inicializador del Pool)
+
+
+QC_TABLA = False   # si se devuelve también el texto de la tabla de métricas
+
+
+def init_worker(permitidos, filtros, qc_tabla):
+    global PERMITIDOS, FILTROS, QC_TABLA
+    PERMITIDOS = permitidos
+    FILTROS = filtros
+    QC_TABLA = qc_tabla
+
+
+def suma_por_registro(mask, offsets):
+    """Cantidad de True de 'mask' dentro de cada registro [offsets[i], offsets[i+1])."""
+    c = np.zeros(len(mask) + 1, dtype=np.int64)
+    np.cumsum(mask, out=c[1:])
+    return c[offsets[1:]] - c[offsets[:-1]]
+
+
+def qc_bloque(block):
+    """
+    QC de un bloque de registros. Devuelve (IDs aprobados, secuencias
+    aprobadas, cantidad evaluada, descartes por motivo, texto de la tabla QC).
+    """
+    ids = []
+    seqs = []
+    for rec in block.lstrip(b">").split(b"\n>"):
+        header, _, body = rec.partition(b"\n")
+        if not header.strip():
+            continue
+        sid = header.split()[0].decode("ascii")
+        if PERMITIDOS is not None and sid not in PERMITIDOS:
+            continue
+        ids.append(sid)
+        seqs.append(body.replace(b"\n", b"").replace(b"\r", b""))
+    n = len(ids)
+    if n == 0:
+        return [], [], 0, dict.fromkeys(MOTIVOS, 0), ""
+
+    raw_len = np.fromiter((len(s) for s in seqs), dtype=np.int64, count=n)
+    raw_off = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(raw_len, out=raw_off[1:])
+    raw = np.frombuffer(b"".join(seqs), dtype=np.uint8)
+
+    gap = IS_GAP[raw]
+    n_gap = suma_por_registro(gap, raw_off)
+
+    # Secuencia sin gaps (mismo buffer compactado)
+    seq = UPPER[raw[~gap]]
+    length = raw_len - n_gap
+    off = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(length, out=off[1:])
+    n_acgt = suma_por_registro(IS_ACGT[seq], off)
+
+    # Codones stop TAA / TAG: posición p del stop -> registro y marco
+    stops = np.zeros((n, 3), dtype=np.int64)
+    if len(seq) >= 3:
+        es_stop = (seq[:-2] == ord("T")) & (seq[1:-1] == ord("A")) & (
+            (seq[2:] == ord("A")) | (seq[2:] == ord("G")))
+        p = np.flatnonzero(es_stop)
+        rec = np.searchsorted(off, p, side="right") - 1
+        ok = p + 3 <= off[rec + 1]
+        p, rec = p[ok], rec[ok]
+        frame = (p - off[rec]) % 3
+        stops = np.bincount(rec * 3 + frame, minlength=3 * n).reshape(n, 3)
+    best_stops = stops.min(axis=1)
+
+    safe = np.maximum(length, 1)
+    ambig_frac = (length - n_acgt) / safe
+    ambig_frac[length == 0] = 1.0
+    gap_frac = n_gap / np.maximum(raw_len, 1)
+
+    falla = {
+        "length": length < FILTROS["min_len"],
+        "ambig": ambig_frac > FILTROS["max_ambig"],
+        "gap": gap_frac > FILTROS["max_gap"],
+        "stops": best_stops > FILTROS["max_stops"],
+    }
+    passed = ~(falla["length"] | falla["ambig"] | falla["gap"] | falla["stops"])
+    motivos = {m: int(falla[m].sum()) for m in MOTIVOS}
+
+    qc_text = ""
+    if QC_TABLA:
+        qc_text = "".join(
+            f"{sid}\t{l}\t{a:.4f}\t{g:.4f}\t{st}\t{int(ok)}\n"
+            for sid, l, a, g, st, ok in zip(ids, length.tolist(), ambig_frac.tolist(),
+                                            gap_frac.tolist(), best_stops.tolist(), passed.tolist())
+        )
+    ok_rows = np.flatnonzero(passed).tolist()
+    return [ids[i] for i in ok_rows], [seqs[i] for i in ok_rows], n, motivos, qc_text
+
+# ==========================
+# PROGRAMA PRINCIPAL
+# ==========================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="QC y filtro del FASTA crudo en una pasada.")
+    parser.add_argument("--fasta", default=RAW_FASTA)
+    parser.add_argument("--meta", default=RAW_META)
+    parser.add_argument("--family", default=FAMILY)
+    parser.add_argument("--out-prefix", default=OUT_PREFIX)
+    parser.add_argument("--qc", default=QC_FILE, help="TSV con métricas de todas las secuencias evaluadas")
+    parser.add_argument("--min-len", type=int, default=MIN_LEN)
+    parser.add_argument("--max-ambig", type=float, default=MAX_AMBIG_FRAC)
+    parser.add_argument("--max-gap", type=float, default=MAX_GAP_FRAC)
+    parser.add_argument("--max-stops", type=int, default=MAX_STOPS)
+    parser.add_argument("--procs", type=int, default=N_PROCS)
+    parser.add_argument("--force", action="store_true", help="sobrescribir salidas existentes")
+    args = parser.parse_args()
+
+    filtros = {
+        "min_len": args.min_len,
+        "max_ambig": args.max_ambig,
+        "max_gap": args.max_gap,
+        "max_stops": args.max_stops,
+    }
+
+    if os.path.abspath(f"{args.out_prefix}.fasta") == os.path.abspath(args.fasta):
+        raise SystemExit("ERROR: El FASTA de salida no puede ser el mismo que el de entrada.")
+    salidas = [f"{args.out_prefix}.{ext}" for ext in ("fasta", "ids", "labels", "metadata")]
+    existentes = [p for p in salidas + [args.qc] if p and os.path.exists(p)]
+    if existentes and not args.force:
+        raise SystemExit(f"ERROR: Ya existen {', '.join(existentes)}. Usá otro --out-prefix o --force "
+                         f"para sobrescribirlos.")
+
+    print(f"Usando FASTA: {args.fasta}")
+    print(f"Usando metadata: {args.meta}")
+    print(f"Familia: {args.family or 'todas'}")
+    print(f"Filtros: largo >= {filtros['min_len']}, ambiguas <= {filtros['max_ambig']}, "
+          f"gaps <= {filtros['max_gap']}, stops <= {filtros['max_stops']}")
+
+    meta = leer_metadata(args.meta, args.family)
+    print(f"Secuencias en la metadata: {len(meta)}")
+    permitidos = set(meta) if args.family is not None else None
+
+    t0 = time.perf_counter()
+    n_eval = 0
+    n_ok = 0
+    n_sin_meta = 0
+    motivos = dict.fromkeys(MOTIVOS, 0)
+    prefix = args.out_prefix
+    qc_out = open(args.qc, "w") if args.qc else None
+    if qc_out:
+        qc_out.write("seq_id\tlength\tambig_frac\tgap_frac\tstops\tpassed\n")
+    with open(f"{prefix}.fasta", "w") as fa, open(f"{prefix}.ids", "w") as fi, \
+            open(f"{prefix}.labels", "w") as fl, open(f"{prefix}.metadata", "w") as fm, \
+            Pool(args.procs, initializer=init_worker,
+                 initargs=(permitidos, filtros, qc_out is not None)) as pool:
+        bloques = bloques_de_registros(args.fasta, BLOCK_BYTES)
+        for ids_ok, seqs_ok, n, descartes, qc_text in pool.imap(qc_bloque, bloques):
+            n_eval += n
+            for m in MOTIVOS:
+                motivos[m] += descartes[m]
+            if qc_out:
+                qc_out.write(qc_text)
+            filas = []
+            for sid, seq in zip(ids_ok, seqs_ok):
+                row = meta.get(sid)
+                if row is None:
+                    n_sin_meta += 1
+                else:
+                    filas.append((sid, seq, row))
+            fa.write("".join(f">{sid}\n{seq.decode('ascii')}\n" for sid, seq, _ in filas))
+            fi.write("".join(f"{sid}\n" for sid, _, _ in filas))
+            fl.write("".join(f"{sid}\t{row[1]}\n" for sid, _, row in filas))
+            fm.write("".join(f"{row[0]}\n" for _, _, row in filas))
+            n_ok += len(filas)
+    if qc_out:
+        qc_out.close()
+    dt = time.perf_counter() - t0
+
+    print(f"Secuencias evaluadas: {n_eval} en {dt:.1f} s ({n_eval / max(dt, 1e-9):.0f} secuencias/s)")
+    print(f"Descartadas por largo: {motivos['length']}, ambiguas: {motivos['ambig']}, "
+          f"gaps: {motivos['gap']}, stops: {motivos['stops']} (una secuencia puede sumar en varios)")
+    if n_sin_meta:
+        print(f"Aprobadas sin fila en la metadata (no se escriben): {n_sin_meta}")
+    print(f"Secuencias que pasan el filtro: {n_ok}")
+    print(f"Subconjunto escrito en: {prefix}.fasta, {prefix}.ids, {prefix}.labels, {prefix}.metadata")
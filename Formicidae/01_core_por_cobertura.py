@@ -1,7 +1,14 @@
 #!/usr/bin/env python3
 
+import importlib
 from collections import defaultdict
 
+import numpy as np
+
+from cache_resultados import CacheResultados, huella, huella_archivo
+
+barrido = importlib.import_module("12_barrido_parametros")
+
 # Configuración
 aln_file = "formicidae_core_aln.fasta"     # alineamiento recortado
 meta_file = "metadata_formicidae.tsv"      # metadata con seq_id y species
@@ -11,6 +18,8 @@ max_per_species = 20                       # máximo de secuencias por especie p
 windows_scores_out = "windows_scores.tsv"  # tabla con métricas por ventana
 best_barcode_aln_out = "formicidae_best_barcode_aln.fasta"
 best_barcode_ungapped_out = "formicidae_best_barcode.fasta"
+use_cache = True                           # reutilizar sumas por ventana ya calculadas (ver cache_resultados.py)
+tile_rows = 512                            # filas por bloque de distancias (memoria ~ tile_rows x secuencias)
 
 print(f"Usando alineamiento core: {aln_file}")
 print(f"Usando metadata: {meta_file}")
@@ -93,57 +102,48 @@ selected_indices = sorted(set(selected_indices))
 print(f"Especies totales en metadata/alineamiento: {len(species_to_indices)}")
 print(f"Secuencias seleccionadas para cálculo: {len(selected_indices)} (máx {max_per_species} por especie)")
 
-# 4) Función de distancia p (ignorando gaps)
-def p_distance(a, b):
-    dif, comp = 0, 0
-    for x, y in zip(a, b):
-        if x == "-" or y == "-":
-            continue
-        comp += 1
-        if x != y:
-            dif += 1
-    if comp == 0:
-        return 0.0
-    return dif / comp
-
-# 5) Sliding window y cálculo intra / inter
+# 4) Distancia p (ignorando gaps) vectorizada por bloques de filas
+sel_ids = [ids[i] for i in selected_indices]
+sel_species = [species_by_id[sid] for sid in sel_ids]
+n_sel = len(selected_indices)
+mat = np.frombuffer("".join(seqs[i] for i in selected_indices).encode("ascii"), dtype=np.uint8).reshape(n_sel, L)
+sp_code = {sp: k for k, sp in enumerate(sorted(set(sel_species)))}
+sp_sel = np.array([sp_code[sp] for sp in sel_species])
+
+
+def sumas_ventana(start, end):
+    """Sumas intra/inter en [start, end) sobre los pares seleccionados (ver 12_barrido_parametros.py)."""
+    return barrido.sumas_intra_inter(mat[:, start:end], sp_sel, tile_rows)
+
+
+# 5) Sliding window y cálculo intra / inter (sumas por ventana guardadas en cache)
+cache = CacheResultados() if use_cache else None
+aln_huella = huella_archivo(aln_file)
+sel_huella = huella([sel_ids, sel_species])
+
 results = []
 
 for start in range(0, L - win_size + 1, step):
     end = start + win_size
-    intra_dists = []
-    inter_dists = []
-
-    for i_idx in range(len(selected_indices)):
-        i = selected_indices[i_idx]
-        sid_i = ids[i]
-        sp_i = species_by_id.get(sid_i)
-        if sp_i is None:
-            continue
-        frag_i = seqs[i][start:end]
-
-        for j_idx in range(i_idx + 1, len(selected_indices)):
-            j = selected_indices[j_idx]
-            sid_j = ids[j]
-            sp_j = species_by_id.get(sid_j)
-            if sp_j is None:
-                continue
-            frag_j = seqs[j][start:end]
-            d = p_distance(frag_i, frag_j)
-            if sp_i == sp_j:
-                intra_dists.append(d)
-            else:
-                inter_dists.append(d)
-
-    if intra_dists and inter_dists:
-        mean_intra = sum(intra_dists) / len(intra_dists)
-        mean_inter = sum(inter_dists) / len(inter_dists)
+    if cache is not None:
+        clave = cache.clave("ventana_intra_inter", aln=aln_huella, seleccion=sel_huella, start=start, end=end)
+        sumas = cache.memo(clave, lambda: {"sumas": sumas_ventana(start, end)})["sumas"]
+    else:
+        sumas = sumas_ventana(start, end)
+    sum_intra, n_intra, sum_inter, n_inter = sumas
+
+    if n_intra and n_inter:
+        mean_intra = sum_intra / n_intra
+        mean_inter = sum_inter / n_inter
         ratio = mean_inter / (mean_intra + 1e-6)
         results.append((start, end, mean_intra, mean_inter, ratio))
         print(f"Ventana {start}-{end}: intra={mean_intra:.4f} inter={mean_inter:.4f} ratio={ratio:.2f}")
     else:
         print(f"Ventana {start}-{end}: sin suficientes datos (intra o inter vacíos)")
 
+if cache is not None:
+    print(cache.resumen())
+
 if not results:
     raise SystemExit("No se obtuvo ninguna ventana con datos intra e inter suficientes.")
 
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+"""
+Versión dispersa de 01_core_y_entropia.py para alineamientos dominados por gaps.
+
+En formicidae_col_stats.tsv casi todas las columnas del alineamiento completo
+tienen cobertura ~0.00005: guardar la matriz densa n x L es guardar gaps.
+Este script:
+1) Lee el FASTA alineado fila por fila y guarda SÓLO las celdas que no son gap
+   (formato CSR: por fila, las columnas y los símbolos no-gap).
+2) Calcula cobertura y entropía por columna con un bincount sobre esas celdas
+   (tiempo y memoria proporcionales al contenido no-gap, no al ancho L).
+3) Encuentra el bloque core con cobertura >= COVERAGE_THRESHOLD.
+4) Guarda una representación híbrida: matriz densa para las columnas core y
+   celdas dispersas para el resto, y escribe el core en FASTA y la tabla TSV
+   (mismos formatos que 01_core_y_entropia.py).
+"""
+
+import numpy as np
+
+# ==========================
+# CONFIGURACIÓN
+# ==========================
+
+ALN_FILE = "formicidae_ge600_aln.fasta"
+
+COVERAGE_THRESHOLD = 0.85
+
+CORE_OUT_FASTA = "formicidae_core_aln.fasta"
+COL_STATS_TSV = "formicidae_col_stats.tsv"
+HYBRID_OUT = "formicidae_aln_hibrido.npz"  # representación híbrida reutilizable
+
+GAP = ord("-")
+
+print(f"Usando alineamiento: {ALN_FILE}")
+print(f"Umbral de cobertura: {COVERAGE_THRESHOLD*100:.1f}%")
+
+# ==========================
+# 1) LEER EL ALINEAMIENTO EN FORMATO DISPERSO (CSR)
+# ==========================
+
+ids = []
+row_ptr = [0]      # row_ptr[i]:row_ptr[i+1] son las celdas de la fila i
+col_chunks = []    # columnas no-gap de cada fila
+base_chunks = []   # símbolos (bytes ASCII) de esas celdas
+L = None
+
+
+def agregar_fila(sid, seq):
+    global L
+    row = np.frombuffer(seq.encode("ascii"), dtype=np.uint8)
+    if L is None:
+        L = len(row)
+    elif len(row) != L:
+        raise SystemExit(f"ERROR: La secuencia {sid} tiene longitud {len(row)} distinta de {L}.")
+    cols = np.flatnonzero(row != GAP).astype(np.int32)
+    col_chunks.append(cols)
+    base_chunks.append(row[cols])
+    row_ptr.append(row_ptr[-1] + len(cols))
+
+
+with open(ALN_FILE) as f:
+    current_id = None
+    current_seq = []
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith(">"):
+            if current_id is not None:
+                agregar_fila(current_id, "".join(current_seq))
+            current_id = line[1:].split()[0]
+            ids.append(current_id)
+            current_seq = []
+        else:
+            current_seq.append(line)
+    if current_id is not None:
+        agregar_fila(current_id, "".join(current_seq))
+
+if not ids:
+    raise SystemExit("ERROR: No se leyeron secuencias del archivo de alineamiento.")
+
+n_seq = len(ids)
+row_ptr = np.array(row_ptr, dtype=np.int64)
+col_idx = np.concatenate(col_chunks)
+base_val = np.concatenate(base_chunks)
+row_of_cell = np.repeat(np.arange(n_seq, dtype=np.int32), np.diff(row_ptr))
+del col_chunks, base_chunks
+
+nnz = len(col_idx)
+print(f"Secuencias leídas: {n_seq}")
+print(f"Longitud del alineamiento: {L} columnas")
+print(f"Celdas no-gap: {nnz} de {n_seq * L} ({nnz / (n_seq * L):.2%})")
+
+# ==========================
+# 2) COBERTURA Y ENTROPÍA POR COLUMNA (SOBRE CELDAS NO-GAP)
+# ==========================
+
+# Conteos (columna, símbolo) con un solo bincount sobre las celdas no-gap.
+# Como en 01_core_y_entropia.py, cada símbolo cuenta tal cual ('a' y 'A' son
+# símbolos distintos).
+symbols, sym_code = np.unique(base_val, return_inverse=True)
+n_sym = len(symbols)
+counts = np.bincount(col_idx.astype(np.int64) * n_sym + sym_code, minlength=L * n_sym).reshape(L, n_sym)
+
+non_gap = counts.sum(axis=1)
+coverages = non_gap / n_seq
+
+p = np.divide(counts, non_gap[:, None], out=np.zeros(counts.shape), where=non_gap[:, None] > 0)
+logp = np.log2(p, out=np.zeros_like(p), where=p > 0)
+entropies = 0.0 - (p * logp).sum(axis=1)
+
+print(f"Entropía mínima por columna: {entropies.min():.3f}")
+print(f"Entropía máxima por columna: {entropies.max():.3f}")
+print(f"Entropía promedio por columna: {entropies.mean():.3f}")
+
+# ==========================
+# 3) ENCONTRAR EL BLOQUE CORE POR COBERTURA
+# ==========================
+
+good = np.concatenate(([False], coverages >= COVERAGE_THRESHOLD, [False]))
+edges = np.flatnonzero(np.diff(good.astype(np.int8)))
+run_starts, run_ends = edges[0::2], edges[1::2]
+
+if len(run_starts) == 0:
+    raise SystemExit(
+        "ERROR: No se encontró ningún bloque 'core' con la cobertura indicada. "
+        "Probá bajar COVERAGE_THRESHOLD (por ejemplo a 0.80)."
+    )
+
+# Primer bloque de largo máximo (mismo desempate que 01_core_y_entropia.py)
+k = int(np.argmax(run_ends - run_starts))
+best_start, best_end = int(run_starts[k]), int(run_ends[k])
+core_length = best_end - best_start
+
+print(f"Core encontrado: columnas {best_start} - {best_end} (longitud: {core_length})")
+print(f"Proporción de alineamiento conservada como core: {core_length / L:.2%}")
+
+# ==========================
+# 4) REPRESENTACIÓN HÍBRIDA: CORE DENSO + RESTO DISPERSO
+# ==========================
+
+in_core = (col_idx >= best_start) & (col_idx < best_end)
+
+core_dense = np.full((n_seq, core_length), GAP, dtype=np.uint8)
+core_dense[row_of_cell[in_core], col_idx[in_core] - best_start] = base_val[in_core]
+
+out_rows = row_of_cell[~in_core]
+out_cols = col_idx[~in_core]
+out_bases = base_val[~in_core]
+
+np.savez_compressed(
+    HYBRID_OUT,
+    ids=np.array(ids),
+    length=L,
+    core_start=best_start,
+    core_end=best_end,
+    core_dense=core_dense,
+    sparse_row=out_rows,
+    sparse_col=out_cols,
+    sparse_base=out_bases,
+)
+
+print(f"Representación híbrida guardada en: {HYBRID_OUT}")
+print(f"  core denso: {core_dense.nbytes / 1e6:.1f} MB, celdas dispersas fuera del core: {len(out_cols)}")
+
+# ==========================
+# 5) ESCRIBIR ALINEAMIENTO CORE
+# ==========================
+
+with open(CORE_OUT_FASTA, "w") as out:
+    for sid, row in zip(ids, core_dense):
+        out.write(f">{sid}\n{row.tobytes().decode('ascii')}\n")
+
+print(f"Alineamiento core escrito en: {CORE_OUT_FASTA}")
+
+# ==========================
+# 6) ESCRIBIR TABLA POR COLUMNA
+# ==========================
+
+with open(COL_STATS_TSV, "w") as out:
+    out.write("columna\tcoverage\tentropy\n")
+    for i, (cov, H) in enumerate(zip(coverages, entropies)):
+        out.write(f"{i}\t{cov:.5f}\t{H:.5f}\n")
+
+print(f"Tabla de cobertura y entropía por columna escrita en: {COL_STATS_TSV}")
+print("Listo. Ahora podés mirar el core y analizar las columnas/ventanas más informativas.")
@@ -8,13 +8,23 @@ y calcula ventanas deslizantes con:
 
 Devuelve las mejores ventanas según entropía media,
 filtrando por una cobertura media mínima.
+
+Las medias de todas las ventanas (antes del filtro de cobertura) se guardan
+en el cache de cache_resultados.py, con clave en el contenido del archivo de
+stats (su sha256, así que el archivo se lee entero para hashearlo en cada
+corrida), WIN_SIZE y STEP: si sólo cambia MIN_MEAN_COV no se vuelven a parsear
+las columnas ni a calcular las medias. Es una sola entrada para todas las
+ventanas; una por ventana costaría más en disco que calcular la media.
 """
 
+from cache_resultados import CacheResultados, huella_archivo
+
 STATS_FILE = "formicidae_col_stats.tsv"
 
 WIN_SIZE = 100       # tamaño de ventana en columnas
 STEP = 20            # paso entre ventanas
 MIN_MEAN_COV = 0.70  # cobertura media mínima para considerar una ventana
+USE_CACHE = True     # reutilizar las medias por ventana ya calculadas
 
 OUT_FILE = "ventanas_entropy_coverage.tsv"
 
@@ -22,42 +32,61 @@ print(f"Usando archivo de stats: {STATS_FILE}")
 print(f"Tamaño de ventana: {WIN_SIZE}, paso: {STEP}")
 print(f"Cobertura media mínima: {MIN_MEAN_COV}")
 
-# 1) Leer stats por columna
-cols = []
-covs = []
-ents = []
-
-with open(STATS_FILE) as f:
-    header = f.readline().strip().split("\t")
-    # esperamos: columna\tcoverage\tentropy
-    for line in f:
-        if not line.strip():
-            continue
-        c, cov, ent = line.strip().split("\t")
-        cols.append(int(c))
-        covs.append(float(cov))
-        ents.append(float(ent))
-
-if not cols:
-    raise SystemExit("No se pudieron leer datos de formicidae_col_stats.tsv")
-
-n = len(cols)
-print(f"Columnas leídas: {n}")
-
-# 2) Sliding window
-windows = []
-
-for start_idx in range(0, n - WIN_SIZE + 1, STEP):
-    end_idx = start_idx + WIN_SIZE  # índice exclusivo
-    win_cov = covs[start_idx:end_idx]
-    win_ent = ents[start_idx:end_idx]
-    mean_cov = sum(win_cov) / len(win_cov)
-    mean_ent = sum(win_ent) / len(win_ent)
-
-    if mean_cov >= MIN_MEAN_COV:
-        col_start = cols[start_idx]
-        col_end = cols[end_idx - 1]
-        windows.append((col_start, col_end, mean_cov, mean_ent))
+
+def medias_por_ventana():
+    # 1) Leer stats por columna
+    cols = []
+    covs = []
+    ents = []
+
+    with open(STATS_FILE) as f:
+        header = f.readline().strip().split("\t")
+        # esperamos: columna\tcoverage\tentropy
+        for line in f:
+            if not line.strip():
+                continue
+            c, cov, ent = line.strip().split("\t")
+            cols.append(int(c))
+            covs.append(float(cov))
+            ents.append(float(ent))
+
+    if not cols:
+        raise SystemExit("No se pudieron leer datos de formicidae_col_stats.tsv")
+
+    n = len(cols)
+    print(f"Columnas leídas: {n}")
+
+    # 2) Sliding window (todas las ventanas; el filtro de cobertura va después)
+    col_starts, col_ends, mean_covs, mean_ents = [], [], [], []
+    for start_idx in range(0, n - WIN_SIZE + 1, STEP):
+        end_idx = start_idx + WIN_SIZE  # índice exclusivo
+        win_cov = covs[start_idx:end_idx]
+        win_ent = ents[start_idx:end_idx]
+        col_starts.append(cols[start_idx])
+        col_ends.append(cols[end_idx - 1])
+        mean_covs.append(sum(win_cov) / len(win_cov))
+        mean_ents.append(sum(win_ent) / len(win_ent))
+
+    return {
+        "col_start": col_starts,
+        "col_end": col_ends,
+        "mean_cov": mean_covs,
+        "mean_ent": mean_ents,
+    }
+
+
+cache = CacheResultados() if USE_CACHE else None
+if cache is not None:
+    clave = cache.clave("ventanas_entropia", stats=huella_archivo(STATS_FILE), win=WIN_SIZE, step=STEP)
+    medias = cache.memo(clave, medias_por_ventana)
+else:
+    medias = medias_por_ventana()
+
+windows = [
+    (int(cs), int(ce), float(mc), float(me))
+    for cs, ce, mc, me in zip(medias["col_start"], medias["col_end"], medias["mean_cov"], medias["mean_ent"])
+    if mc >= MIN_MEAN_COV
+]
 
 # 3) Ordenar por entropía media (descendente)
 windows.sort(key=lambda x: x[3], reverse=True)
@@ -76,3 +105,6 @@ print(f"Resultados escritos en: {OUT_FILE}")
 print("Top 10 ventanas:")
 for (cs, ce, mc, me) in windows[:10]:
     print(f"  {cs}-{ce}  cov={mc:.3f}  H={me:.3f}")
+
+if cache is not None:
+    print(cache.resumen())
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+"""
+Script para:
+1) Leer un alineamiento (core) y la especie de cada secuencia.
+2) Construir UNA sola vez el tensor de conteos columna x especie x base.
+3) Derivar por columna, a partir de ese tensor:
+   - cobertura y entropía de Shannon (como 01_core_y_entropia.py),
+   - entropía condicional dada la especie H(B|S),
+   - información mutua con la especie I(B;S) = H(B) - H(B|S),
+   - diversidad de Simpson (1 - sum p^2).
+4) Rankear ventanas deslizantes por información mutua media (sumas prefijas).
+
+A diferencia de la entropía, la información mutua mide cuánto dice la columna
+sobre la especie: una columna muy variable dentro de cada especie tiene
+entropía alta pero información mutua baja.
+"""
+
+import numpy as np
+
+# ==========================
+# CONFIGURACIÓN
+# ==========================
+
+ALN_FILE = "formicidae_core_aln.fasta"
+META_FILE = "Formicidae.metadata.tsv"   # metadata con columnas seq_id y species
+
+WINDOW_SIZES = [30, 40, 50, 60]  # tamaños de ventana (columnas)
+STEP = 1                         # paso entre ventanas
+MIN_MEAN_COV = 0.70              # cobertura media mínima de la ventana
+
+COL_BLOCK = 256  # columnas por bloque al contar (acota la memoria del tensor)
+
+COL_INFO_TSV = "formicidae_col_info.tsv"
+WINDOWS_OUT = "ventanas_info_mutua.tsv"
+
+BASES = "ACGT"
+
+print(f"Usando alineamiento: {ALN_FILE}")
+print(f"Usando metadata: {META_FILE}")
+print(f"Tamaños de ventana: {WINDOW_SIZES}, paso: {STEP}")
+print(f"Cobertura media mínima: {MIN_MEAN_COV}")
+
+# ==========================
+# 1) LEER METADATA Y ALINEAMIENTO
+# ==========================
+
+species_by_id = {}
+with open(META_FILE) as meta:
+    header = meta.readline().rstrip("\n").split("\t")
+    try:
+        id_idx = header.index("seq_id")
+        sp_idx = header.index("species")
+    except ValueError:
+        raise SystemExit("ERROR: La metadata debe tener columnas 'seq_id' y 'species' separadas por TAB.")
+    for line in meta:
+        if not line.strip():
+            continue
+        cols = line.rstrip("\n").split("\t")
+        if len(cols) <= max(id_idx, sp_idx):
+            continue
+        species_by_id[cols[id_idx]] = cols[sp_idx]
+
+ids = []
+seqs = []
+
+with open(ALN_FILE) as f:
+    current_id = None
+    current_seq = []
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith(">"):
+            if current_id is not None:
+                seqs.append("".join(current_seq))
+            current_id = line[1:].split()[0]
+            ids.append(current_id)
+            current_seq = []
+        else:
+            current_seq.append(line)
+    if current_id is not None:
+        seqs.append("".join(current_seq))
+
+if not seqs:
+    raise SystemExit("ERROR: No se leyeron secuencias del archivo de alineamiento.")
+
+n_seq = len(seqs)
+L = len(seqs[0])
+
+for sid, s in zip(ids, seqs):
+    if len(s) != L:
+        raise SystemExit(f"ERROR: La secuencia {sid} tiene longitud {len(s)} distinta de {L}.")
+
+print(f"Secuencias leídas: {n_seq}")
+print(f"Longitud del alineamiento: {L} columnas")
+
+# ==========================
+# 2) CODIFICAR
+# ==========================
+
+# Bases -> 0..3 (A, C, G, T); N/IUPAC -> 4; gap -> 5.
+# La cobertura cuenta todo lo que no es gap (como en 01_core_y_entropia.py);
+# las entropías y la información mutua usan sólo A/C/G/T.
+N_SYM = 6
+lut = np.full(256, 4, dtype=np.uint8)
+for code, b in enumerate(BASES):
+    lut[ord(b)] = code
+    lut[ord(b.lower())] = code
+lut[ord("-")] = 5
+lut[ord(".")] = 5
+
+matrix = lut[np.frombuffer("".join(seqs).encode("ascii"), dtype=np.uint8)].reshape(n_seq, L)
+
+# Especie -> 0..S-1; las secuencias sin especie van a un grupo extra (S) que
+# cuenta para cobertura/entropía pero no para la información mutua.
+species_names = sorted({species_by_id[sid] for sid in ids if sid in species_by_id})
+species_code = {sp: k for k, sp in enumerate(species_names)}
+S = len(species_names)
+sp_of_seq = np.array([species_code.get(species_by_id.get(sid), S) for sid in ids], dtype=np.int64)
+
+print(f"Especies: {S}  (secuencias sin especie: {int((sp_of_seq == S).sum())})")
+
+if S < 2:
+    raise SystemExit("ERROR: Hacen falta al menos 2 especies para calcular información mutua.")
+
+# ==========================
+# 3) TENSOR DE CONTEOS Y ESTADÍSTICAS POR COLUMNA
+# ==========================
+
+def entropia_bits(counts, axis=-1):
+    """
+    Entropía de Shannon (bits) de conteos a lo largo de 'axis'.
+    Filas con total 0 devuelven 0.
+    """
+    total = counts.sum(axis=axis, keepdims=True)
+    p = np.divide(counts, total, out=np.zeros(counts.shape), where=total > 0)
+    logp = np.log2(p, out=np.zeros_like(p), where=p > 0)
+    return 0.0 - (p * logp).sum(axis=axis)
+
+
+def stats_desde_tensor(tensor, n_total):
+    """
+    tensor: conteos (columnas, especies + 1, N_SYM) con la última especie = sin
+    etiqueta. Devuelve cobertura, H, H(B|S), I(B;S) y Simpson por columna.
+    """
+    coverage = (n_total - tensor[:, :, 5].sum(axis=1)) / n_total
+    acgt_all = tensor[:, :, :4].sum(axis=1)          # (cols, 4)
+    n_acgt = acgt_all.sum(axis=1)                    # (cols,)
+    H = entropia_bits(acgt_all)
+
+    p = np.divide(acgt_all, n_acgt[:, None], out=np.zeros(acgt_all.shape), where=n_acgt[:, None] > 0)
+    simpson = np.where(n_acgt > 0, 1.0 - (p ** 2).sum(axis=1), 0.0)
+
+    # Sólo secuencias con especie conocida para la parte condicional
+    lab = tensor[:, :-1, :4]                         # (cols, S, 4)
+    n_sp = lab.sum(axis=2)                           # (cols, S)
+    n_lab = n_sp.sum(axis=1)                         # (cols,)
+    H_lab = entropia_bits(lab.sum(axis=1))
+    H_cond_sp = entropia_bits(lab)                   # (cols, S)
+    w = np.divide(n_sp, n_lab[:, None], out=np.zeros(n_sp.shape), where=n_lab[:, None] > 0)
+    H_cond = (w * H_cond_sp).sum(axis=1)
+    mi = np.maximum(H_lab - H_cond, 0.0)
+    return coverage, H, H_cond, mi, simpson
+
+
+coverages = np.empty(L)
+entropies = np.empty(L)
+cond_entropies = np.empty(L)
+mutual_infos = np.empty(L)
+simpsons = np.empty(L)
+
+# Un solo recorrido de conteo: para cada bloque de columnas, un bincount sobre
+# (columna, especie, base) de todas las celdas.
+for c0 in range(0, L, COL_BLOCK):
+    c1 = min(c0 + COL_BLOCK, L)
+    width = c1 - c0
+    block = matrix[:, c0:c1].astype(np.int64)
+    keys = (np.arange(width)[None, :] * (S + 1) + sp_of_seq[:, None]) * N_SYM + block
+    tensor = np.bincount(keys.ravel(), minlength=width * (S + 1) * N_SYM).reshape(width, S + 1, N_SYM)
+    (coverages[c0:c1], entropies[c0:c1], cond_entropies[c0:c1],
+     mutual_infos[c0:c1], simpsons[c0:c1]) = stats_desde_tensor(tensor, n_seq)
+
+print(f"Información mutua máxima por columna: {mutual_infos.max():.3f} bits (columna {int(mutual_infos.argmax())})")
+print(f"Información mutua promedio por columna: {mutual_infos.mean():.3f} bits")
+
+with open(COL_INFO_TSV, "w") as out:
+    out.write("columna\tcoverage\tentropy\tcond_entropy\tmutual_info\tsimpson\n")
+    for i in range(L):
+        out.write(
+            f"{i}\t{coverages[i]:.5f}\t{entropies[i]:.5f}\t{cond_entropies[i]:.5f}\t"
+            f"{mutual_infos[i]:.5f}\t{simpsons[i]:.5f}\n"
+        )
+
+print(f"Tabla de información por columna escrita en: {COL_INFO_TSV}")
+
+# ==========================
+# 4) VENTANAS DESLIZANTES (SUMAS PREFIJAS)
+# ==========================
+
+def prefijo(x):
+    return np.concatenate(([0.0], np.cumsum(x)))
+
+pref = {
+    "cov": prefijo(coverages),
+    "H": prefijo(entropies),
+    "Hc": prefijo(cond_entropies),
+    "MI": prefijo(mutual_infos),
+    "simpson": prefijo(simpsons),
+}
+
+windows = []
+for WIN in WINDOW_SIZES:
+    if WIN > L:
+        print(f"Ventana de {WIN} columnas es mayor que la longitud ({L}), se omite.")
+        continue
+    starts = np.arange(0, L - WIN + 1, STEP)
+    ends = starts + WIN
+    means = {k: (v[ends] - v[starts]) / WIN for k, v in pref.items()}
+    keep = means["cov"] >= MIN_MEAN_COV
+    for j in np.nonzero(keep)[0]:
+        windows.append((
+            int(starts[j]), int(ends[j]), WIN,
+            means["cov"][j], means["H"][j], means["Hc"][j], means["MI"][j], means["simpson"][j],
+        ))
+
+if not windows:
+    raise SystemExit("No hay ninguna ventana que cumpla el criterio de cobertura. Probá bajar MIN_MEAN_COV.")
+
+# Ordenar por información mutua media (descendente)
+windows.sort(key=lambda x: x[6], reverse=True)
+
+with open(WINDOWS_OUT, "w") as out:
+    out.write("start\tend\twin_size\tmean_coverage\tmean_entropy\tmean_cond_entropy\tmean_mutual_info\tmean_simpson\n")
+    for (s, e, w, mc, mh, mhc, mmi, msi) in windows:
+        out.write(f"{s}\t{e}\t{w}\t{mc:.5f}\t{mh:.5f}\t{mhc:.5f}\t{mmi:.5f}\t{msi:.5f}\n")
+
+print(f"Ventanas escritas en: {WINDOWS_OUT}")
+
+print("Top 10 ventanas por información mutua media:")
+for (s, e, w, mc, mh, mhc, mmi, msi) in windows[:10]:
+    print(f"  {s}-{e}  (len={w})  MI={mmi:.4f}  H={mh:.4f}  H|sp={mhc:.4f}  cov={mc:.3f}")
@@ -0,0 +1,466 @@
+#!/usr/bin/env python3
+
+"""
+Actualización incremental de estadísticas por columna y puntajes de ventana.
+
+En vez de correr de nuevo 01_core_y_entropia.py, 02_ventanas_entropy_coverage.py
+y 05_informacion_por_columna.py cada vez que llegan secuencias nuevas, se guarda
+un estado con:
+- los IDs ordenados (con la especie y una huella del contenido de cada uno),
+  para ubicar un ID del lote con búsqueda binaria y comprobar al quitarlo
+  que la secuencia es la misma que se sumó,
+- conteos por columna y símbolo: cada byte por separado, como en
+  01_core_y_entropia.py ('a', 'A' y 'N' son símbolos distintos), y A/C/G/T de
+  las secuencias etiquetadas,
+- el tensor disperso columna x especie x base (claves ordenadas y valores),
+- los acumulados T1 = sum_s n_s log n_s y T2 = sum_{s,b} n_sb log n_sb por
+  columna, con los que H(B|S) = (T1 - T2) / N sin recorrer las especies.
+
+Todo se guarda como arrays: cargar el estado no arma diccionarios ni conjuntos,
+y sumar o restar un lote hace búsquedas binarias sólo para las claves del
+lote (el trabajo en Python es O(lote)). Insertar y borrar en los arrays
+ordenados y reescribir el .npz sí copian el estado entero: son copias de
+memoria en C, O(estado) en bytes, no recorridos en Python.
+Después se reescriben en O(L):
+- formicidae_col_stats.tsv (mismo formato y valores que 01_core_y_entropia.py),
+- ventanas_entropy_coverage.tsv (como 02_ventanas_entropy_coverage.py),
+- ventanas_info_mutua_incremental.tsv: las columnas de ventanas_info_mutua.tsv
+  de 05_informacion_por_columna.py, pero con coordenadas de ALN_FILE (el
+  alineamiento completo, no el core), por eso va en otro archivo.
+
+Uso:
+  python 06_actualizacion_incremental.py init
+  python 06_actualizacion_incremental.py add nuevas_aln.fasta [--meta nuevas.metadata.tsv]
+  python 06_actualizacion_incremental.py remove quitar_aln.fasta
+"""
+
+import argparse
+import hashlib
+import os
+
+import numpy as np
+
+# ==========================
+# CONFIGURACIÓN
+# ==========================
+
+ALN_FILE = "formicidae_ge600_aln.fasta"
+META_FILE = "Formicidae.metadata.tsv"   # metadata con columnas seq_id y species
+STATE_FILE = "formicidae_estado_incremental.npz"
+
+COL_STATS_TSV = "formicidae_col_stats.tsv"
+
+# Como en 02_ventanas_entropy_coverage.py
+WIN_SIZE = 100
+STEP = 20
+MIN_MEAN_COV = 0.70
+WINDOWS_ENTROPY_OUT = "ventanas_entropy_coverage.tsv"
+
+# Como en 05_informacion_por_columna.py
+MI_WINDOW_SIZES = [30, 40, 50, 60]
+MI_STEP = 1
+MI_WINDOWS_OUT = "ventanas_info_mutua_incremental.tsv"
+
+BASES = "ACGT"
+N_SYM = 6     # A, C, G, T, otro (N/IUPAC), gap (para la parte por especie)
+GAP_CODE = 5
+GAP_BYTE = ord("-")
+
+# ==========================
+# FUNCIONES AUXILIARES
+# ==========================
+
+def leer_fasta(path):
+    ids = []
+    seqs = []
+    with open(path) as f:
+        current_id = None
+        current_seq = []
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith(">"):
+                if current_id is not None:
+                    seqs.append("".join(current_seq))
+                current_id = line[1:].split()[0]
+                ids.append(current_id)
+                current_seq = []
+            else:
+                current_seq.append(line)
+        if current_id is not None:
+            seqs.append("".join(current_seq))
+    return ids, seqs
+
+
+def leer_especies(path):
+    species_by_id = {}
+    with open(path) as meta:
+        header = meta.readline().rstrip("\n").split("\t")
+        try:
+            id_idx = header.index("seq_id")
+            sp_idx = header.index("species")
+        except ValueError:
+            raise SystemExit(f"ERROR: {path} debe tener columnas 'seq_id' y 'species' separadas por TAB.")
+        for line in meta:
+            if not line.strip():
+                continue
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) <= max(id_idx, sp_idx):
+                continue
+            species_by_id[cols[id_idx]] = cols[sp_idx]
+    return species_by_id
+
+
+LUT = np.full(256, 4, dtype=np.uint8)
+for _code, _b in enumerate(BASES):
+    LUT[ord(_b)] = _code
+    LUT[ord(_b.lower())] = _code
+LUT[ord("-")] = GAP_CODE
+LUT[ord(".")] = GAP_CODE
+
+
+def codificar(ids, seqs, L):
+    """Bytes (n, L) del lote; LUT[...] da los códigos A/C/G/T/otro/gap."""
+    for sid, s in zip(ids, seqs):
+        if len(s) != L:
+            raise SystemExit(f"ERROR: La secuencia {sid} tiene longitud {len(s)} distinta de {L}.")
+        if not s.isascii():
+            raise SystemExit(f"ERROR: La secuencia {sid} tiene caracteres no ASCII.")
+    return np.frombuffer("".join(seqs).encode("ascii"), dtype=np.uint8).reshape(len(seqs), L)
+
+
+def xlog2x(x):
+    x = np.asarray(x, dtype=np.float64)
+    return np.where(x > 0, x * np.log2(np.where(x > 0, x, 1.0)), 0.0)
+
+
+def entropia_bits(counts):
+    total = counts.sum(axis=1, keepdims=True)
+    p = np.divide(counts, total, out=np.zeros(counts.shape), where=total > 0)
+    logp = np.log2(p, out=np.zeros_like(p), where=p > 0)
+    return 0.0 - (p * logp).sum(axis=1)
+
+
+def estado_vacio(L):
+    return {
+        "L": L,
+        "ids": np.array([], dtype=str),          # ordenados
+        "sp": np.array([], dtype=np.int64),      # especie de cada ID (-1 = sin especie)
+        "hash": np.array([], dtype=np.uint64),   # huella de la secuencia de cada ID
+        "species_names": [],
+        "sym_counts": np.zeros((L, 256), dtype=np.int64),
+        "lab_counts": np.zeros((L, N_SYM), dtype=np.int64),
+        "tensor": (np.array([], dtype=np.int64), np.array([], dtype=np.int64)),  # (sp * L + col) * 4 + base -> n_sb
+        "sp_col": (np.array([], dtype=np.int64), np.array([], dtype=np.int64)),  # sp * L + col -> n_s (A/C/G/T)
+        "T1": np.zeros(L),
+        "T2": np.zeros(L),
+    }
+
+
+def cargar_estado(path):
+    d = np.load(path, allow_pickle=False)
+    if "sym_counts" not in d.files or "hash" not in d.files:
+        raise SystemExit(f"ERROR: {path} es de una versión anterior del estado; correr de nuevo el modo 'init'.")
+    return {
+        "L": int(d["L"]),
+        "ids": d["ids"],
+        "sp": d["sp"],
+        "hash": d["hash"],
+        "species_names": d["species_names"].tolist(),
+        "sym_counts": d["sym_counts"],
+        "lab_counts": d["lab_counts"],
+        "tensor": (d["tensor_keys"], d["tensor_vals"]),
+        "sp_col": (d["spcol_keys"], d["spcol_vals"]),
+        "T1": d["T1"],
+        "T2": d["T2"],
+    }
+
+
+def guardar_estado(state, path):
+    tmp = path + ".tmp.npz"
+    np.savez(
+        tmp,
+        L=state["L"],
+        ids=state["ids"],
+        sp=state["sp"],
+        hash=state["hash"],
+        species_names=np.array(state["species_names"], dtype=str),
+        sym_counts=state["sym_counts"],
+        lab_counts=state["lab_counts"],
+        tensor_keys=state["tensor"][0],
+        tensor_vals=state["tensor"][1],
+        spcol_keys=state["sp_col"][0],
+        spcol_vals=state["sp_col"][1],
+        T1=state["T1"],
+        T2=state["T2"],
+    )
+    os.replace(tmp, path)  # reemplazo atómico: un corte no deja el estado a medias
+
+
+def buscar_ordenado(sorted_arr, values):
+    """Posición de cada valor en 'sorted_arr' (búsqueda binaria) y si está."""
+    pos = np.searchsorted(sorted_arr, values)
+    found = np.zeros(len(values), dtype=bool)
+    dentro = pos < len(sorted_arr)
+    found[dentro] = sorted_arr[pos[dentro]] == values[dentro]
+    return pos, found
+
+
+def actualizar_dispersos(store, keys, deltas, col_of_key, acc, L):
+    """
+    Suma 'deltas' a las entradas 'keys' (únicas y ordenadas) de 'store' =
+    (claves ordenadas, valores) y actualiza el acumulado por columna
+    acc += x log x (nuevo) - x log x (viejo). Devuelve el nuevo 'store'.
+    """
+    sk, sv = store
+    pos, found = buscar_ordenado(sk, keys)
+    old = np.zeros(len(keys), dtype=np.int64)
+    old[found] = sv[pos[found]]
+    new = old + deltas
+    if (new < 0).any():
+        raise SystemExit("ERROR: El lote a quitar no coincide con el contenido del estado.")
+    acc += np.bincount(col_of_key, weights=xlog2x(new) - xlog2x(old), minlength=L)
+
+    sv = sv.copy()
+    sv[pos[found]] = new[found]
+    borrar = pos[found & (new == 0)]
+    sk, sv = np.delete(sk, borrar), np.delete(sv, borrar)
+    nuevas = ~found & (new > 0)
+    ins = np.searchsorted(sk, keys[nuevas])
+    return np.insert(sk, ins, keys[nuevas]), np.insert(sv, ins, new[nuevas])
+
+
+def huellas(raw):
+    """Huella de 64 bits del contenido de cada fila del lote."""
+    return np.array([int.from_bytes(hashlib.blake2b(row.tobytes(), digest_size=8).digest(), "little")
+                     for row in raw], dtype=np.uint64)
+
+
+def insertar_ids(state, ids, sp_codes, hashes):
+    """Agrega IDs nuevos (no presentes) manteniendo 'ids' ordenado."""
+    order = np.argsort(ids, kind="stable")
+    ids, sp_codes, hashes = ids[order], sp_codes[order], hashes[order]
+    width = max(state["ids"].itemsize, ids.itemsize, 4) // 4
+    actuales = state["ids"].astype(f"<U{width}")
+    ins = np.searchsorted(actuales, ids)
+    state["ids"] = np.insert(actuales, ins, ids)
+    state["sp"] = np.insert(state["sp"], ins, sp_codes)
+    state["hash"] = np.insert(state["hash"], ins, hashes)
+
+
+def aplicar_lote(state, raw, sp_codes, signo):
+    """
+    Suma (signo=+1) o resta (signo=-1) un lote (bytes de codificar). Costo
+    proporcional a las celdas del lote, no al tamaño del estado.
+    """
+    L = state["L"]
+    n_rows = raw.shape[0]
+    sym_keys = (np.arange(L, dtype=np.int64)[None, :] * 256 + raw).ravel()
+    state["sym_counts"] += signo * np.bincount(sym_keys, minlength=L * 256).reshape(L, 256)
+    if signo < 0 and (state["sym_counts"] < 0).any():
+        raise SystemExit("ERROR: El lote a quitar no coincide con el contenido del estado.")
+    matrix = LUT[raw]
+
+    labeled = sp_codes >= 0
+    print(f"  {'Sumadas' if signo > 0 else 'Restadas'} {n_rows} secuencias ({int(labeled.sum())} con especie)")
+    if not labeled.any():
+        return
+    sub = matrix[labeled]
+    sub_sp = sp_codes[labeled].astype(np.int64)
+    lab_keys = (np.arange(L, dtype=np.int64)[None, :] * N_SYM + sub).ravel()
+    state["lab_counts"] += signo * np.bincount(lab_keys, minlength=L * N_SYM).reshape(L, N_SYM)
+    if signo < 0 and (state["lab_counts"] < 0).any():
+        raise SystemExit("ERROR: El lote a quitar no coincide con el contenido del estado.")
+
+    r, c = np.nonzero(sub < 4)
+    keys = (sub_sp[r] * L + c) * 4 + sub[r, c]
+    uk, cnt = np.unique(keys, return_counts=True)
+    state["tensor"] = actualizar_dispersos(state["tensor"], uk, signo * cnt, (uk // 4) % L, state["T2"], L)
+
+    usc, inv = np.unique(uk // 4, return_inverse=True)
+    sc_cnt = np.bincount(inv, weights=cnt).astype(np.int64)
+    state["sp_col"] = actualizar_dispersos(state["sp_col"], usc, signo * sc_cnt, usc % L, state["T1"], L)
+
+
+def codigos_especie(state, ids, species_by_id):
+    """Código de especie por ID; las especies nuevas se agregan al final."""
+    code = {sp: k for k, sp in enumerate(state["species_names"])}
+    out = np.full(len(ids), -1, dtype=np.int64)
+    for i, sid in enumerate(ids):
+        sp = species_by_id.get(sid)
+        if sp is None:
+            continue
+        if sp not in code:
+            code[sp] = len(state["species_names"])
+            state["species_names"].append(sp)
+        out[i] = code[sp]
+    return out
+
+# ==========================
+# SALIDAS (O(L))
+# ==========================
+
+def prefijo(x):
+    return np.concatenate(([0.0], np.cumsum(x)))
+
+
+def escribir_salidas(state):
+    L = state["L"]
+    n_seq = len(state["ids"])
+    if n_seq == 0:
+        raise SystemExit("ERROR: El estado quedó sin secuencias.")
+
+    # Cobertura y entropía como 01_core_y_entropia.py: todo símbolo no gap
+    # cuenta, cada byte por separado
+    cc = state["sym_counts"]
+    coverages = (n_seq - cc[:, GAP_BYTE]) / n_seq
+    entropies = entropia_bits(np.delete(cc, GAP_BYTE, axis=1))
+
+    # Entropía y Simpson sólo con A/C/G/T, como 05_informacion_por_columna.py
+    acgt = np.column_stack([cc[:, ord(b)] + cc[:, ord(b.lower())] for b in BASES])
+    n_acgt = acgt.sum(axis=1)
+    H_acgt = entropia_bits(acgt)
+    p_acgt = np.divide(acgt, n_acgt[:, None], out=np.zeros(acgt.shape), where=n_acgt[:, None] > 0)
+    simpsons = np.where(n_acgt > 0, 1.0 - (p_acgt ** 2).sum(axis=1), 0.0)
+
+    lab = state["lab_counts"][:, :4]
+    n_lab = lab.sum(axis=1)
+    H_lab = entropia_bits(lab)
+    H_cond = np.divide(state["T1"] - state["T2"], n_lab, out=np.zeros(L), where=n_lab > 0)
+    H_cond = np.maximum(H_cond, 0.0)
+    mutual_infos = np.maximum(H_lab - H_cond, 0.0)
+
+    with open(COL_STATS_TSV, "w") as out:
+        out.write("columna\tcoverage\tentropy\n")
+        for i in range(L):
+            out.write(f"{i}\t{coverages[i]:.5f}\t{entropies[i]:.5f}\n")
+    print(f"Tabla por columna escrita en: {COL_STATS_TSV}")
+
+    pref_cov = prefijo(coverages)
+    pref_H = prefijo(entropies)
+    pref_Hacgt = prefijo(H_acgt)
+    pref_Hc = prefijo(H_cond)
+    pref_MI = prefijo(mutual_infos)
+    pref_Si = prefijo(simpsons)
+
+    # Ventanas de 02_ventanas_entropy_coverage.py (col_end inclusivo)
+    windows = []
+    if WIN_SIZE <= L:
+        starts = np.arange(0, L - WIN_SIZE + 1, STEP)
+        mc = (pref_cov[starts + WIN_SIZE] - pref_cov[starts]) / WIN_SIZE
+        me = (pref_H[starts + WIN_SIZE] - pref_H[starts]) / WIN_SIZE
+        for j in np.nonzero(mc >= MIN_MEAN_COV)[0]:
+            windows.append((int(starts[j]), int(starts[j]) + WIN_SIZE - 1, mc[j], me[j]))
+    windows.sort(key=lambda x: x[3], reverse=True)
+    with open(WINDOWS_ENTROPY_OUT, "w") as out:
+        out.write("col_start\tcol_end\tmean_coverage\tmean_entropy\n")
+        for (cs, ce, mc_, me_) in windows:
+            out.write(f"{cs}\t{ce}\t{mc_:.5f}\t{me_:.5f}\n")
+    print(f"Ventanas por entropía escritas en: {WINDOWS_ENTROPY_OUT} ({len(windows)} ventanas)")
+
+    # Ranking por información mutua de 05_informacion_por_columna.py
+    mi_windows = []
+    for WIN in MI_WINDOW_SIZES:
+        if WIN > L:
+            continue
+        starts = np.arange(0, L - WIN + 1, MI_STEP)
+        ends = starts + WIN
+        mc = (pref_cov[ends] - pref_cov[starts]) / WIN
+        mh = (pref_Hacgt[ends] - pref_Hacgt[starts]) / WIN
+        mhc = (pref_Hc[ends] - pref_Hc[starts]) / WIN
+        mmi = (pref_MI[ends] - pref_MI[starts]) / WIN
+        msi = (pref_Si[ends] - pref_Si[starts]) / WIN
+        for j in np.nonzero(mc >= MIN_MEAN_COV)[0]:
+            mi_windows.append((int(starts[j]), int(ends[j]), WIN, mc[j], mh[j], mhc[j], mmi[j], msi[j]))
+    mi_windows.sort(key=lambda x: x[6], reverse=True)
+    with open(MI_WINDOWS_OUT, "w") as out:
+        out.write("start\tend\twin_size\tmean_coverage\tmean_entropy\tmean_cond_entropy\tmean_mutual_info\t"
+                  "mean_simpson\n")
+        for (s, e, w, mc_, mh_, mhc_, mmi_, msi_) in mi_windows:
+            out.write(f"{s}\t{e}\t{w}\t{mc_:.5f}\t{mh_:.5f}\t{mhc_:.5f}\t{mmi_:.5f}\t{msi_:.5f}\n")
+    print(f"Ranking por información mutua escrito en: {MI_WINDOWS_OUT} ({len(mi_windows)} ventanas)")
+
+    if mi_windows:
+        s, e, w, mc_, mh_, mhc_, mmi_, msi_ = mi_windows[0]
+        print(f"Mejor ventana por información mutua: {s}-{e} (len={w})  MI={mmi_:.4f}  cov={mc_:.3f}")
+
+# ==========================
+# PROGRAMA PRINCIPAL
+# ==========================
+
+parser = argparse.ArgumentParser(description="Estadísticas por columna y ventanas con actualización incremental.")
+parser.add_argument("modo", choices=["init", "add", "remove"])
+parser.add_argument("fasta", nargs="?", help="lote alineado (add/remove); por defecto ALN_FILE en init")
+parser.add_argument("--meta", default=None, help="metadata extra con seq_id/species para el lote")
+parser.add_argument("--state", default=STATE_FILE)
+args = parser.parse_args()
+
+species_by_id = leer_especies(META_FILE) if os.path.exists(META_FILE) else {}
+if args.meta:
+    species_by_id.update(leer_especies(args.meta))
+
+if args.modo == "init":
+    aln = args.fasta or ALN_FILE
+    print(f"Construyendo estado desde: {aln}")
+    ids, seqs = leer_fasta(aln)
+    if not seqs:
+        raise SystemExit("ERROR: No se leyeron secuencias del archivo de alineamiento.")
+    state = estado_vacio(len(seqs[0]))
+    _, first = np.unique(np.array(ids, dtype=str), return_index=True)
+    if len(first) < len(ids):
+        print(f"  Aviso: {len(ids) - len(first)} IDs repetidos; se usa la primera aparición.")
+        first = np.sort(first)
+        ids = [ids[i] for i in first]
+        seqs = [seqs[i] for i in first]
+    raw = codificar(ids, seqs, state["L"])
+    sp = codigos_especie(state, ids, species_by_id)
+    aplicar_lote(state, raw, sp, +1)
+    insertar_ids(state, np.array(ids, dtype=str), sp, huellas(raw))
+else:
+    if not args.fasta:
+        raise SystemExit(f"ERROR: El modo '{args.modo}' necesita un FASTA alineado con el lote.")
+    if not os.path.exists(args.state):
+        raise SystemExit(f"ERROR: No existe el estado {args.state}. Corré primero el modo 'init'.")
+    state = cargar_estado(args.state)
+    print(f"Estado cargado: {len(state['ids'])} secuencias, {state['L']} columnas")
+    ids, seqs = leer_fasta(args.fasta)
+    if not seqs:
+        raise SystemExit(f"ERROR: No se leyeron secuencias de {args.fasta}.")
+
+    # Búsqueda binaria de los IDs del lote en el índice ordenado del estado
+    batch_ids = np.array(ids, dtype=str)
+    _, first = np.unique(batch_ids, return_index=True)
+    pos, found = buscar_ordenado(state["ids"], batch_ids)
+    if args.modo == "add":
+        keep = np.sort(first[~found[first]])
+        if len(keep) < len(ids):
+            print(f"  Aviso: {len(ids) - len(keep)} IDs ya estaban en el estado o repetidos en el lote; "
+                  f"se ignoran.")
+        ids = [ids[i] for i in keep]
+        seqs = [seqs[i] for i in keep]
+        raw = codificar(ids, seqs, state["L"])
+        sp = codigos_especie(state, ids, species_by_id)
+        aplicar_lote(state, raw, sp, +1)
+        insertar_ids(state, batch_ids[keep], sp, huellas(raw))
+    else:
+        if not found.all():
+            missing = batch_ids[~found]
+            raise SystemExit(f"ERROR: {len(missing)} IDs del lote no están en el estado (ej: {missing[0]}).")
+        if len(first) < len(ids):
+            raise SystemExit(f"ERROR: El lote a quitar tiene {len(ids) - len(first)} IDs repetidos.")
+        # Cada secuencia tiene que ser la que se sumó; se resta con su especie de entonces
+        raw = codificar(ids, seqs, state["L"])
+        distintas = np.flatnonzero(huellas(raw) != state["hash"][pos])
+        if len(distintas):
+            raise SystemExit(f"ERROR: {len(distintas)} secuencias del lote no coinciden con las que se sumaron "
+                             f"(ej: {ids[distintas[0]]}).")
+        aplicar_lote(state, raw, state["sp"][pos], -1)
+        state["ids"] = np.delete(state["ids"], pos)
+        state["sp"] = np.delete(state["sp"], pos)
+        state["hash"] = np.delete(state["hash"], pos)
+
+guardar_estado(state, args.state)
+print(f"Estado guardado en: {args.state} ({len(state['ids'])} secuencias)")
+
+escribir_salidas(state)
@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+
+"""
+Servidor de clasificación por lotes sobre el barcode de 30 bp.
+
+Carga UNA vez formicidae_barcode_30bp.fasta y las especies de metadata_ge600.tsv
+y queda escuchando consultas en formato JSON lines, por stdin/stdout o por un
+socket Unix. Las consultas se agrupan en micro-lotes y se comparan contra todas
+las referencias con un producto de matrices (one-hot), devolviendo la especie
+más cercana y su p-distancia (ignorando gaps, como en 01_core_por_cobertura.py).
+Las referencias idénticas de la misma especie se colapsan al cargar, así que el
+costo por consulta depende de los haplotipos distintos y no de los registros.
+
+Formato de consulta (una por línea):
+  {"id": "q1", "seq": "acattaggaaattttattaatataggagct"}
+  {"cmd": "stats"}    -> latencias p50/p99 y throughput
+  {"cmd": "reload"}   -> fuerza la recarga de la referencia
+
+Respuesta:
+  {"id": "q1", "species": "...", "distance": 0.0, "ref_id": "...",
+   "n_tied_species": 1, "second_species": "...", "second_distance": 0.07}
+
+Si ninguna referencia comparte al menos MIN_COMPARABLE posiciones con base
+con la consulta (consulta corta o casi toda gaps), species es "NA" y
+distance/ref_id son null.
+
+Cada consulta se valida por separado (largo L, sólo A/C/G/T, códigos IUPAC y
+gaps, en mayúscula o minúscula); una consulta inválida recibe su propio
+{"id": ..., "error": "..."} y el resto del micro-lote se clasifica igual.
+
+Si el FASTA de referencia cambia en disco se recarga solo; la nueva referencia
+se construye aparte y se reemplaza de una vez (las consultas en curso terminan
+con la anterior).
+
+Uso:
+  python 07_servidor_clasificacion.py                      # stdin/stdout
+  python 07_servidor_clasificacion.py --socket /tmp/coi.sock
+"""
+
+import argparse
+import json
+import os
+import queue
+import socketserver
+import sys
+import threading
+import time
+
+import numpy as np
+
+# ==========================
+# CONFIGURACIÓN
+# ==========================
+
+REF_FASTA = "formicidae_barcode_30bp.fasta"
+META_FILE = "metadata_ge600.tsv"   # sin encabezado; seq_id primero, especie última
+
+BATCH_SIZE = 256        # máximo de consultas por micro-lote
+MAX_WAIT_MS = 5         # espera máxima para completar un micro-lote
+RELOAD_CHECK_S = 2.0    # cada cuánto se mira si cambió el FASTA de referencia
+MAX_LATENCIES = 100000  # latencias guardadas para p50/p99
+MIN_COMPARABLE = 20     # posiciones con base en ambas para que la distancia valga
+
+BASES = "ACGT"
+ALFABETO = frozenset("ACGTRYSWKMBDHVN-.?acgtryswkmbdhvn")   # bases, IUPAC y gaps
+
+# ==========================
+# REFERENCIA
+# ==========================
+
+LUT = np.full(256, 4, dtype=np.uint8)
+for _code, _b in enumerate(BASES):
+    LUT[ord(_b)] = _code
+    LUT[ord(_b.lower())] = _code
+
+
+def leer_fasta(path):
+    ids = []
+    seqs = []
+    with open(path) as f:
+        current_id = None
+        current_seq = []
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith(">"):
+                if current_id is not None:
+                    seqs.append("".join(current_seq))
+                current_id = line[1:].split()[0]
+                ids.append(current_id)
+                current_seq = []
+            else:
+                current_seq.append(line)
+        if current_id is not None:
+            seqs.append("".join(current_seq))
+    return ids, seqs
+
+
+def leer_especies(path):
+    species_by_id = {}
+    with open(path) as f:
+        for line in f:
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) < 2 or not cols[-1]:
+                continue
+            species_by_id[cols[0]] = cols[-1]
+    return species_by_id
+
+
+def validar_secuencia(seq, L):
+    """Mensaje de error si 'seq' no es una secuencia alineada de largo L; None si vale."""
+    if not isinstance(seq, str):
+        return "la secuencia debe ser un texto"
+    if len(seq) != L:
+        return f"largo {len(seq)} distinto de {L}"
+    malos = set(seq) - ALFABETO
+    if malos:
+        return f"caracteres no permitidos: {''.join(sorted(malos))[:20]!r}"
+    return None
+
+
+def one_hot(seqs, L):
+    """
+    Codifica secuencias de largo L como (n, L*4) float32 y devuelve también
+    la máscara (n, L) de posiciones con base A/C/G/T.
+    """
+    codes = LUT[np.frombuffer("".join(seqs).encode("ascii"), dtype=np.uint8)].reshape(len(seqs), L)
+    valid = codes < 4
+    oh = np.zeros((len(seqs), L, 4), dtype=np.float32)
+    r, c = np.nonzero(valid)
+    oh[r, c, codes[r, c]] = 1.0
+    return oh.reshape(len(seqs), L * 4), valid.astype(np.float32)
+
+
+def cargar_referencia(fasta, meta):
+    mtime = os.path.getmtime(fasta)
+    ids, seqs = leer_fasta(fasta)
+    species_by_id = leer_especies(meta)
+
+    # Sólo referencias con especie conocida; un representante por par
+    # (haplotipo, especie), ordenados por especie para sacar el mínimo por
+    # especie con reduceat.
+    L = len(seqs[0]) if seqs else 0
+    first_by_pair = {}
+    for sid, s in zip(ids, seqs):
+        if len(s) != L:
+            raise SystemExit(f"ERROR: La referencia {sid} tiene longitud {len(s)} distinta de {L}.")
+        sp = species_by_id.get(sid)
+        if sp is None:
+            continue
+        first_by_pair.setdefault((sp, s.upper()), sid)
+    if not first_by_pair:
+        raise SystemExit("ERROR: Ninguna secuencia de referencia tiene especie en la metadata.")
+
+    pairs = sorted(first_by_pair)
+    ids = [first_by_pair[p] for p in pairs]
+    seqs = [p[1] for p in pairs]
+    species = [p[0] for p in pairs]
+    starts = [0] + [i for i in range(1, len(species)) if species[i] != species[i - 1]]
+    oh, valid = one_hot(seqs, L)
+    return {
+        "L": L,
+        "mtime": mtime,
+        "n_pairs": len(first_by_pair),
+        "ids": ids,
+        "oh": oh,
+        "valid": valid,
+        "sp_starts": np.array(starts, dtype=np.int64),
+        "sp_names": [species[i] for i in starts],
+    }
+
+
+def clasificar(ref, seqs):
+    """
+    p-distancia de cada consulta contra todas las referencias (posiciones con
+    base en ambas), luego mínimo por especie y las dos especies más cercanas.
+    """
+    q_oh, q_valid = one_hot(seqs, ref["L"])
+    matches = q_oh @ ref["oh"].T
+    comparable = q_valid @ ref["valid"].T
+    dist = np.float32(1.0) - matches / np.maximum(comparable, np.float32(1.0))
+    dist[comparable < MIN_COMPARABLE] = np.inf
+
+    best_ref = dist.argmin(axis=1)
+    per_sp = np.minimum.reduceat(dist, ref["sp_starts"], axis=1)
+    rows = np.arange(len(seqs))
+    s1 = per_sp.argmin(axis=1)
+    d1 = per_sp[rows, s1]
+    n_tied = (per_sp == d1[:, None]).sum(axis=1)
+    n_sp = per_sp.shape[1]
+    if n_sp > 1:
+        per_sp[rows, s1] = np.inf
+        s2 = per_sp.argmin(axis=1)
+        d2 = per_sp[rows, s2]
+
+    # Sin ninguna referencia comparable (consulta corta o casi toda gaps): NA
+    out = []
+    for k in range(len(seqs)):
+        if not np.isfinite(d1[k]):
+            res = {"species": "NA", "distance": None, "ref_id": None, "n_tied_species": 0}
+            if n_sp > 1:
+                res["second_species"] = "NA"
+                res["second_distance"] = None
+            out.append(res)
+            continue
+        res = {
+            "species": ref["sp_names"][s1[k]],
+            "distance": round(float(d1[k]), 6),
+            "ref_id": ref["ids"][best_ref[k]],
+            "n_tied_species": int(n_tied[k]),
+        }
+        if n_sp > 1:
+            finita = np.isfinite(d2[k])
+            res["second_species"] = ref["sp_names"][s2[k]] if finita else "NA"
+            res["second_distance"] = round(float(d2[k]), 6) if finita else None
+        out.append(res)
+    return out
+
+# ==========================
+# MICRO-LOTES
+# ==========================
+
+class Servidor:
+    """Mantiene la referencia actual, agrupa consultas y lleva las métricas."""
+
+    def __init__(self, fasta, meta):
+        self.fasta = fasta
+        self.meta = meta
+        self.ref = cargar_referencia(fasta, meta)
+        self.pending = queue.Queue()
+        self.latencies = []
+        self.n_done = 0
+        self.t_first = None
+        self.lock = threading.Lock()
+        log(f"Referencia cargada: {self.ref['n_pairs']} pares haplotipo-especie, "
+            f"{len(self.ref['sp_names'])} especies, L={self.ref['L']}")
+
+    def enviar(self, msg, responder):
+        self.pending.put((msg, time.perf_counter(), responder))
+
+    def recargar_si_cambio(self, forzar=False):
+        try:
+            mtime = os.path.getmtime(self.fasta)
+        except OSError:
+            return
+        if forzar or mtime != self.ref["mtime"]:
+            try:
+                nueva = cargar_referencia(self.fasta, self.meta)
+            except (SystemExit, OSError, ValueError) as e:
+                log(f"Aviso: no se pudo recargar la referencia ({e}); se sigue con la anterior.")
+                return
+            self.ref = nueva  # reemplazo atómico de la referencia completa
+            log(f"Referencia recargada: {nueva['n_pairs']} pares haplotipo-especie")
+
+    def stats(self):
+        with self.lock:
+            lat = np.array(self.latencies) if self.latencies else np.zeros(1)
+            elapsed = time.perf_counter() - self.t_first if self.t_first else 0.0
+            return {
+                "queries": self.n_done,
+                "p50_ms": round(float(np.percentile(lat, 50)), 3),
+                "p99_ms": round(float(np.percentile(lat, 99)), 3),
+                "throughput_qps": round(self.n_done / elapsed, 1) if elapsed > 0 else 0.0,
+            }
+
+    def procesar_lote(self, lote):
+        ref = self.ref
+        validas = []
+        for msg, t0, responder in lote:
+            if "cmd" in msg:
+                # Las consultas anteriores al comando se responden antes
+                self.clasificar_validas(ref, validas)
+                validas = []
+                if msg["cmd"] == "stats":
+                    responder(self.stats())
+                elif msg["cmd"] == "reload":
+                    self.recargar_si_cambio(forzar=True)
+                    ref = self.ref
+                    responder({"reloaded": True, "n_refs": ref["n_pairs"]})
+                else:
+                    responder({"error": f"comando desconocido: {msg['cmd']}"})
+                continue
+            seq = msg.get("seq", "")
+            seq = seq.strip() if isinstance(seq, str) else seq
+            error = validar_secuencia(seq, ref["L"])
+            if error is not None:
+                responder({"id": msg.get("id"), "error": error})
+                continue
+            validas.append((msg, t0, responder, seq))
+        self.clasificar_validas(ref, validas)
+
+    def clasificar_validas(self, ref, validas):
+        if not validas:
+            return
+        resultados = clasificar(ref, [v[3] for v in validas])
+        t1 = time.perf_counter()
+        with self.lock:
+            for (msg, t0, responder, _), res in zip(validas, resultados):
+                res = {"id": msg.get("id"), **res}
+                responder(res)
+                self.latencies.append((t1 - t0) * 1000.0)
+                if self.t_first is None or t0 < self.t_first:
+                    self.t_first = t0
+            self.n_done += len(validas)
+            if len(self.latencies) > MAX_LATENCIES:
+                del self.latencies[: len(self.latencies) - MAX_LATENCIES]
+
+    def bucle(self):
+        ultimo_chequeo = time.perf_counter()
+        while True:
+            try:
+                item = self.pending.get(timeout=RELOAD_CHECK_S)
+            except queue.Empty:
+                item = None
+            if time.perf_counter() - ultimo_chequeo >= RELOAD_CHECK_S:
+                self.recargar_si_cambio()
+                ultimo_chequeo = time.perf_counter()
+            if item is None:
+                continue
+            if item[0] is None:  # fin de la entrada
+                return
+            lote = [item]
+            limite = time.perf_counter() + MAX_WAIT_MS / 1000.0
+            while len(lote) < BATCH_SIZE:
+                restante = limite - time.perf_counter()
+                try:
+                    sig = self.pending.get(timeout=max(restante, 0)) if restante > 0 else self.pending.get_nowait()
+                except queue.Empty:
+                    break
+                if sig[0] is None:
+                    self.procesar_lote(lote)
+                    return
+                lote.append(sig)
+            self.procesar_lote(lote)
+
+
+def log(msg):
+    print(msg, file=sys.stderr, flush=True)
+
+
+def parsear(line):
+    try:
+        msg = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+    return msg if isinstance(msg, dict) else None
+
+# ==========================
+# MODOS: STDIN/STDOUT Y SOCKET UNIX
+# ==========================
+
+def modo_stdio(servidor):
+    out_lock = threading.Lock()
+
+    def responder(res):
+        with out_lock:
+            sys.stdout.write(json.dumps(res, ensure_ascii=False) + "\n")
+            sys.stdout.flush()
+
+    def leer():
+        for line in sys.stdin:
+            if not line.strip():
+                continue
+            msg = parsear(line)
+            if msg is None:
+                responder({"error": "JSON inválido"})
+                continue
+            servidor.enviar(msg, responder)
+        servidor.pending.put((None, None, None))
+
+    threading.Thread(target=leer, daemon=True).start()
+    servidor.bucle()
+
+
+def modo_socket(servidor, path):
+    if os.path.exists(path):
+        os.unlink(path)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            lock = threading.Lock()
+            pendientes = []
+            done = threading.Condition(lock)
+
+            def responder(res):
+                data = (json.dumps(res, ensure_ascii=False) + "\n").encode("utf-8")
+                with lock:
+                    try:
+                        self.wfile.write(data)
+                        self.wfile.flush()
+                    except OSError:
+                        pass
+                    pendientes.pop()
+                    done.notify_all()
+
+            for raw in self.rfile:
+                line = raw.decode("utf-8", errors="replace")
+                if not line.strip():
+                    continue
+                msg = parsear(line)
+                if msg is None:
+                    with lock:
+                        pendientes.append(1)
+                    responder({"error": "JSON inválido"})
+                    continue
+                with lock:
+                    pendientes.append(1)
+                servidor.enviar(msg, responder)
+            # Esperar a que salgan todas las respuestas antes de cerrar
+            with lock:
+                while pendientes:
+                    done.wait()
+
+    srv = socketserver.ThreadingUnixStreamServer(path, Handler)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    log(f"Escuchando en socket Unix: {path}")
+    try:
+        servidor.bucle()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.shutdown()
+        os.unlink(path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clasificación de barcodes como servicio (JSON lines).")
+    parser.add_argument("--ref", default=REF_FASTA)
+    parser.add_argument("--meta", default=META_FILE)
+    parser.add_argument("--socket", default=None, help="ruta de socket Unix (por defecto stdin/stdout)")
+    args = parser.parse_args()
+
+    servidor = Servidor(args.ref, args.meta)
+    if args.socket:
+        modo_socket(servidor, args.socket)
+    else:
+        modo_stdio(servidor)
+    s = servidor.stats()
+    log(f"Consultas: {s['queries']}  p50={s['p50_ms']} ms  p99={s['p99_ms']} ms  "
+        f"throughput={s['throughput_qps']} consultas/s")
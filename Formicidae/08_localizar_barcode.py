@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+
+"""
+Localiza el barcode de 30 bp en secuencias crudas (sin alinear).
+
+Hoy el barcode (columnas 49–78 de formicidae_trimmed_ref.fasta) sólo se puede
+cortar de secuencias que pasaron por MAFFT. Este script evita el alineamiento:
+1) Ubica el barcode dentro de COI_REF (COI_ref.fasta) y arma un índice de
+   semillas (k-meros únicos de COI_REF) a izquierda y derecha del centro del
+   barcode.
+2) En cada secuencia cruda busca la semilla más cercana de cada lado: los
+   k-meros de todas las secuencias del bloque se codifican en 2 bits por base
+   con NumPy y se buscan de una vez entre las semillas (búsqueda binaria); el
+   resultado es el mismo que probar las semillas en orden con str.find. Si
+   las dos dan el mismo desplazamiento (diagonal), no hay
+   indels en el medio y el barcode se corta directo; con una sola semilla se
+   corta directo si el resultado se parece al barcode de COI_REF.
+3) Si no, refina los bordes con un alineamiento en banda (DP chico) contra el
+   barcode de COI_REF con un margen a cada lado. El DP se hace con NumPy para
+   todas las secuencias del bloque que lo necesitan a la vez (fila por fila;
+   el gap horizontal con un máximo acumulado), no secuencia por secuencia.
+4) Si no aparece ninguna semilla, o el resultado difiere demasiado del barcode
+   de COI_REF, se prueba el reverso complementario.
+
+La salida tiene el mismo formato que formicidae_barcode_30bp.fasta: 30
+caracteres en coordenadas de COI_REF ('-' donde la secuencia no tiene base o
+no llega a cubrir el barcode). Se procesa en streaming y en paralelo por bloques.
+
+No todas las secuencias se localizan: hacen falta semillas exactas de K bases
+compartidas con COI_REF. Al final se informan localizadas y no localizadas, y
+estas últimas separadas por motivo (sin_semillas: ningún k-mero en común en
+ninguna hebra, típico de fragmentos cortos o muy divergentes; difiere: hubo
+semillas pero el corte difiere en más de MAX_MISMATCH del barcode de COI_REF).
+Con los fragmentos de 82 bp de formicidae_core_aln.fasta (sin gaps) quedan sin
+localizar ~41% (la mayoría sin semillas); la entrada prevista son secuencias
+crudas completas (>= 600 bp).
+"""
+
+import argparse
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+# ==========================
+# CONFIGURACIÓN
+# ==========================
+
+REF_FILE = "COI_ref.fasta"
+REF_ID = "COI_REF"
+BARCODE_REF_FASTA = "formicidae_barcode_30bp.fasta"  # de acá sale el barcode de COI_REF
+
+IN_FILE = "formicidae_ge600.fasta"   # secuencias crudas, sin alinear
+OUT_FILE = "formicidae_barcode_30bp_localizado.fasta"
+FAIL_FILE = "barcode_no_localizados.ids"
+
+K = 12            # largo de semilla
+FLANK = 150       # bases de COI_REF a cada lado del barcode donde se buscan semillas
+PAD = 10          # margen de COI_REF a cada lado del barcode en el refinado
+BAND = 6          # ancho extra de banda en el DP
+GAP_SCORE = -5    # penalidad de gap en el DP (COI es codificante: indels raros)
+MAX_INDEL = 15    # diferencia máxima entre diagonales para refinar entre ambas
+FAST_MAX_MISMATCH = 6  # corte directo si difiere en <= esto del barcode de COI_REF
+MAX_MISMATCH = 12      # por encima de esto el barcode se descarta (semillas espurias)
+CHUNK = 2000      # secuencias por bloque enviado a cada proceso
+N_PROCS = None    # None = todos los núcleos
+
+COMP = str.maketrans("ACGTNacgtn", "TGCANtgcan")
+
+# ==========================
+# LECTURA
+# ==========================
+
+def leer_fasta(path):
+    """Generador de (id, secuencia) leyendo el archivo en streaming."""
+    with open(path) as f:
+        current_id = None
+        current_seq = []
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith(">"):
+                if current_id is not None:
+                    yield current_id, "".join(current_seq)
+                current_id = line[1:].split()[0]
+                current_seq = []
+            else:
+                current_seq.append(line)
+        if current_id is not None:
+            yield current_id, "".join(current_seq)
+
+
+def en_bloques(records, size):
+    bloque = []
+    for rec in records:
+        bloque.append(rec)
+        if len(bloque) == size:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+# ==========================
+# ÍNDICE DE SEMILLAS
+# ==========================
+
+def construir_indice(ref_file, ref_id, barcode_fasta):
+    ref = None
+    barcode = None
+    for sid, s in leer_fasta(ref_file):
+        if sid == ref_id:
+            ref = s.upper()
+    for sid, s in leer_fasta(barcode_fasta):
+        if sid == ref_id:
+            barcode = s.upper()
+            break
+    if ref is None:
+        raise SystemExit(f"ERROR: No se encontró '{ref_id}' en {ref_file}.")
+    if barcode is None:
+        raise SystemExit(f"ERROR: No se encontró '{ref_id}' en {barcode_fasta}.")
+    if "-" in barcode:
+        raise SystemExit("ERROR: El barcode de la referencia tiene gaps; no se puede ubicar en COI_REF.")
+
+    bc_start = ref.find(barcode)
+    if bc_start < 0 or ref.count(barcode) != 1:
+        raise SystemExit("ERROR: El barcode de la referencia no aparece una única vez en COI_REF.")
+    bc_end = bc_start + len(barcode)
+
+    counts = {}
+    for p in range(len(ref) - K + 1):
+        counts[ref[p:p + K]] = counts.get(ref[p:p + K], 0) + 1
+
+    lo = max(0, bc_start - FLANK)
+    hi = min(len(ref), bc_end + FLANK)
+    mid = (bc_start + bc_end) // 2
+    # Izquierda: semillas que empiezan antes del centro del barcode, de la más
+    # cercana a la más lejana
+    left = [(ref[p:p + K], p) for p in range(mid - 1, lo - 1, -1)
+            if p + K <= len(ref) and counts[ref[p:p + K]] == 1]
+    # Derecha: semillas que terminan después del centro del barcode
+    right = [(ref[p:p + K], p) for p in range(max(0, mid - K + 1), hi - K + 1)
+             if counts[ref[p:p + K]] == 1]
+
+    return {
+        "ref": ref,
+        "bc_start": bc_start,
+        "bc_end": bc_end,
+        "barcode": barcode,
+        "left": left,
+        "right": right,
+        "left_codes": codificar_semillas(left),
+        "right_codes": codificar_semillas(right),
+    }
+
+
+SEED_LUT = np.full(256, 4, dtype=np.uint32)
+for _code, _b in enumerate("ACGT"):
+    SEED_LUT[ord(_b)] = _code
+    SEED_LUT[ord(_b.lower())] = _code
+
+
+def codigos_kmeros(buf):
+    """Código de 2 bits por base de cada K-mero de 'buf' (uint8) y si es todo A/C/G/T."""
+    c = SEED_LUT[buf]
+    N = len(buf) - K + 1
+    if N <= 0:
+        return np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=bool)
+    code = np.zeros(N, dtype=np.uint32)
+    for t in range(K):
+        code = (code << np.uint32(2)) | (c[t:t + N] & np.uint32(3))
+    n_bad = np.concatenate(([0], np.cumsum(c >= 4)))
+    return code, n_bad[K:] == n_bad[:N]
+
+
+def codificar_semillas(seeds):
+    """(códigos ordenados, orden en la lista, posición en COI_REF) de una lista de semillas."""
+    codes, ok = codigos_kmeros(np.frombuffer("#".join(k for k, _ in seeds).encode("ascii"), dtype=np.uint8))
+    codes = codes[0::K + 1] if seeds else codes
+    if seeds and not ok[0::K + 1].all():
+        raise SystemExit("ERROR: COI_REF tiene bases fuera de A/C/G/T en la zona de semillas.")
+    order = np.argsort(codes, kind="stable")
+    return codes[order], order, np.array([p for _, p in seeds], dtype=np.int64)[order]
+
+# ==========================
+# LOCALIZACIÓN
+# ==========================
+
+IDX = None  # índice por proceso (se carga en el inicializador del Pool)
+
+
+def init_worker(idx):
+    global IDX
+    IDX = idx
+
+
+def diagonales(seqs, semillas):
+    """
+    Para cada secuencia, posición - p de la primera semilla de la lista (la más
+    cercana al barcode) que aparece en ella, en su primera aparición; None si
+    no aparece ninguna. Es lo mismo que probar las semillas en orden con
+    seq.find, pero para todas las secuencias juntas.
+    """
+    codes_s, rank_s, p_s = semillas
+    starts = np.cumsum([0] + [len(s) + 1 for s in seqs[:-1]])
+    buf = np.frombuffer("#".join(seqs).encode("ascii", errors="replace"), dtype=np.uint8)
+    code, ok = codigos_kmeros(buf)
+    x = np.flatnonzero(ok)
+    j = np.minimum(np.searchsorted(codes_s, code[x]), max(len(codes_s) - 1, 0))
+    hit = codes_s[j] == code[x] if len(codes_s) else np.zeros(len(x), dtype=bool)
+    x, j = x[hit], j[hit]
+    seq_of = np.searchsorted(starts, x, side="right") - 1
+    x_local = x - starts[seq_of]
+    order = np.lexsort((x_local, rank_s[j], seq_of))
+    con_hit, first = np.unique(seq_of[order], return_index=True)
+    sel = order[first]
+    out = [None] * len(seqs)
+    for k, d in zip(con_hit.tolist(), (x_local[sel] - p_s[j[sel]]).tolist()):
+        out[k] = d
+    return out
+
+
+def cortar(seq, start, length):
+    """seq[start:start+length] rellenando con '-' lo que cae fuera de la secuencia."""
+    left = "-" * max(0, -start)
+    right = "-" * max(0, start + length - len(seq))
+    return left + seq[max(0, start):max(0, start + length)] + right
+
+
+def refinar_banda(segs):
+    """
+    Alinea ref[bc_start-PAD : bc_end+PAD] contra la región de cada secuencia que
+    predicen sus diagonales, en una banda [diag_lo - BAND, diag_hi + BAND].
+    'segs' es una lista de (seq, diag_lo, diag_hi) y el DP se hace para todas a
+    la vez. Alineamiento de solapamiento (extremos libres en las dos
+    secuencias, para secuencias que terminan cerca del barcode) con match +1,
+    mismatch -1 y gap GAP_SCORE. Devuelve, por secuencia, las 30 posiciones del
+    barcode en coordenadas de la referencia (o None).
+    """
+    ref = IDX["ref"]
+    r0 = max(0, IDX["bc_start"] - PAD)
+    r1 = min(len(ref), IDX["bc_end"] + PAD)
+    r = np.frombuffer(ref[r0:r1].encode("ascii"), dtype=np.uint8)
+    m = len(r)
+    B = len(segs)
+
+    # Ventana de cada secuencia, rellenada a un ancho común W
+    ventanas = []
+    off_lo = np.empty(B, dtype=np.int64)
+    off_hi = np.empty(B, dtype=np.int64)
+    for b, (seq, diag_lo, diag_hi) in enumerate(segs):
+        s0 = max(0, r0 + diag_lo - BAND)
+        s1 = min(len(seq), r1 + diag_hi + BAND)
+        ventanas.append(seq[s0:s1].encode("ascii", errors="replace"))
+        # banda en términos de j - i (posición en s menos posición en r)
+        off_lo[b] = r0 + diag_lo - BAND - s0
+        off_hi[b] = r0 + diag_hi + BAND - s0
+    n = np.array([len(v) for v in ventanas], dtype=np.int64)
+    W = int(n.max()) if B else 0
+    s = np.zeros((B, W + 1), dtype=np.uint8)   # s[:, j] = base j (1-based); columna 0 sin uso
+    for b, v in enumerate(ventanas):
+        s[b, 1:len(v) + 1] = np.frombuffer(v, dtype=np.uint8)
+
+    NEG = np.int32(-10 ** 9)
+    jj = np.arange(W + 1, dtype=np.int64)
+    gap_j = (GAP_SCORE * jj).astype(np.int32)
+    D = np.full((m + 1, B, W + 1), NEG, dtype=np.int32)
+    T = np.zeros((m + 1, B, W + 1), dtype=np.uint8)  # 0=inicio, 1=diag, 2=arriba (gap en s), 3=izq (gap en r)
+    D[0] = 0
+    D[0][jj[None, :] > n[:, None]] = NEG
+    for i in range(1, m + 1):
+        j_lo = np.maximum(1, i + off_lo - 1)
+        j_hi = np.minimum(n, i + off_hi + 1)
+        banda = (jj[None, :] >= j_lo[:, None]) & (jj[None, :] <= j_hi[:, None])
+        Dp = D[i - 1]
+        # Diagonal y arriba; a igual puntaje gana la diagonal, como en un DP celda a celda
+        diag = np.full((B, W + 1), NEG, dtype=np.int32)
+        diag[:, 1:] = Dp[:, :-1] + np.where(s[:, 1:] == r[i - 1], 1, -1).astype(np.int32)
+        up = Dp + np.int32(GAP_SCORE)
+        H = np.where(up > diag, up, diag)
+        t = np.where(up > diag, 2, 1).astype(np.uint8)
+        H = np.where(banda, H, NEG)
+        H[:, 0] = 0
+        # Gap horizontal: D[j] = max(H[j], D[j-1] + GAP) = max_k<=j (H[k] - GAP*k) + GAP*j
+        Di = np.maximum.accumulate(H - gap_j, axis=1) + gap_j
+        t[Di > H] = 3
+        Di = np.where(banda, Di, NEG)
+        Di[:, 0] = 0
+        D[i] = Di
+        T[i] = np.where(banda, t, 0)
+
+    # Mejor celda en la última fila o la última columna (la primera a igual puntaje)
+    rows = np.arange(B)
+    last_col = D[:, rows, n]                         # (m + 1, B)
+    j_best = D[m].argmax(axis=1)
+    i_alt = last_col.argmax(axis=0)
+    alt = last_col[i_alt, rows] > D[m, rows, j_best]
+    i = np.where(alt, i_alt, m)
+    j = np.where(alt, n, j_best)
+    ok = D[i, rows, j] > 0
+
+    # Traceback de todas a la vez: qué base de s quedó alineada a cada posición de r
+    aligned = np.full((B, m), ord("-"), dtype=np.uint8)
+    activo = ok.copy()
+    while True:
+        t = T[i, rows, j]
+        activo &= (i > 0) & (j > 0) & (t > 0)
+        if not activo.any():
+            break
+        d = activo & (t == 1)
+        aligned[rows[d], i[d] - 1] = s[rows[d], j[d]]
+        i = i - (activo & (t != 3))
+        j = j - (activo & (t != 2))
+
+    b0 = IDX["bc_start"] - r0
+    bc = aligned[:, b0:b0 + (IDX["bc_end"] - IDX["bc_start"])]
+    return [bc[b].tobytes().decode("ascii", errors="replace") if ok[b] else None for b in range(B)]
+
+
+def mismatches(a, b):
+    return sum(1 for x, y in zip(a, b) if x != y)
+
+
+def camino_rapido(s, dl, dr):
+    """
+    Semillas en una hebra (diagonales de la izquierda y la derecha). Devuelve
+    (barcode, None) si alcanza el corte directo, (None, (diag_lo, diag_hi)) si
+    hay que refinar, o (None, None) si no hay semillas.
+    """
+    bc_len = IDX["bc_end"] - IDX["bc_start"]
+    diags = sorted({d for d in (dl, dr) if d is not None})
+    if not diags:
+        return None, None
+    # Corte directo en la diagonal de las semillas. Si las dos semillas
+    # coinciden no hay indels en el medio; si no, se acepta el corte que se
+    # parezca lo suficiente al barcode de COI_REF.
+    cortes = [(mismatches(cortar(s, IDX["bc_start"] + d, bc_len), IDX["barcode"]), d) for d in diags]
+    mm, d = min(cortes)
+    if len(diags) == 1 and dl == dr or mm <= FAST_MAX_MISMATCH:
+        return cortar(s, IDX["bc_start"] + d, bc_len), None
+    # Diagonales muy distintas: una de las semillas es espuria
+    if diags[-1] - diags[0] > MAX_INDEL:
+        diags = [d]
+    return None, (diags[0], diags[-1])
+
+
+def procesar_bloque(bloque):
+    """
+    Devuelve (id, barcode o None, método o motivo) por secuencia. Cada hebra se
+    resuelve para todo el bloque: primero el camino rápido y después UN DP en
+    banda con todas las que lo necesitan; las que no quedan se prueban en la
+    otra hebra.
+    """
+    barcode = IDX["barcode"]
+    res = [None] * len(bloque)
+    con_semillas = [False] * len(bloque)
+    pendientes = list(range(len(bloque)))
+    for hebra in "+-":
+        refinar = []
+        siguientes = []
+        hebras = [bloque[k][1].upper() for k in pendientes]
+        if hebra == "-":
+            hebras = [s.translate(COMP)[::-1] for s in hebras]
+        dls = diagonales(hebras, IDX["left_codes"])
+        drs = diagonales(hebras, IDX["right_codes"])
+        for k, s, dl, dr in zip(pendientes, hebras, dls, drs):
+            bc, diags = camino_rapido(s, dl, dr)
+            if bc is None and diags is None:
+                siguientes.append(k)
+                continue
+            con_semillas[k] = True
+            if bc is not None:
+                if mismatches(bc, barcode) <= MAX_MISMATCH:
+                    res[k] = (bc, f"semillas{hebra}")
+                else:
+                    siguientes.append(k)
+            else:
+                refinar.append((k, s, diags))
+        if refinar:
+            bcs = refinar_banda([(s, lo, hi) for _, s, (lo, hi) in refinar])
+            for (k, _, _), bc in zip(refinar, bcs):
+                if bc is not None and mismatches(bc, barcode) <= MAX_MISMATCH:
+                    res[k] = (bc, f"banda{hebra}")
+                else:
+                    siguientes.append(k)
+        pendientes = sorted(siguientes)
+
+    out = []
+    for k, (sid, _) in enumerate(bloque):
+        if res[k] is None:
+            out.append((sid, None, "no_localizado_difiere" if con_semillas[k] else "no_localizado_sin_semillas"))
+        else:
+            out.append((sid, res[k][0].lower(), res[k][1]))
+    return out
+
+# ==========================
+# PROGRAMA PRINCIPAL
+# ==========================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Localiza el barcode de 30 bp sin alinear.")
+    parser.add_argument("--in", dest="in_file", default=IN_FILE)
+    parser.add_argument("--out", default=OUT_FILE)
+    parser.add_argument("--procs", type=int, default=N_PROCS)
+    args = parser.parse_args()
+
+    idx = construir_indice(REF_FILE, REF_ID, BARCODE_REF_FASTA)
+    print(f"Barcode en COI_REF: posiciones {idx['bc_start']}–{idx['bc_end'] - 1}")
+    print(f"Semillas de {K}-meros: {len(idx['left'])} a la izquierda, {len(idx['right'])} a la derecha")
+    print(f"Usando secuencias crudas: {args.in_file}")
+
+    t0 = time.perf_counter()
+    n_total = 0
+    metodos = {}
+    with open(args.out, "w") as out, open(FAIL_FILE, "w") as fail, \
+            Pool(args.procs, initializer=init_worker, initargs=(idx,)) as pool:
+        for resultados in pool.imap(procesar_bloque, en_bloques(leer_fasta(args.in_file), CHUNK)):
+            for sid, bc, metodo in resultados:
+                n_total += 1
+                metodos[metodo] = metodos.get(metodo, 0) + 1
+                if bc is None:
+                    fail.write(sid + "\n")
+                else:
+                    out.write(f">{sid}\n{bc}\n")
+    dt = time.perf_counter() - t0
+
+    n_fail = sum(c for metodo, c in metodos.items() if metodo.startswith("no_localizado"))
+    print(f"Secuencias procesadas: {n_total} en {dt:.1f} s ({n_total / max(dt, 1e-9):.0f} secuencias/s)")
+    print(f"Localizadas: {n_total - n_fail} ({(n_total - n_fail) / max(n_total, 1):.1%}), "
+          f"no localizadas: {n_fail} ({n_fail / max(n_total, 1):.1%})")
+    for metodo, c in sorted(metodos.items()):
+        print(f"  {metodo}: {c}")
+    print(f"Barcodes escritos en: {args.out}")
+    print(f"IDs no localizados en: {FAIL_FILE}")
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+
+"""
+Agrega secuencias nuevas al alineamiento core sin volver a correr MAFFT.
+
+Con el alineamiento existente (formicidae_core_aln.fasta) se arma un perfil
+posición-específico a partir de los conteos de bases por columna. Cada
+secuencia nueva (cruda, sin alinear) se alinea contra ese perfil con
+programación dinámica en banda y se inserta con EXACTAMENTE las mismas
+columnas: lo que la secuencia tiene de más respecto del perfil (inserciones)
+se descarta, como en "mafft --add --keeplength". Así las coordenadas de las
+ventanas (por ejemplo el barcode 49–78) no se mueven.
+
+1) Perfil: score(col, base) = log2(p(base | col) / 0.25) con pseudoconteos y
+   un piso para bases raras; borrar una columna cuesta menos cuanto más gaps
+   tiene esa columna.
+2) Banda: la diagonal se estima con semillas (k-meros únicos del consenso)
+   buscadas en la secuencia; sin semillas se usa la DP completa.
+3) El DP se hace con numpy para todo un bloque a la vez (una fila del perfil
+   por paso) y los bloques se reparten en paralelo.
+
+Los IDs que ya están en el alineamiento (o que se repiten en la entrada) no
+se agregan: van a FAIL_FILE con el motivo, igual que las de score bajo.
+"""
+
+import argparse
+import math
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+# ==========================
+# CONFIGURACIÓN
+# ==========================
+
+ALN_FILE = "formicidae_core_aln.fasta"        # alineamiento existente (no se modifica)
+IN_FILE = "nuevas_secuencias.fasta"          # secuencias nuevas, sin alinear
+OUT_FILE = "formicidae_core_aln_ampliado.fasta"
+FAIL_FILE = "no_agregadas.ids"
+
+PSEUDO = 1.0       # pseudoconteo por base en el perfil
+MIN_MATCH = -2.0   # piso del score de una base rara (si no, un indel sale más barato)
+GAP_SCORE = -6.0   # inserción en la secuencia / borrado de una columna sin gaps
+K = 10             # largo de semilla sobre el consenso
+BAND = 8           # semiancho de la banda alrededor de la diagonal estimada
+MIN_SCORE = 10.0   # por debajo de esto la secuencia no se agrega
+CHUNK = 1000       # secuencias por bloque enviado a cada proceso
+MAX_CELDAS = 50_000_000  # tope de la matriz de traceback de un lote (bytes)
+N_PROCS = None     # None = todos los núcleos
+
+BASES = "ACGT"
+
+# ==========================
+# LECTURA
+# ==========================
+
+def leer_fasta(path):
+    """Generador de (id, secuencia) leyendo el archivo en streaming."""
+    with open(path) as f:
+        current_id = None
+        current_seq = []
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith(">"):
+                if current_id is not None:
+                    yield current_id, "".join(current_seq)
+                current_id = line[1:].split()[0]
+                current_seq = []
+            else:
+                current_seq.append(line)
+        if current_id is not None:
+            yield current_id, "".join(current_seq)
+
+
+def sin_duplicados(records, ids, duplicados):
+    """Deja pasar sólo los IDs que no están en 'ids' (y los va agregando)."""
+    for sid, seq in records:
+        if sid in ids:
+            duplicados.append(sid)
+            continue
+        ids.add(sid)
+        yield sid, seq
+
+
+def en_bloques(records, size):
+    bloque = []
+    for rec in records:
+        bloque.append(rec)
+        if len(bloque) == size:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+# ==========================
+# PERFIL
+# ==========================
+
+def construir_perfil(aln_file):
+    L = None
+    n_seq = 0
+    counts = None
+    ids = set()
+    for sid, s in leer_fasta(aln_file):
+        if L is None:
+            L = len(s)
+            counts = [dict.fromkeys(BASES + "-", 0) for _ in range(L)]
+        elif len(s) != L:
+            raise SystemExit(f"ERROR: La secuencia {sid} tiene longitud {len(s)} distinta de {L}.")
+        n_seq += 1
+        ids.add(sid)
+        for col, b in zip(counts, s.upper()):
+            if b in col:
+                col[b] += 1
+    if not n_seq:
+        raise SystemExit("ERROR: No se leyeron secuencias del archivo de alineamiento.")
+
+    match = []     # por columna: {base: score}
+    delete = []    # por columna: score de dejar la columna en gap
+    consensus = []
+    for col in counts:
+        n_bases = sum(col[b] for b in BASES)
+        match.append({
+            b: max(MIN_MATCH, math.log2((col[b] + PSEUDO) / (n_bases + 4 * PSEUDO) / 0.25))
+            for b in BASES
+        })
+        gap_frac = col["-"] / n_seq
+        delete.append(GAP_SCORE * (1.0 - gap_frac))
+        consensus.append(max(BASES, key=lambda b: col[b]))
+    consensus = "".join(consensus)
+
+    kmer_counts = {}
+    for p in range(L - K + 1):
+        kmer_counts[consensus[p:p + K]] = kmer_counts.get(consensus[p:p + K], 0) + 1
+    seeds = [(consensus[p:p + K], p) for p in range(L - K + 1) if kmer_counts[consensus[p:p + K]] == 1]
+
+    # Tabla columna x byte para el DP (0 para lo que no es ACGT)
+    match_lut = np.zeros((L, 256))
+    for i, m in enumerate(match):
+        for b in BASES:
+            match_lut[i, ord(b)] = m[b]
+
+    return {
+        "L": L,
+        "n_seq": n_seq,
+        "ids": ids,
+        "match": match_lut,
+        "delete": np.array(delete),
+        "consensus": consensus,
+        "seeds": seeds,
+    }
+
+# ==========================
+# ALINEAMIENTO CONTRA EL PERFIL
+# ==========================
+
+PERFIL = None  # perfil por proceso (se carga en el inicializador del Pool)
+
+
+def init_worker(perfil):
+    global PERFIL
+    PERFIL = perfil
+
+
+def diagonal_por_semillas(seq):
+    """Diagonal (pos en seq - columna) más votada por las semillas del consenso."""
+    votos = {}
+    for kmer, p in PERFIL["seeds"]:
+        pos = seq.find(kmer)
+        if pos >= 0:
+            votos[pos - p] = votos.get(pos - p, 0) + 1
+    if not votos:
+        return None
+    return max(votos, key=votos.get)
+
+
+def banda(seq, diag):
+    """
+    Recorte de seq y banda |(j - i) - off| en coordenadas del recorte: la
+    diagonal estimada +- BAND, o todo (DP completa) si diag es None.
+    """
+    L = PERFIL["L"]
+    if diag is None:
+        return seq, -len(seq) - L, len(seq) + L
+    s0 = max(0, diag - BAND)
+    s1 = min(len(seq), L + diag + BAND)
+    return seq[s0:s1], diag - BAND - s0, diag + BAND - s0
+
+
+def alinear_a_perfil(segs):
+    """
+    Alineamiento de solapamiento (extremos libres) de cada secuencia contra el
+    perfil, restringido a su banda. 'segs' es una lista de (s, off_lo, off_hi)
+    y el DP se hace para todas a la vez, fila por fila del perfil, guardando
+    sólo las celdas de la banda: la celda k de la fila i es j = i + off_lo + k.
+    Devuelve, por secuencia, (fila alineada de largo L, score).
+    """
+    L = PERFIL["L"]
+    match = PERFIL["match"]
+    delete = PERFIL["delete"]
+    B = len(segs)
+    rows = np.arange(B)
+    n = np.array([len(seg[0]) for seg in segs], dtype=np.int64)
+    # j va de 0 a n, así que la banda útil es -L <= j - i <= n - 1
+    off_lo = np.maximum([seg[1] for seg in segs], -L)
+    off_hi = np.minimum([seg[2] for seg in segs], n - 1)
+    W = max(1, int((off_hi - off_lo).max()) + 1)
+    s = np.zeros((B, int(n.max()) + 1), dtype=np.uint8)   # s[:, j] = base j (1-based); columna 0 sin uso
+    for b, (seg, _, _) in enumerate(segs):
+        s[b, 1:len(seg) + 1] = np.frombuffer(seg.encode("ascii", errors="replace"), dtype=np.uint8)
+
+    NEG = -1e18
+    kk = np.arange(W, dtype=np.int64)
+    ancho = (off_hi - off_lo)[:, None]
+
+    def celdas(i):
+        j = i + off_lo[:, None] + kk[None, :]
+        return j, (kk[None, :] <= ancho) & (j >= 1) & (j <= n[:, None])
+
+    # Fila 0: D[0][j] = 0 para 0 <= j <= n
+    j, _ = celdas(0)
+    Dp = np.where((j >= 0) & (j <= n[:, None]), 0.0, NEG)
+    last_col = np.full((L + 1, B), NEG)                 # D[i][n] de cada secuencia
+    last_col[0] = 0.0
+    T = np.zeros((L + 1, B, W), dtype=np.uint8)         # 0=inicio, 1=diag, 2=columna en gap, 3=inserción
+    izq = np.full((B, W), NEG)
+    for i in range(1, L + 1):
+        j, en_banda = celdas(i)
+        # Diagonal (misma k en la fila anterior) y columna en gap (k + 1);
+        # a igual puntaje gana la diagonal
+        H = Dp + match[i - 1][s[rows[:, None], np.clip(j, 0, s.shape[1] - 1)]]
+        v = np.full((B, W), NEG)
+        v[:, :-1] = Dp[:, 1:] + delete[i - 1]
+        t = np.where(v > H, 2, 1).astype(np.uint8)
+        H = np.where(v > H, v, H)
+        H = np.where(en_banda, H, np.where(j == 0, 0.0, NEG))   # D[i][0] = 0
+        # Inserciones: D[j] = max(H[j], D[j-1] + GAP), propagado hasta que no cambie
+        # (las mismas sumas que celda a celda, así el resultado es idéntico)
+        izq[:, 0] = np.where(j[:, 0] == 1, 0.0, NEG)
+        Di = H
+        while True:
+            izq[:, 1:] = Di[:, :-1]
+            v = izq + GAP_SCORE
+            mejora = en_banda & (v > Di)
+            if not mejora.any():
+                break
+            Di = np.where(mejora, v, Di)
+            t[mejora] = 3
+        T[i] = np.where(en_banda, t, 0)
+        k_n = n - i - off_lo
+        dentro = (k_n >= 0) & (k_n < W)
+        last_col[i, dentro] = Di[rows[dentro], k_n[dentro]]
+        Dp = Di
+
+    # Mejor celda en la última fila (j = 0 vale 0 aunque quede fuera de la banda)
+    # o en la última columna; la primera a igual puntaje
+    k_best = Dp.argmax(axis=1)
+    d_best = Dp[rows, k_best]
+    j_best = np.where(d_best > 0, L + off_lo + k_best, 0)
+    d_best = np.maximum(d_best, 0.0)
+    i_alt = last_col.argmax(axis=0)
+    alt = last_col[i_alt, rows] > d_best
+    i = np.where(alt, i_alt, L)
+    j = np.where(alt, n, j_best)
+    score = np.where(alt, last_col[i_alt, rows], d_best)
+
+    # Traceback de todas a la vez; lo que la secuencia tiene de más se descarta
+    aligned = np.full((B, L), ord("-"), dtype=np.uint8)
+    activo = np.ones(B, dtype=bool)
+    while True:
+        k = j - i - off_lo
+        activo &= (i > 0) & (j > 0) & (k >= 0) & (k < W)
+        t = T[i, rows, np.clip(k, 0, W - 1)]
+        activo &= t > 0
+        if not activo.any():
+            break
+        d = activo & (t == 1)
+        aligned[rows[d], i[d] - 1] = s[rows[d], j[d]]
+        i = i - (activo & (t != 3))
+        j = j - (activo & (t != 2))
+    return [(aligned[b].tobytes().decode("ascii", errors="replace"), float(score[b])) for b in range(B)]
+
+
+def procesar_bloque(bloque):
+    """
+    Alinea un bloque; las secuencias se agrupan por ancho de banda (las de DP
+    completa no agrandan la banda de las demás) y cada grupo tiene a lo sumo
+    MAX_CELDAS celdas de traceback.
+    """
+    segs = []
+    for sid, seq in bloque:
+        su = seq.upper().replace("-", "")
+        segs.append(banda(su, diagonal_por_semillas(su)))
+    res = [(None, 0.0)] * len(bloque)
+    L = PERFIL["L"]
+    ancho = [max(1, min(seg[2], len(seg[0]) - 1) - max(seg[1], -L) + 1) for seg in segs]
+    orden = sorted((k for k in range(len(segs)) if segs[k][0]), key=lambda k: ancho[k])
+    a = 0
+    while a < len(orden):
+        b = a + 1
+        while (b < len(orden) and ancho[orden[b]] <= 2 * ancho[orden[a]]
+               and (L + 1) * (b + 1 - a) * ancho[orden[b]] <= MAX_CELDAS):
+            b += 1
+        for k, r in zip(orden[a:b], alinear_a_perfil([segs[k] for k in orden[a:b]])):
+            res[k] = r
+        a = b
+
+    out = []
+    for (sid, _), (row, score) in zip(bloque, res):
+        if row is None or score < MIN_SCORE:
+            out.append((sid, None, score))
+        else:
+            out.append((sid, row.lower(), score))
+    return out
+
+# ==========================
+# PROGRAMA PRINCIPAL
+# ==========================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Agrega secuencias al alineamiento core sin mover columnas.")
+    parser.add_argument("--aln", default=ALN_FILE)
+    parser.add_argument("--in", dest="in_file", default=IN_FILE)
+    parser.add_argument("--out", default=OUT_FILE)
+    parser.add_argument("--procs", type=int, default=N_PROCS)
+    args = parser.parse_args()
+
+    perfil = construir_perfil(args.aln)
+    ids = perfil.pop("ids")  # sólo hace falta acá, no en los procesos
+    print(f"Perfil construido desde {args.aln}: {perfil['n_seq']} secuencias, {perfil['L']} columnas")
+    print(f"Semillas de {K}-meros del consenso: {len(perfil['seeds'])}")
+    print(f"Secuencias nuevas: {args.in_file}")
+
+    t0 = time.perf_counter()
+    n_ok = 0
+    n_fail = 0
+    duplicados = []
+    with open(args.out, "w") as out, open(FAIL_FILE, "w") as fail:
+        # 1) Copiar el alineamiento existente tal cual
+        with open(args.aln) as f:
+            for line in f:
+                out.write(line if line.endswith("\n") else line + "\n")
+        # 2) Agregar las nuevas con las mismas columnas
+        with Pool(args.procs, initializer=init_worker, initargs=(perfil,)) as pool:
+            nuevas = sin_duplicados(leer_fasta(args.in_file), ids, duplicados)
+            for resultados in pool.imap(procesar_bloque, en_bloques(nuevas, CHUNK)):
+                for sid, row, score in resultados:
+                    if row is None:
+                        fail.write(f"{sid}\tscore_bajo\t{score:.1f}\n")
+                        n_fail += 1
+                    else:
+                        out.write(f">{sid}\n{row}\n")
+                        n_ok += 1
+        for sid in duplicados:
+            fail.write(f"{sid}\tduplicado\tNA\n")
+    dt = time.perf_counter() - t0
+
+    print(f"Secuencias agregadas: {n_ok}, descartadas: {n_fail}, ya presentes: {len(duplicados)} "
+          f"en {dt:.1f} s ({(n_ok + n_fail) / max(dt, 1e-9):.0f} secuencias/s)")
+    print(f"Alineamiento ampliado escrito en: {args.out} (mismas {perfil['L']} columnas)")
+    print(f"IDs no agregados en: {FAIL_FILE}")
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+
+"""
+Curva de precisión leave-one-out 1-NN por especie para todas las ventanas.
+
+01_core_por_cobertura.py rankea ventanas por el cociente inter/intra y
+02_ventanas_entropy_coverage.py por entropía media: son proxies. Este script
+mide directamente lo que importa: si para cada secuencia la más cercana (sin
+contarse a sí misma) es de su misma especie.
+
+Las secuencias idénticas se comparan una sola vez (haplotipos con su número
+de copias). Para cada bloque de consultas se calcula una vez, con productos
+one-hot, el aporte de cada columna (diferencias y posiciones comparables
+contra todos los haplotipos) y se acumula en sumas prefijas: cualquier
+ventana de cualquier tamaño sale de una resta, sin volver a recorrer sus
+columnas. Cada posición se evalúa con enteros: el par (diferencias,
+comparables) se traduce con una tabla al rango de su p-distancia, así el
+mínimo y los empates son exactos y no hay divisiones.
+
+Empates: si varias secuencias están a la misma distancia mínima, la consulta
+suma la fracción de ellas que son de su especie (precisión esperada con
+desempate al azar). Sólo se evalúan consultas cuya especie tiene al menos
+otra secuencia en la selección.
+"""
+
+import math
+import time
+
+import numpy as np
+
+# ==========================
+# CONFIGURACIÓN
+# ==========================
+
+ALN_FILE = "formicidae_core_aln.fasta"
+META_FILE = "Formicidae.metadata.tsv"   # metadata con columnas seq_id y species
+
+WINDOW_SIZES = [20, 30, 40, 50, 60]
+MAX_PER_SPECIES = 20   # máximo de secuencias por especie (como en 01_core_por_cobertura.py)
+MIN_COMPARABLE = 0.5   # fracción mínima de la ventana con base en ambas secuencias
+BLOCK = 128            # grupos de consulta por bloque (memoria: (L + 1) x BLOCK x haplotipos, int16)
+
+OUT_FILE = "precision_1nn_por_ventana.tsv"
+
+BASES = "ACGT"
+
+print(f"Usando alineamiento: {ALN_FILE}")
+print(f"Usando metadata: {META_FILE}")
+print(f"Tamaños de ventana: {WINDOW_SIZES}")
+print(f"Máximo de secuencias por especie: {MAX_PER_SPECIES}")
+
+# ==========================
+# 1) LEER METADATA Y ALINEAMIENTO
+# ==========================
+
+species_by_id = {}
+with open(META_FILE) as meta:
+    header = meta.readline().rstrip("\n").split("\t")
+    try:
+        id_idx = header.index("seq_id")
+        sp_idx = header.index("species")
+    except ValueError:
+        raise SystemExit("ERROR: La metadata debe tener columnas 'seq_id' y 'species' separadas por TAB.")
+    for line in meta:
+        if not line.strip():
+            continue
+        cols = line.rstrip("\n").split("\t")
+        if len(cols) <= max(id_idx, sp_idx):
+            continue
+        species_by_id[cols[id_idx]] = cols[sp_idx]
+
+ids = []
+seqs = []
+
+with open(ALN_FILE) as f:
+    current_id = None
+    current_seq = []
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith(">"):
+            if current_id is not None:
+                seqs.append("".join(current_seq))
+            current_id = line[1:].split()[0]
+            ids.append(current_id)
+            current_seq = []
+        else:
+            current_seq.append(line)
+    if current_id is not None:
+        seqs.append("".join(current_seq))
+
+if not seqs:
+    raise SystemExit("ERROR: No se leyeron secuencias del alineamiento.")
+
+L = len(seqs[0])
+for sid, s in zip(ids, seqs):
+    if len(s) != L:
+        raise SystemExit(f"ERROR: La secuencia {sid} tiene longitud {len(s)} distinta de {L}.")
+
+print(f"Secuencias en el alineamiento: {len(seqs)}, longitud: {L} columnas")
+
+# ==========================
+# 2) SELECCIÓN Y CODIFICACIÓN
+# ==========================
+
+by_species = {}
+for i, sid in enumerate(ids):
+    sp = species_by_id.get(sid)
+    if sp is not None:
+        by_species.setdefault(sp, []).append(i)
+
+selected = sorted(i for idxs in by_species.values() for i in idxs[:MAX_PER_SPECIES])
+if not selected:
+    raise SystemExit("ERROR: Ninguna secuencia del alineamiento tiene especie en la metadata.")
+
+sp_names = sorted(by_species)
+sp_code = {sp: k for k, sp in enumerate(sp_names)}
+labels = np.array([sp_code[species_by_id[ids[i]]] for i in selected], dtype=np.int32)
+n = len(selected)
+
+lut = np.full(256, 4, dtype=np.uint8)
+for code, b in enumerate(BASES):
+    lut[ord(b)] = code
+    lut[ord(b.lower())] = code
+codes = lut[np.frombuffer("".join(seqs[i] for i in selected).encode("ascii"), dtype=np.uint8)].reshape(n, L)
+valid = codes < 4
+
+# Consultas evaluables: su especie tiene al menos otra secuencia seleccionada
+sp_count = np.bincount(labels, minlength=len(sp_names))
+evaluable = sp_count[labels] >= 2
+n_eval = int(evaluable.sum())
+
+print(f"Secuencias seleccionadas: {n} de {len(by_species)} especies ({n_eval} evaluables)")
+
+if n_eval == 0:
+    raise SystemExit("ERROR: Ninguna especie tiene 2 o más secuencias; no se puede evaluar leave-one-out.")
+
+# ==========================
+# 3) HAPLOTIPOS
+# ==========================
+
+# Las secuencias idénticas (mismos códigos en todo el core) están a distancia
+# idéntica de todas las demás en cualquier ventana: se compara haplotipo contra
+# haplotipo y cada uno pesa lo que sus copias. Las consultas se agrupan por
+# (haplotipo, especie), que es lo único que cambia su resultado.
+haps, hap_of = np.unique(codes, axis=0, return_inverse=True)
+hap_of = hap_of.ravel()
+n_haps = len(haps)
+hap_valid = haps < 4
+hap_count = np.bincount(hap_of, minlength=n_haps)
+
+n_sp = len(sp_names)
+pair_keys, pair_count = np.unique(hap_of.astype(np.int64) * n_sp + labels, return_counts=True)
+pair_hap = pair_keys // n_sp
+pair_sp = pair_keys % n_sp
+query_pairs = np.flatnonzero(sp_count[pair_sp] >= 2)
+
+print(f"Haplotipos distintos: {n_haps}; grupos de consulta (haplotipo, especie): {len(query_pairs)}")
+
+# ==========================
+# 4) VENTANAS CON SUMAS PREFIJAS POR BLOQUE
+# ==========================
+
+# Cada par (consulta, haplotipo) de una ventana se resume en un entero
+# clave = BASE * comparables + diferencias (las dos < BASE). La clave es
+# aditiva, así que con sumas prefijas sobre las columnas la de cualquier
+# ventana, de cualquier tamaño, es PK[fin] - PK[inicio]. Las sumas son int16 y
+# pueden dar la vuelta en alineamientos largos, pero la resta modular vuelve a
+# dar el valor exacto de la ventana porque éste entra en int16.
+windows = [W for W in WINDOW_SIZES if W <= L]
+for W in WINDOW_SIZES:
+    if W > L:
+        print(f"Ventana de {W} columnas es mayor que la longitud ({L}), se omite.")
+BASE = max(windows, default=0) + 1
+SIN_DATOS = np.int16(np.iinfo(np.int16).max)
+
+
+def tabla_rangos(W):
+    """
+    Clave -> rango de la p-distancia diferencias/comparables entre todas las
+    fracciones posibles (fracciones iguales, mismo rango), o SIN_DATOS si hay
+    menos de MIN_COMPARABLE * W posiciones comparables. Comparar rangos es
+    comparar distancias exactas, sin dividir.
+    """
+    min_comp = max(1, int(np.ceil(MIN_COMPARABLE * W)))
+    tabla = np.full(BASE * BASE, SIN_DATOS, dtype=np.int16)
+    fracs = [(m, c) for c in range(min_comp, W + 1) for m in range(c + 1)]
+    # Fracciones reducidas distintas con denominador <= W nunca dan el mismo float
+    reducida = {(m, c): (m // math.gcd(m, c), c // math.gcd(m, c)) for m, c in fracs}
+    orden = sorted(set(reducida.values()), key=lambda f: f[0] / f[1])
+    rango = {f: r for r, f in enumerate(orden)}
+    for (m, c), f in reducida.items():
+        tabla[BASE * c + m] = rango[f]
+    return tabla
+
+
+def prefijos(qh):
+    """
+    PK[c] = suma de las claves de las columnas < c, (L + 1) x consultas x
+    haplotipos. La clave de cada columna sale de un producto one-hot:
+    [base, válida] de la consulta contra [-base, (BASE + 1) * válida] del
+    haplotipo da BASE * comparable + diferente.
+    """
+    PK = np.zeros((L + 1, len(qh), n_haps), dtype=np.int16)
+    for c in range(L):
+        np.add(PK[c], (hap_oh[qh, c] @ hap_oh_ref[c]).astype(np.int16), out=PK[c + 1])
+    return PK
+
+
+def evaluar(clave, tabla, qh, solo, mismos, peso, rango):
+    """
+    Suma de la precisión 1-NN (con empates) de los grupos de consulta del
+    bloque, pesada por la cantidad de consultas de cada grupo. 'mismos' son
+    las celdas (fila, haplotipo, copias) de la misma especie de cada fila.
+    """
+    np.take(tabla, clave, out=rango)
+    filas = np.arange(len(qh))
+    rango[filas[solo], qh[solo]] = SIN_DATOS  # leave-one-out: el haplotipo no tiene otra copia
+    rmin = rango.min(axis=1)
+    tied = rango == rmin[:, None]
+    propio = tied[filas, qh]                  # la consulta misma no cuenta
+    n_tied = tied.astype(np.float32) @ hap_count_f - propio
+    fila_s, hap_s, copias_s = mismos
+    n_same = np.bincount(fila_s, weights=tied[fila_s, hap_s] * copias_s, minlength=len(qh)) - propio
+    n_tied[rmin == SIN_DATOS] = 0
+    frac = np.divide(n_same, n_tied, out=np.zeros(len(qh)), where=n_tied > 0)
+    return float((frac * peso).sum())
+
+
+def celdas_misma_especie(qsp):
+    """(fila, haplotipo, copias) de los haplotipos con la especie de cada fila del bloque."""
+    fila_s, hap_s, copias_s = [], [], []
+    for f, sp in enumerate(qsp):
+        a, b = sp_pairs[sp], sp_pairs[sp + 1]
+        fila_s.append(np.full(b - a, f))
+        hap_s.append(pair_hap[by_sp_order[a:b]])
+        copias_s.append(pair_count[by_sp_order[a:b]])
+    return np.concatenate(fila_s), np.concatenate(hap_s), np.concatenate(copias_s)
+
+
+hap_count_f = hap_count.astype(np.float32)
+hap_oh = np.zeros((n_haps, L, 5), dtype=np.float32)   # A, C, G, T, válida
+hap_oh[np.arange(n_haps)[:, None], np.arange(L)[None, :], np.minimum(haps, 4)] = 1.0
+hap_oh[:, :, 4] = hap_valid
+hap_oh_ref = np.concatenate([-hap_oh[:, :, :4], (BASE + 1) * hap_oh[:, :, 4:]], axis=2)
+hap_oh_ref = np.ascontiguousarray(hap_oh_ref.transpose(1, 2, 0))   # columna x 5 x haplotipos
+by_sp_order = np.argsort(pair_sp, kind="stable")
+sp_pairs = np.searchsorted(pair_sp[by_sp_order], np.arange(n_sp + 1))
+tablas = {W: tabla_rangos(W) for W in windows}
+acc = {W: np.zeros(L - W + 1) for W in windows}
+
+t0 = time.perf_counter()
+for b0 in range(0, len(query_pairs), BLOCK):
+    bloque = query_pairs[b0:b0 + BLOCK]
+    qh = pair_hap[bloque]
+    qsp = pair_sp[bloque]
+    solo = hap_count[qh] == 1
+    mismos = celdas_misma_especie(qsp)
+    PK = prefijos(qh)
+    clave = np.empty((len(qh), n_haps), dtype=np.int16)
+    rango = np.empty((len(qh), n_haps), dtype=np.int16)
+    for W, curve in acc.items():
+        for start in range(L - W + 1):
+            np.subtract(PK[start + W], PK[start], out=clave)
+            curve[start] += evaluar(clave, tablas[W], qh, solo, mismos, pair_count[bloque], rango)
+    print(f"  Grupos de consulta procesados: {min(b0 + BLOCK, len(query_pairs))}/{len(query_pairs)} "
+          f"({time.perf_counter() - t0:.1f} s)")
+
+# ==========================
+# 5) ESCRIBIR CURVA
+# ==========================
+
+with open(OUT_FILE, "w") as out:
+    out.write("win_size\tstart\tend\tloo_1nn_accuracy\tn_queries\n")
+    for W, curve in acc.items():
+        for start, total in enumerate(curve):
+            out.write(f"{W}\t{start}\t{start + W}\t{total / n_eval:.5f}\t{n_eval}\n")
+
+print(f"Curva de precisión escrita en: {OUT_FILE}")
+
+print("Mejor ventana por tamaño:")
+for W, curve in acc.items():
+    best = int(curve.argmax())
+    print(f"  ventana {W}: columnas {best}-{best + W}  precisión 1-NN = {curve[best] / n_eval:.4f}")
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+"""
+Tabla compacta de IDs de secuencia con índice hash.
+
+Los IDs (por ejemplo "HM434648.1.<1.>658") hoy viven como str sueltos en cada
+script y se cruzan con diccionarios. Acá se guardan:
+- buf.npy:     todos los IDs concatenados en un solo buffer de bytes (UTF-8,
+               así un ID con acentos o símbolos no rompe la tabla),
+- offsets.npy: offsets[i]:offsets[i+1] es el ID de la fila i,
+- hashes.npy:  hash de 64 bits de cada ID,
+- table.npy:   índice de direccionamiento abierto (sondeo lineal) hash -> fila.
+
+Son .npy sin comprimir para poder abrirlos con mmap desde cualquier etapa. La
+construcción y la búsqueda masiva (una lista de IDs contra la tabla) son
+vectorizadas: el hash se calcula columna a columna sobre una matriz de bytes y
+las colisiones se resuelven por rondas de sondeo sobre todos los pendientes.
+
+Uso:
+  python 11_tabla_ids.py build ../Raw/ids_fasta.txt --index ids_fasta.idx
+  python 11_tabla_ids.py join formicidae_ge600.ids --index ids_fasta.idx --out ge600_en_fasta.tsv
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+
+# ==========================
+# CONFIGURACIÓN
+# ==========================
+
+INDEX_DIR = "formicidae_ids.idx"
+CHUNK = 1_000_000       # IDs por bloque al hashear (acota la matriz de bytes)
+LOAD_FACTOR = 0.5       # ocupación máxima de la tabla hash
+
+FNV_OFFSET = np.uint64(0xCBF29CE484222325)
+FNV_PRIME = np.uint64(0x100000001B3)
+
+# ==========================
+# LECTURA DE LISTAS DE IDS
+# ==========================
+
+def leer_ids(path):
+    """
+    IDs de un FASTA (encabezados), o de un archivo de texto/TSV (primera
+    columna de cada línea).
+    """
+    ids = []
+    with open(path) as f:
+        first = f.readline()
+        f.seek(0)
+        if first.startswith(">"):
+            for line in f:
+                if line.startswith(">"):
+                    ids.append(line[1:].split()[0])
+        else:
+            for line in f:
+                line = line.rstrip("\n")
+                if line.strip():
+                    ids.append(line.split("\t")[0].strip())
+    return ids
+
+
+def empaquetar(ids):
+    """Lista de str -> (buffer uint8 con los IDs en UTF-8, offsets int64)."""
+    encoded = [s.encode("utf-8") for s in ids]
+    lengths = np.fromiter((len(b) for b in encoded), dtype=np.int64, count=len(encoded))
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    buf = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return buf, offsets
+
+# ==========================
+# HASH Y COMPARACIÓN VECTORIZADOS
+# ==========================
+
+def matriz_bytes(buf, offsets, rows):
+    """Bytes de las filas 'rows' como matriz (len(rows), largo máximo) rellena con 0."""
+    starts = offsets[rows]
+    lengths = offsets[rows + 1] - starts
+    width = int(lengths.max()) if len(rows) else 0
+    pos = np.arange(width)
+    mask = pos[None, :] < lengths[:, None]
+    idx = np.where(mask, starts[:, None] + pos[None, :], 0)
+    mat = buf[idx] if len(buf) else np.zeros(idx.shape, dtype=np.uint8)
+    mat[~mask] = 0
+    return mat, mask, lengths
+
+
+def hash_ids(buf, offsets):
+    """FNV-1a de 64 bits de cada ID, en bloques de CHUNK filas."""
+    n = len(offsets) - 1
+    out = np.empty(n, dtype=np.uint64)
+    for c0 in range(0, n, CHUNK):
+        rows = np.arange(c0, min(c0 + CHUNK, n))
+        mat, mask, lengths = matriz_bytes(buf, offsets, rows)
+        h = np.full(len(rows), FNV_OFFSET, dtype=np.uint64)
+        for k in range(mat.shape[1]):
+            hk = (h ^ mat[:, k].astype(np.uint64)) * FNV_PRIME
+            h = np.where(mask[:, k], hk, h)
+        out[c0:c0 + len(rows)] = (h ^ lengths.astype(np.uint64)) * FNV_PRIME
+    return out
+
+
+def iguales(buf_a, off_a, rows_a, buf_b, off_b, rows_b):
+    """Compara byte a byte los IDs rows_a (tabla A) con rows_b (tabla B)."""
+    if len(rows_a) == 0:
+        return np.zeros(0, dtype=bool)
+    ma, mask_a, la = matriz_bytes(buf_a, off_a, rows_a)
+    mb, mask_b, lb = matriz_bytes(buf_b, off_b, rows_b)
+    same_len = la == lb
+    w = min(ma.shape[1], mb.shape[1])
+    eq = (ma[:, :w] == mb[:, :w]).all(axis=1)
+    return same_len & eq
+
+# ==========================
+# TABLA
+# ==========================
+
+def construir_tabla(ids):
+    """Construye la tabla (IDs únicos, en el orden de primera aparición)."""
+    ids = list(dict.fromkeys(ids))
+    buf, offsets = empaquetar(ids)
+    hashes = hash_ids(buf, offsets)
+    n = len(ids)
+
+    size = 1
+    while size * LOAD_FACTOR < max(n, 1):
+        size <<= 1
+    mask = np.uint64(size - 1)
+    table = np.full(size, -1, dtype=np.int64)
+
+    pending = np.arange(n, dtype=np.int64)
+    slot = (hashes & mask).astype(np.int64)
+    while len(pending):
+        s = slot[pending]
+        free = table[s] == -1
+        # Entre los que caen en el mismo slot libre gana el primero
+        uniq, first = np.unique(s[free], return_index=True)
+        winners = pending[free][first]
+        table[uniq] = winners
+        placed = np.zeros(n, dtype=bool)
+        placed[winners] = True
+        pending = pending[~placed[pending]]
+        slot[pending] = (slot[pending] + 1) & (size - 1)
+
+    return {"buf": buf, "offsets": offsets, "hashes": hashes, "table": table}
+
+
+def guardar_tabla(tabla, path):
+    os.makedirs(path, exist_ok=True)
+    for name in ("buf", "offsets", "hashes", "table"):
+        np.save(os.path.join(path, f"{name}.npy"), tabla[name])
+
+
+def cargar_tabla(path, mmap=True):
+    mode = "r" if mmap else None
+    return {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode)
+            for name in ("buf", "offsets", "hashes", "table")}
+
+
+def id_de_fila(tabla, i):
+    return bytes(tabla["buf"][tabla["offsets"][i]:tabla["offsets"][i + 1]]).decode("utf-8")
+
+
+def buscar(tabla, ids):
+    """
+    Búsqueda masiva: fila de cada ID de 'ids' en la tabla, o -1 si no está.
+    """
+    q_buf, q_off = empaquetar(ids)
+    q_hash = hash_ids(q_buf, q_off)
+    table = tabla["table"]
+    size = len(table)
+    m = len(ids)
+
+    result = np.full(m, -1, dtype=np.int64)
+    pending = np.arange(m, dtype=np.int64)
+    slot = (q_hash & np.uint64(size - 1)).astype(np.int64)
+    while len(pending):
+        cand = table[slot[pending]]
+        vacio = cand == -1
+        ocupado = ~vacio
+        p = pending[ocupado]
+        r = cand[ocupado]
+        match = tabla["hashes"][r] == q_hash[p]
+        if match.any():
+            ok = iguales(tabla["buf"], tabla["offsets"], r[match], q_buf, q_off, p[match])
+            result[p[match][ok]] = r[match][ok]
+        # Siguen sondeando los que encontraron un slot ocupado por otro ID
+        resolved = np.zeros(m, dtype=bool)
+        resolved[pending[vacio]] = True
+        resolved[result >= 0] = True
+        pending = pending[~resolved[pending]]
+        slot[pending] = (slot[pending] + 1) & (size - 1)
+    return result
+
+# ==========================
+# PROGRAMA PRINCIPAL
+# ==========================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tabla compacta de IDs con índice hash.")
+    parser.add_argument("modo", choices=["build", "join"])
+    parser.add_argument("fuente", help="FASTA, lista de IDs o TSV (primera columna)")
+    parser.add_argument("--index", default=INDEX_DIR)
+    parser.add_argument("--out", default=None, help="(join) TSV con id y fila en la tabla")
+    args = parser.parse_args()
+
+    if args.modo == "build":
+        t0 = time.perf_counter()
+        ids = leer_ids(args.fuente)
+        tabla = construir_tabla(ids)
+        guardar_tabla(tabla, args.index)
+        n = len(tabla["offsets"]) - 1
+        nbytes = sum(tabla[k].nbytes for k in ("buf", "offsets", "hashes", "table"))
+        print(f"IDs leídos: {len(ids)} (únicos: {n})")
+        print(f"Tabla guardada en: {args.index} ({nbytes / 1e6:.1f} MB, {time.perf_counter() - t0:.2f} s)")
+    else:
+        tabla = cargar_tabla(args.index)
+        ids = leer_ids(args.fuente)
+        t0 = time.perf_counter()
+        filas = buscar(tabla, ids)
+        dt = time.perf_counter() - t0
+        encontrados = int((filas >= 0).sum())
+        print(f"IDs buscados: {len(ids)}, encontrados: {encontrados}, faltantes: {len(ids) - encontrados} "
+              f"({dt:.3f} s)")
+        if args.out:
+            with open(args.out, "w") as out:
+                out.write("seq_id\trow\n")
+                for sid, r in zip(ids, filas.tolist()):
+                    out.write(f"{sid}\t{r}\n")
+            print(f"Cruce escrito en: {args.out}")
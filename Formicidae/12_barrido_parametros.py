@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+
+"""
+Barrido de parámetros del core y de las ventanas con una sola carga del
+alineamiento.
+
+Reemplaza editar constantes y correr uno por uno 01_core_y_entropia.py,
+01_core_por_cobertura.py y 02_ventanas_entropy_coverage.py. Para cada
+combinación de la grilla
+  COVERAGE_THRESHOLD x WIN_SIZE x STEP x MIN_MEAN_COV x max_per_species
+se arma el core, se recorren sus ventanas, se filtran por cobertura media y
+se rankean por el cociente inter/intra de distancias p (como en
+01_core_por_cobertura.py) y por entropía media (como en 02_...).
+
+Lo común a varias combinaciones se calcula una sola vez:
+- conteos por columna (cobertura y entropía): uno para toda la grilla,
+- cores: uno por umbral de cobertura,
+- sumas intra/inter de cada ventana: una por (columnas, max_per_species),
+  aunque aparezca en varias combinaciones de WIN_SIZE/STEP/umbral.
+Las sumas de ventana que faltan se reparten en un Pool de procesos y todo se
+guarda en el cache de cache_resultados.py, así que una grilla que se solapa
+con una anterior sólo calcula lo nuevo.
+
+Salida: una tabla con las ventanas rankeadas de cada combinación.
+
+Uso:
+  python 12_barrido_parametros.py --coverage 0.8 0.85 0.9 --win 30 60 --step 5 10 --max-per-species 10 20
+"""
+
+import argparse
+import itertools
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+from cache_resultados import CacheResultados, huella, huella_archivo
+
+# ==========================
+# CONFIGURACIÓN
+# ==========================
+
+ALN_FILE = "formicidae_ge600_aln.fasta"
+META_FILE = "Formicidae.metadata.tsv"   # metadata con columnas seq_id y species
+OUT_FILE = "barrido_ventanas.tsv"
+
+COVERAGE_THRESHOLDS = [0.85]
+WIN_SIZES = [60, 100]
+STEPS = [10, 20]
+MIN_MEAN_COVS = [0.70]
+MAX_PER_SPECIES = [20]
+
+TILE_ROWS = 512   # filas por bloque de distancias
+ROW_BLOCK = 1000  # filas por bloque al contar columnas
+N_PROCS = None    # None = todos los núcleos
+
+GAP = ord("-")
+
+# ==========================
+# LECTURA
+# ==========================
+
+def leer_alineamiento(path):
+    """IDs y matriz uint8 (secuencias x columnas) con los bytes del alineamiento."""
+    ids = []
+    seqs = []
+    with open(path) as f:
+        current_id = None
+        current_seq = []
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith(">"):
+                if current_id is not None:
+                    seqs.append("".join(current_seq))
+                current_id = line[1:].split()[0]
+                ids.append(current_id)
+                current_seq = []
+            else:
+                current_seq.append(line)
+        if current_id is not None:
+            seqs.append("".join(current_seq))
+
+    if not seqs:
+        raise SystemExit("ERROR: No se leyeron secuencias del archivo de alineamiento.")
+    L = len(seqs[0])
+    for sid, s in zip(ids, seqs):
+        if len(s) != L:
+            raise SystemExit(f"ERROR: La secuencia {sid} tiene longitud {len(s)} distinta de {L}.")
+    mat = np.frombuffer("".join(seqs).encode("ascii"), dtype=np.uint8).reshape(len(seqs), L)
+    return ids, mat
+
+
+def leer_especies(path):
+    species_by_id = {}
+    with open(path) as meta:
+        header = meta.readline().rstrip("\n").split("\t")
+        try:
+            id_idx = header.index("seq_id")
+            sp_idx = header.index("species")
+        except ValueError:
+            raise SystemExit("ERROR: La metadata debe tener columnas 'seq_id' y 'species' separadas por TAB.")
+        for line in meta:
+            if not line.strip():
+                continue
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) <= max(id_idx, sp_idx):
+                continue
+            species_by_id[cols[id_idx]] = cols[sp_idx]
+    return species_by_id
+
+# ==========================
+# CÁLCULOS COMPARTIDOS
+# ==========================
+
+def conteos_por_columna(mat):
+    """Matriz (columnas x 256) con la cantidad de cada byte por columna."""
+    n, L = mat.shape
+    counts = np.zeros(L * 256, dtype=np.int64)
+    base = (np.arange(L, dtype=np.int64) * 256)[None, :]
+    for r0 in range(0, n, ROW_BLOCK):
+        keys = base + mat[r0:r0 + ROW_BLOCK]
+        counts += np.bincount(keys.ravel(), minlength=L * 256)
+    return counts.reshape(L, 256)
+
+
+def stats_columnas(counts, n_seq):
+    """Cobertura y entropía de Shannon (bits, sin gaps) por columna, como 01_core_y_entropia.py."""
+    nongap = counts.copy()
+    nongap[:, GAP] = 0
+    total = nongap.sum(axis=1)
+    coverage = total / n_seq
+    p = nongap / np.maximum(total, 1)[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        logp = np.where(p > 0, np.log2(p), 0.0)
+    entropy = 0.0 - (p * logp).sum(axis=1)
+    return coverage, entropy
+
+
+def core_por_cobertura(coverage, threshold):
+    """Bloque contiguo más largo con cobertura >= threshold (el primero si hay empate)."""
+    good = np.concatenate([[False], coverage >= threshold, [False]])
+    edges = np.flatnonzero(np.diff(good.astype(np.int8)))
+    if len(edges) == 0:
+        return 0, 0
+    starts, ends = edges[0::2], edges[1::2]
+    best = int(np.argmax(ends - starts))
+    return int(starts[best]), int(ends[best])
+
+
+def seleccion_por_especie(ids, species_by_id, max_per_species):
+    """Filas (primeras max_per_species por especie) y código de especie de cada una."""
+    by_species = {}
+    for i, sid in enumerate(ids):
+        sp = species_by_id.get(sid)
+        if sp is not None:
+            by_species.setdefault(sp, []).append(i)
+    rows = sorted(i for idxs in by_species.values() for i in idxs[:max_per_species])
+    sp_code = {sp: k for k, sp in enumerate(sorted(by_species))}
+    codes = np.array([sp_code[species_by_id[ids[i]]] for i in rows], dtype=np.int64)
+    return np.array(rows, dtype=np.int64), codes
+
+# ==========================
+# SUMAS INTRA / INTER POR VENTANA (EN LOS PROCESOS)
+# ==========================
+
+MAT = None          # alineamiento por proceso (se carga en el inicializador del Pool)
+SELECCIONES = None  # max_per_species -> (filas, códigos de especie)
+
+
+def init_worker(mat, selecciones):
+    global MAT, SELECCIONES
+    MAT = mat
+    SELECCIONES = selecciones
+
+
+def sumas_intra_inter(frag, sp, tile_rows=TILE_ROWS):
+    """
+    Suma y cantidad de distancias p intra e inter especie sobre todos los
+    pares i < j de las filas de frag (bytes del alineamiento, una fila por
+    secuencia; sp = código de especie de cada fila). Comparables: posiciones
+    sin gap en ambas secuencias; diferencias: comparables con distinto
+    símbolo. También la usa 01_core_por_cobertura.py.
+    """
+    n_sel = len(frag)
+    nogap = (frag != GAP).astype(np.float32)
+    symbols = [s for s in np.unique(frag) if s != GAP]
+    onehot = np.concatenate([(frag == s).astype(np.float32) for s in symbols], axis=1)
+    sumas = np.zeros(4)  # suma intra, pares intra, suma inter, pares inter
+    for b0 in range(0, n_sel, tile_rows):
+        b1 = min(b0 + tile_rows, n_sel)
+        comp = (nogap[b0:b1] @ nogap[b0:].T).astype(np.float64)
+        same = (onehot[b0:b1] @ onehot[b0:].T).astype(np.float64)
+        d = np.divide(comp - same, comp, out=np.zeros(comp.shape), where=comp > 0)
+        upper = np.arange(b0, n_sel)[None, :] > np.arange(b0, b1)[:, None]
+        intra = upper & (sp[b0:b1, None] == sp[None, b0:])
+        inter = upper & ~intra
+        sumas += (d[intra].sum(), intra.sum(), d[inter].sum(), inter.sum())
+    return sumas
+
+
+def sumas_ventana(tarea):
+    """Sumas intra/inter de las columnas [start, end) de la selección max_per_species."""
+    max_per_species, start, end = tarea
+    rows, sp = SELECCIONES[max_per_species]
+    return tarea, sumas_intra_inter(MAT[rows, start:end], sp)
+
+# ==========================
+# PROGRAMA PRINCIPAL
+# ==========================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Barrido de parámetros de core y ventanas.")
+    parser.add_argument("--aln", default=ALN_FILE)
+    parser.add_argument("--meta", default=META_FILE)
+    parser.add_argument("--out", default=OUT_FILE)
+    parser.add_argument("--coverage", type=float, nargs="+", default=COVERAGE_THRESHOLDS)
+    parser.add_argument("--win", type=int, nargs="+", default=WIN_SIZES)
+    parser.add_argument("--step", type=int, nargs="+", default=STEPS)
+    parser.add_argument("--min-cov", type=float, nargs="+", default=MIN_MEAN_COVS)
+    parser.add_argument("--max-per-species", type=int, nargs="+", default=MAX_PER_SPECIES)
+    parser.add_argument("--procs", type=int, default=N_PROCS)
+    args = parser.parse_args()
+
+    print(f"Usando alineamiento: {args.aln}")
+    print(f"Usando metadata: {args.meta}")
+
+    # 1) Carga única del alineamiento y cálculos compartidos
+    t0 = time.perf_counter()
+    ids, mat = leer_alineamiento(args.aln)
+    n_seq, L = mat.shape
+    species_by_id = leer_especies(args.meta)
+    print(f"Secuencias leídas: {n_seq}, longitud: {L} columnas ({time.perf_counter() - t0:.1f} s)")
+
+    cache = CacheResultados()
+    aln_huella = huella_archivo(args.aln)
+    counts = cache.memo(cache.clave("conteos_columna", aln=aln_huella),
+                        lambda: {"counts": conteos_por_columna(mat)})["counts"]
+    coverage, entropy = stats_columnas(counts, n_seq)
+    cov_acum = np.concatenate([[0.0], np.cumsum(coverage)])
+    ent_acum = np.concatenate([[0.0], np.cumsum(entropy)])
+
+    cores = {thr: core_por_cobertura(coverage, thr) for thr in args.coverage}
+    for thr, (cs, ce) in cores.items():
+        print(f"Core con cobertura >= {thr}: columnas {cs} - {ce} (longitud: {ce - cs})")
+
+    selecciones = {}
+    sel_huellas = {}
+    for mps in args.max_per_species:
+        rows, codes = seleccion_por_especie(ids, species_by_id, mps)
+        if len(rows) == 0:
+            raise SystemExit("ERROR: Ninguna secuencia del alineamiento tiene especie en la metadata.")
+        selecciones[mps] = (rows, codes)
+        sel_huellas[mps] = huella([[ids[i], species_by_id[ids[i]]] for i in rows])
+        print(f"Selección con máximo {mps} por especie: {len(rows)} secuencias")
+
+    # 2) Ventanas de cada combinación (las que pasan el filtro de cobertura)
+    grilla = list(itertools.product(args.coverage, args.win, args.step, args.min_cov, args.max_per_species))
+    ventanas = {}
+    tareas = set()
+    for punto in grilla:
+        thr, W, step, min_cov, mps = punto
+        cs, ce = cores[thr]
+        lista = []
+        for start in range(cs, ce - W + 1, step):
+            end = start + W
+            mean_cov = (cov_acum[end] - cov_acum[start]) / W
+            if mean_cov < min_cov:
+                continue
+            mean_ent = (ent_acum[end] - ent_acum[start]) / W
+            lista.append((start, end, mean_cov, mean_ent))
+            tareas.add((mps, start, end))
+        ventanas[punto] = lista
+    print(f"Combinaciones en la grilla: {len(grilla)}, ventanas distintas a evaluar: {len(tareas)}")
+
+    # 3) Sumas intra/inter: cache primero, lo que falta en paralelo
+    sumas = {}
+    claves = {}
+    faltan = []
+    for tarea in sorted(tareas):
+        mps, start, end = tarea
+        claves[tarea] = cache.clave("ventana_intra_inter_aln", aln=aln_huella, seleccion=sel_huellas[mps],
+                                    start=start, end=end)
+        res = cache.obtener(claves[tarea])
+        if res is None:
+            faltan.append(tarea)
+        else:
+            sumas[tarea] = res["sumas"]
+    print(f"Ventanas ya calculadas en cache: {len(sumas)}, por calcular: {len(faltan)}")
+
+    t0 = time.perf_counter()
+    if faltan:
+        with Pool(args.procs, initializer=init_worker, initargs=(mat, selecciones)) as pool:
+            for k, (tarea, s) in enumerate(pool.imap_unordered(sumas_ventana, faltan), 1):
+                sumas[tarea] = s
+                cache.guardar(claves[tarea], sumas=s)
+                if k % 20 == 0 or k == len(faltan):
+                    print(f"  Ventanas calculadas: {k}/{len(faltan)} ({time.perf_counter() - t0:.1f} s)")
+
+    # 4) Tabla consolidada
+    n_rows = 0
+    with open(args.out, "w") as out:
+        out.write("coverage_threshold\twin_size\tstep\tmin_mean_cov\tmax_per_species\tcore_start\tcore_end\t"
+                  "rank_ratio\trank_entropy\tstart\tend\tmean_coverage\tmean_entropy\t"
+                  "mean_intra\tmean_inter\tratio\n")
+        for punto in grilla:
+            thr, W, step, min_cov, mps = punto
+            cs, ce = cores[thr]
+            filas = []
+            for start, end, mean_cov, mean_ent in ventanas[punto]:
+                sum_intra, n_intra, sum_inter, n_inter = sumas[(mps, start, end)]
+                if not (n_intra and n_inter):
+                    continue
+                mean_intra = sum_intra / n_intra
+                mean_inter = sum_inter / n_inter
+                ratio = mean_inter / (mean_intra + 1e-6)
+                filas.append([start - cs, end - cs, mean_cov, mean_ent, mean_intra, mean_inter, ratio])
+            if not filas:
+                print(f"  {punto}: sin ventanas que cumplan el criterio de cobertura")
+                continue
+            por_entropia = sorted(range(len(filas)), key=lambda k: filas[k][3], reverse=True)
+            rank_ent = {k: r for r, k in enumerate(por_entropia, 1)}
+            orden = sorted(range(len(filas)), key=lambda k: filas[k][6], reverse=True)
+            for r, k in enumerate(orden, 1):
+                start, end, mc, me, mi, mx, ratio = filas[k]
+                out.write(f"{thr}\t{W}\t{step}\t{min_cov}\t{mps}\t{cs}\t{ce}\t{r}\t{rank_ent[k]}\t"
+                          f"{start}\t{end}\t{mc:.5f}\t{me:.5f}\t{mi:.6f}\t{mx:.6f}\t{ratio:.4f}\n")
+                n_rows += 1
+            best = filas[orden[0]]
+            print(f"  cov>={thr} W={W} step={step} min_cov={min_cov} max/sp={mps}: "
+                  f"mejor ventana {best[0]}-{best[1]} ratio={best[6]:.2f}")
+
+    print(cache.resumen())
+    print(f"Tabla consolidada ({n_rows} filas) escrita en: {args.out}")
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+
+"""
+Embedding de k-meros, grafo de vecinos aproximado y layout 2-D para todo el
+dataset con memoria acotada.
+
+La proyección UMAP del README (umap_clusters_labeled_k5.png) usa sólo 50.000
+de las 1.7M secuencias porque el embedding exacto con k = 5 no escala. Acá:
+
+1) Vectores: el FASTA se lee en streaming por bloques; cada proceso calcula
+   las frecuencias de k-meros (4^k columnas) de su bloque y las reduce con
+   una proyección aleatoria rala (Achlioptas / Li: entradas 0 o ±1). Los
+   vectores normalizados se escriben a un .npy en disco (memmap).
+2) Grafo kNN aproximado por LSH: N_TABLES tablas de hiperplanos aleatorios
+   (SimHash, similitud coseno). En cada tabla se ordenan los puntos por su
+   firma y se cortan en bloques de BLOCK puntos consecutivos; dentro de cada
+   bloque se calculan las distancias exactas y se actualizan los K vecinos
+   de cada punto. Los bloques se reparten en el Pool. Después, N_DESCENT
+   rondas de NN-descent (comparar con los vecinos de los vecinos) completan
+   lo que las tablas no juntaron.
+3) Layout: un subconjunto de MAX_LANDMARKS puntos (landmarks) se proyecta
+   con UMAP (o PCA si umap-learn no está instalado); el resto hereda la
+   posición media de sus vecinos ya ubicados, propagando por el grafo.
+
+Con un FASTA de 50.000 secuencias, --dim 0 (sin proyección) y --k 5 todos
+los puntos son landmarks y se proyectan directamente con UMAP, así que el
+layout es comparable al de k = 5 del README. No es el mismo: acá los vectores
+se normalizan (L2) y UMAP corre con los parámetros de este script.
+
+Salidas (en --out-dir): ids.txt, vectors.npy, knn_idx.npy, knn_dist.npy,
+layout_2d.npy y layout_2d.tsv.
+"""
+
+import argparse
+import os
+import time
+from multiprocessing import Pool
+
+import numpy as np
+
+try:
+    import umap
+except ImportError:
+    umap = None
+
+# ==========================
+# CONFIGURACIÓN
+# ==========================
+
+IN_FILE = "../Raw/COI.fasta"
+OUT_DIR = "embedding_k5"
+
+K_MER = 5
+DIM = 64               # dimensiones tras la proyección (0 = sin proyectar)
+N_NEIGHBORS = 15       # vecinos por punto en el grafo
+N_TABLES = 12          # tablas LSH
+N_BITS = 16            # bits de firma por tabla
+BLOCK = 256            # puntos por bloque de comparación exacta
+BLOCKS_PER_TASK = 64   # bloques por tarea enviada al Pool
+N_DESCENT = 1          # rondas de refinamiento NN-descent (vecinos de vecinos)
+DESCENT_ROWS = 500     # puntos por tarea en cada ronda de refinamiento
+MAX_LANDMARKS = 50000  # puntos proyectados directamente con UMAP/PCA
+CHUNK = 4000           # secuencias por bloque al calcular vectores
+SEED = 0
+N_PROCS = None         # None = todos los núcleos
+
+LUT = np.full(256, 4, dtype=np.int64)
+for code, b in enumerate("ACGT"):
+    LUT[ord(b)] = code
+    LUT[ord(b.lower())] = code
+
+# ==========================
+# LECTURA
+# ==========================
+
+def leer_fasta(path):
+    """Generador de (id, secuencia) leyendo el archivo en streaming."""
+    with open(path) as f:
+        current_id = None
+        current_seq = []
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith(">"):
+                if current_id is not None:
+                    yield current_id, "".join(current_seq)
+                current_id = line[1:].split()[0]
+                current_seq = []
+            else:
+                current_seq.append(line)
+        if current_id is not None:
+            yield current_id, "".join(current_seq)
+
+
+def en_bloques(records, size):
+    bloque = []
+    for rec in records:
+        bloque.append(rec)
+        if len(bloque) == size:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+
+def contar_registros(path):
+    """Cantidad de encabezados (los IDs pueden tener '>' adentro: se cuenta '\\n>')."""
+    n = 0
+    prev = b"\n"
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 26), b""):
+            n += chunk.count(b"\n>") + (prev == b"\n" and chunk[:1] == b">")
+            prev = chunk[-1:]
+    return n
+
+# ==========================
+# 1) VECTORES DE K-MEROS PROYECTADOS
+# ==========================
+
+def matriz_proyeccion(k, dim, seed):
+    """Proyección aleatoria rala 4^k x dim con densidad 1/sqrt(4^k)."""
+    D = 4 ** k
+    if dim == 0:
+        return None
+    rng = np.random.default_rng(seed)
+    s = np.sqrt(D)
+    u = rng.random((D, dim))
+    R = np.zeros((D, dim), dtype=np.float32)
+    R[u < 1 / (2 * s)] = 1.0
+    R[u > 1 - 1 / (2 * s)] = -1.0
+    return R
+
+
+PROY = None  # por proceso (se carga en el inicializador del Pool)
+K = K_MER
+
+
+def init_vectores(proy, k):
+    global PROY, K
+    PROY = proy
+    K = k
+
+
+def vectores_bloque(bloque):
+    """Frecuencias de k-meros de un bloque, proyectadas y normalizadas (L2)."""
+    n = len(bloque)
+    D = 4 ** K
+    # Se separan las secuencias con 'N' para que ningún k-mero cruce de una a otra
+    texto = "N".join(seq for _, seq in bloque) + "N"
+    c = LUT[np.frombuffer(texto.encode("ascii"), dtype=np.uint8)]
+    lens = np.array([len(seq) + 1 for _, seq in bloque], dtype=np.int64)
+    owner = np.repeat(np.arange(n), lens)
+
+    T = len(c) - K + 1
+    val = np.zeros(T, dtype=np.int64)
+    bad = np.zeros(T, dtype=bool)
+    for i in range(K):
+        ci = c[i:i + T]
+        val = val * 4 + np.minimum(ci, 3)
+        bad |= ci == 4
+    ok = ~bad
+    counts = np.bincount(owner[:T][ok] * D + val[ok], minlength=n * D).reshape(n, D).astype(np.float32)
+    counts /= np.maximum(counts.sum(axis=1, keepdims=True), 1.0)
+    X = counts if PROY is None else counts @ PROY
+    X /= np.maximum(np.linalg.norm(X, axis=1, keepdims=True), 1e-12)
+    return [sid for sid, _ in bloque], X.astype(np.float32)
+
+# ==========================
+# 2) GRAFO KNN POR LSH
+# ==========================
+
+VEC = None  # vectores (memmap) por proceso
+KNN = None  # vecinos actuales (memmap) por proceso, para el refinamiento
+
+
+def init_grafo(path, knn_path=None):
+    global VEC, KNN
+    VEC = np.load(path, mmap_mode="r")
+    KNN = np.load(knn_path, mmap_mode="r") if knn_path else None
+
+
+def vecinos_bloques(bloques):
+    """
+    bloques: (b, BLOCK) índices de puntos (-1 = relleno). Devuelve, para cada
+    punto real, sus mejores N_NEIGHBORS candidatos dentro de su bloque.
+    """
+    valid = bloques >= 0
+    X = np.asarray(VEC[np.where(valid, bloques, 0).ravel()]).reshape(bloques.shape + (VEC.shape[1],))
+    dist = 1.0 - np.matmul(X, X.transpose(0, 2, 1))
+    dist[~np.broadcast_to(valid[:, None, :], dist.shape)] = np.inf
+    idx = np.arange(bloques.shape[1])
+    dist[:, idx, idx] = np.inf
+    kk = min(N_NEIGHBORS, bloques.shape[1] - 1)
+    top = np.argpartition(dist, kk - 1, axis=2)[:, :, :kk]
+    cand_d = np.take_along_axis(dist, top, axis=2)
+    cand_i = np.take_along_axis(np.broadcast_to(bloques[:, None, :], dist.shape), top, axis=2)
+    cand_i = np.where(np.isfinite(cand_d), cand_i, -1)
+    return bloques[valid], cand_i[valid], cand_d[valid].astype(np.float32)
+
+
+def vecinos_de_vecinos(rango):
+    """Candidatos NN-descent para los puntos [r0, r1): vecinos de sus vecinos."""
+    r0, r1 = rango
+    nb = np.asarray(KNN[r0:r1])
+    cand = np.asarray(KNN[np.maximum(nb, 0).ravel()]).reshape(len(nb), -1)
+    cand = np.where(np.repeat(nb >= 0, nb.shape[1], axis=1), cand, -1)
+    X = np.asarray(VEC[r0:r1])
+    Y = np.asarray(VEC[np.maximum(cand, 0).ravel()]).reshape(cand.shape + (VEC.shape[1],))
+    dist = 1.0 - np.einsum("id,ikd->ik", X, Y)
+    rows = np.arange(r0, r1)
+    dist[(cand < 0) | (cand == rows[:, None])] = np.inf
+    kk = min(N_NEIGHBORS, cand.shape[1])
+    top = np.argpartition(dist, kk - 1, axis=1)[:, :kk]
+    cand_d = np.take_along_axis(dist, top, axis=1)
+    cand_i = np.where(np.isfinite(cand_d), np.take_along_axis(cand, top, axis=1), -1)
+    return rows, cand_i, cand_d.astype(np.float32)
+
+
+def combinar(knn_i, knn_d, p, new_i, new_d):
+    """Funde los vecinos actuales de los puntos p con candidatos nuevos (sin repetidos)."""
+    ci = np.concatenate([knn_i[p], new_i], axis=1)
+    cd = np.concatenate([knn_d[p], new_d], axis=1)
+    order = np.argsort(ci, axis=1, kind="stable")
+    ci = np.take_along_axis(ci, order, axis=1)
+    cd = np.take_along_axis(cd, order, axis=1)
+    dup = np.zeros(ci.shape, dtype=bool)
+    dup[:, 1:] = ci[:, 1:] == ci[:, :-1]
+    cd[dup | (ci < 0)] = np.inf
+    best = np.argsort(cd, axis=1, kind="stable")[:, :knn_i.shape[1]]
+    knn_i[p] = np.where(np.isfinite(np.take_along_axis(cd, best, axis=1)),
+                        np.take_along_axis(ci, best, axis=1), -1)
+    knn_d[p] = np.take_along_axis(cd, best, axis=1)
+
+
+def grafo_knn(vec_path, knn_path, n, procs):
+    vec = np.load(vec_path, mmap_mode="r")
+    rng = np.random.default_rng(SEED + 1)
+    knn_i = np.full((n, N_NEIGHBORS), -1, dtype=np.int32)
+    knn_d = np.full((n, N_NEIGHBORS), np.inf, dtype=np.float32)
+    pesos = 1 << np.arange(N_BITS, dtype=np.int64)
+
+    with Pool(procs, initializer=init_grafo, initargs=(vec_path,)) as pool:
+        for t in range(N_TABLES):
+            t0 = time.perf_counter()
+            H = rng.standard_normal((vec.shape[1], N_BITS + 1)).astype(np.float32)
+            firma = np.empty(n, dtype=np.int64)
+            desempate = np.empty(n, dtype=np.float32)
+            for c0 in range(0, n, 100_000):
+                P = np.asarray(vec[c0:c0 + 100_000]) @ H
+                firma[c0:c0 + len(P)] = (P[:, :N_BITS] > 0) @ pesos
+                desempate[c0:c0 + len(P)] = P[:, N_BITS]
+            order = np.lexsort((desempate, firma))
+            # Corrimiento distinto por tabla para que los cortes entre bloques no se repitan
+            shift = int(rng.integers(0, BLOCK))
+            order = np.concatenate([np.full(shift, -1), order])
+            pad = (-len(order)) % BLOCK
+            bloques = np.concatenate([order, np.full(pad, -1)]).reshape(-1, BLOCK)
+            tareas = (bloques[b0:b0 + BLOCKS_PER_TASK] for b0 in range(0, len(bloques), BLOCKS_PER_TASK))
+            for p, new_i, new_d in pool.imap(vecinos_bloques, tareas):
+                combinar(knn_i, knn_d, p, new_i, new_d)
+            print(f"  Tabla LSH {t + 1}/{N_TABLES} ({time.perf_counter() - t0:.1f} s)")
+
+    # Refinamiento NN-descent: los procesos leen el grafo de la ronda anterior desde disco
+    for r in range(N_DESCENT):
+        t0 = time.perf_counter()
+        np.save(knn_path, knn_i)
+        antes = knn_d.sum(dtype=np.float64, where=np.isfinite(knn_d))
+        with Pool(procs, initializer=init_grafo, initargs=(vec_path, knn_path)) as pool:
+            rangos = ((r0, min(r0 + DESCENT_ROWS, n)) for r0 in range(0, n, DESCENT_ROWS))
+            for p, new_i, new_d in pool.imap(vecinos_de_vecinos, rangos):
+                combinar(knn_i, knn_d, p, new_i, new_d)
+        despues = knn_d.sum(dtype=np.float64, where=np.isfinite(knn_d))
+        print(f"  Refinamiento {r + 1}/{N_DESCENT}: distancia media a los vecinos "
+              f"{antes / knn_d.size:.4f} -> {despues / knn_d.size:.4f} ({time.perf_counter() - t0:.1f} s)")
+    return knn_i, knn_d
+
+# ==========================
+# 3) LAYOUT 2-D
+# ==========================
+
+def layout_landmarks(X):
+    if umap is not None:
+        reducer = umap.UMAP(n_neighbors=N_NEIGHBORS, n_components=2, random_state=SEED)
+        return reducer.fit_transform(X).astype(np.float32), "UMAP"
+    Xc = X - X.mean(axis=0)
+    _, _, Vt = np.linalg.svd(Xc, full_matrices=False)
+    return (Xc @ Vt[:2].T).astype(np.float32), "PCA (umap-learn no instalado)"
+
+
+def layout_completo(vec, knn_i, knn_d, n):
+    rng = np.random.default_rng(SEED + 2)
+    if n <= MAX_LANDMARKS:
+        land = np.arange(n)
+    else:
+        land = np.sort(rng.choice(n, MAX_LANDMARKS, replace=False))
+    pos = np.full((n, 2), np.nan, dtype=np.float32)
+    pos[land], metodo = layout_landmarks(np.asarray(vec[land]))
+    print(f"Landmarks: {len(land)} ubicados con {metodo}")
+
+    # Propagación: cada punto sin ubicar toma la media (pesada por similitud)
+    # de sus vecinos ya ubicados, usando las aristas del grafo en ambos sentidos
+    ok = (knn_i >= 0).ravel()
+    src = np.repeat(np.arange(n, dtype=np.int32), knn_i.shape[1])[ok]
+    dst = knn_i.ravel()[ok]
+    w = (1.0 / (knn_d.ravel()[ok] + 1e-3)).astype(np.float32)
+    a, b, w = np.concatenate([src, dst]), np.concatenate([dst, src]), np.concatenate([w, w])
+    del src, dst
+    placed = np.zeros(n, dtype=bool)
+    placed[land] = True
+    ronda = 0
+    while not placed.all():
+        m = placed[a] & ~placed[b]
+        if not m.any():
+            break
+        am, bm, wm = a[m], b[m], w[m]
+        peso = np.bincount(bm, weights=wm, minlength=n)
+        nuevos = np.flatnonzero(peso > 0)
+        for j in range(2):
+            suma = np.bincount(bm, weights=wm * pos[am, j], minlength=n)
+            pos[nuevos, j] = suma[nuevos] / peso[nuevos]
+        placed[nuevos] = True
+        ronda += 1
+
+    # Componentes sin landmarks: landmark más cercano por fuerza bruta
+    resto = np.flatnonzero(~placed)
+    if len(resto):
+        L = np.asarray(vec[land])
+        for c0 in range(0, len(resto), 2000):
+            r = resto[c0:c0 + 2000]
+            pos[r] = pos[land[np.argmax(np.asarray(vec[r]) @ L.T, axis=1)]]
+    print(f"Propagación por el grafo: {ronda} rondas, {len(resto)} puntos ubicados por landmark más cercano")
+    return pos
+
+# ==========================
+# PROGRAMA PRINCIPAL
+# ==========================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embedding de k-meros, grafo kNN aproximado y layout 2-D.")
+    parser.add_argument("--in", dest="in_file", default=IN_FILE)
+    parser.add_argument("--out-dir", default=OUT_DIR)
+    parser.add_argument("--k", type=int, default=K_MER)
+    parser.add_argument("--dim", type=int, default=DIM)
+    parser.add_argument("--max-landmarks", type=int, default=MAX_LANDMARKS)
+    parser.add_argument("--procs", type=int, default=N_PROCS)
+    args = parser.parse_args()
+    K_MER = args.k
+    MAX_LANDMARKS = args.max_landmarks
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    vec_path = os.path.join(args.out_dir, "vectors.npy")
+    print(f"Usando FASTA: {args.in_file}")
+    print(f"k = {K_MER}, dimensiones: {args.dim or 4 ** K_MER}, vecinos: {N_NEIGHBORS}")
+
+    # 1) Vectores en streaming hacia un memmap
+    t0 = time.perf_counter()
+    n = contar_registros(args.in_file)
+    proy = matriz_proyeccion(K_MER, args.dim, SEED)
+    d = args.dim or 4 ** K_MER
+    vec = np.lib.format.open_memmap(vec_path, mode="w+", dtype=np.float32, shape=(n, d))
+    row = 0
+    with open(os.path.join(args.out_dir, "ids.txt"), "w") as fids, \
+            Pool(args.procs, initializer=init_vectores, initargs=(proy, K_MER)) as pool:
+        for ids, X in pool.imap(vectores_bloque, en_bloques(leer_fasta(args.in_file), CHUNK)):
+            vec[row:row + len(ids)] = X
+            fids.write("".join(f"{sid}\n" for sid in ids))
+            row += len(ids)
+    vec.flush()
+    del vec
+    if row != n:
+        raise SystemExit(f"ERROR: Se esperaban {n} registros y se leyeron {row}.")
+    print(f"Vectores de {n} secuencias escritos en: {vec_path} ({time.perf_counter() - t0:.1f} s)")
+
+    # 2) Grafo kNN
+    t0 = time.perf_counter()
+    knn_path = os.path.join(args.out_dir, "knn_idx.npy")
+    knn_i, knn_d = grafo_knn(vec_path, knn_path, n, args.procs)
+    np.save(knn_path, knn_i)
+    np.save(os.path.join(args.out_dir, "knn_dist.npy"), knn_d)
+    print(f"Grafo de {N_NEIGHBORS} vecinos escrito en: {args.out_dir} ({time.perf_counter() - t0:.1f} s)")
+
+    # 3) Layout
+    t0 = time.perf_counter()
+    pos = layout_completo(np.load(vec_path, mmap_mode="r"), knn_i, knn_d, n)
+    np.save(os.path.join(args.out_dir, "layout_2d.npy"), pos)
+    with open(os.path.join(args.out_dir, "ids.txt")) as fids, \
+            open(os.path.join(args.out_dir, "layout_2d.tsv"), "w") as out:
+        out.write("seq_id\tx\ty\n")
+        for sid, (x, y) in zip(fids, pos.tolist()):
+            out.write(f"{sid.rstrip()}\t{x:.4f}\t{y:.4f}\n")
+    print(f"Layout 2-D escrito en: {args.out_dir}/layout_2d.tsv ({time.perf_counter() - t0:.1f} s)")
@@ -0,0 +1,483 @@
+#!/usr/bin/env python3
+
+"""
+Clasificador en cascada familia -> género -> especie.
+
+Une los dos análisis del README: el modelo de k-meros (barato y muy preciso a
+nivel grueso) y el barcode corto que separa especies dentro de una familia.
+
+1) Familia: frecuencias de k-meros de la consulta contra un centroide por
+   familia (similitud coseno). Si el margen entre la mejor y la segunda
+   familia es chico, la consulta se queda en familia. Una consulta sin
+   ningún k-mero de ACGT (vector nulo) no se parece a nada: sale con NA y
+   exit_level "sin_datos".
+2) Género: lo mismo, pero sólo contra los géneros de esa familia. Si el
+   margen entre el mejor y el segundo género es chico, la consulta se queda
+   en género.
+3) Especie: sólo contra las referencias de barcode de las especies de ESE
+   género dentro de la familia, con la ventana de la familia
+   (barcodes_por_familia.tsv: familia, alineamiento de contexto, columna
+   inicial, columna final). El barcode de la consulta se ubica deslizando el
+   consenso del contexto sobre la secuencia. Si el género no tiene especies
+   con barcode de referencia, la consulta se queda en género.
+   a) Primero contra el consenso de cada especie: si hay coincidencia exacta
+      única o la segunda especie está a >= EXIT_MARGIN, salida temprana.
+   b) Si no, 1-NN contra todos los haplotipos de referencia del género.
+
+Así cada consulta se compara con los registros de su género en lugar de
+todo el dataset. Se informa el tiempo de cada nivel.
+
+Uso:
+  python 14_clasificador_cascada.py train --fasta ../Raw/COI.fasta --meta ../Raw/COI.metadata.tsv
+  python 14_clasificador_cascada.py classify --in consultas.fasta --out clasificacion_cascada.tsv
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+# ==========================
+# CONFIGURACIÓN
+# ==========================
+
+TRAIN_FASTA = "../Raw/COI.fasta"
+TRAIN_META = "../Raw/COI.metadata.tsv"   # columnas seq_id ... family genus species
+MODEL_FILE = "modelo_cascada_k5.npz"
+BARCODES_FILE = "barcodes_por_familia.tsv"
+IN_FILE = "consultas.fasta"
+OUT_FILE = "clasificacion_cascada.tsv"
+
+K_MER = 5
+CHUNK = 2000               # secuencias por bloque
+MIN_FAMILY_MARGIN = 0.01   # margen coseno mínimo para bajar de familia a género
+MIN_GENUS_MARGIN = 0.05    # margen coseno mínimo para bajar de género a especie
+EXIT_MARGIN = 0.10         # distancia entre 1ra y 2da especie (consenso) para salir temprano
+MIN_COMPARABLE = 20        # posiciones con base en ambas para que la distancia valga
+CONTEXT_MAX_GAP = 0.5      # columnas del contexto con más gaps no se usan para ubicar
+
+BASES = "ACGT"
+LUT = np.full(256, 4, dtype=np.uint8)
+for _code, _b in enumerate(BASES):
+    LUT[ord(_b)] = _code
+    LUT[ord(_b.lower())] = _code
+
+# ==========================
+# LECTURA
+# ==========================
+
+def leer_fasta(path):
+    """Generador de (id, secuencia) leyendo el archivo en streaming."""
+    with open(path) as f:
+        current_id = None
+        current_seq = []
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith(">"):
+                if current_id is not None:
+                    yield current_id, "".join(current_seq)
+                current_id = line[1:].split()[0]
+                current_seq = []
+            else:
+                current_seq.append(line)
+        if current_id is not None:
+            yield current_id, "".join(current_seq)
+
+
+def en_bloques(records, size):
+    bloque = []
+    for rec in records:
+        bloque.append(rec)
+        if len(bloque) == size:
+            yield bloque
+            bloque = []
+    if bloque:
+        yield bloque
+
+
+def leer_taxonomia(path):
+    """seq_id -> (family, genus, species)."""
+    tax = {}
+    with open(path) as meta:
+        header = meta.readline().rstrip("\n").split("\t")
+        try:
+            id_idx = header.index("seq_id")
+            cols_idx = [header.index(c) for c in ("family", "genus", "species")]
+        except ValueError:
+            raise SystemExit("ERROR: La metadata debe tener columnas 'seq_id', 'family', 'genus' y 'species'.")
+        for line in meta:
+            if not line.strip():
+                continue
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) <= max([id_idx] + cols_idx):
+                continue
+            tax[cols[id_idx]] = tuple(cols[i] for i in cols_idx)
+    return tax
+
+# ==========================
+# K-MEROS
+# ==========================
+
+def frecuencias_kmeros(seqs, k):
+    """Frecuencias de k-meros (n, 4^k) normalizadas (L2); sólo k-meros con ACGT."""
+    n = len(seqs)
+    D = 4 ** k
+    texto = "N".join(s.replace("-", "") for s in seqs) + "N"
+    c = LUT[np.frombuffer(texto.encode("ascii"), dtype=np.uint8)].astype(np.int64)
+    lens = np.array([len(s.replace("-", "")) + 1 for s in seqs], dtype=np.int64)
+    owner = np.repeat(np.arange(n), lens)
+    T = len(c) - k + 1
+    val = np.zeros(T, dtype=np.int64)
+    bad = np.zeros(T, dtype=bool)
+    for i in range(k):
+        ci = c[i:i + T]
+        val = val * 4 + np.minimum(ci, 3)
+        bad |= ci == 4
+    ok = ~bad
+    X = np.bincount(owner[:T][ok] * D + val[ok], minlength=n * D).reshape(n, D).astype(np.float32)
+    X /= np.maximum(np.linalg.norm(X, axis=1, keepdims=True), 1e-12)
+    return X
+
+
+def entrenar(fasta, meta, k, out):
+    tax = leer_taxonomia(meta)
+    families = sorted({t[0] for t in tax.values()})
+    genera = sorted({(t[0], t[1]) for t in tax.values()})
+    fam_idx = {f: i for i, f in enumerate(families)}
+    gen_idx = {g: i for i, g in enumerate(genera)}
+    D = 4 ** k
+    fam_sum = np.zeros((len(families), D), dtype=np.float64)
+    gen_sum = np.zeros((len(genera), D), dtype=np.float64)
+
+    n = 0
+    t0 = time.perf_counter()
+    for bloque in en_bloques(((sid, s) for sid, s in leer_fasta(fasta) if sid in tax), CHUNK):
+        X = frecuencias_kmeros([s for _, s in bloque], k)
+        fams = np.array([fam_idx[tax[sid][0]] for sid, _ in bloque])
+        gens = np.array([gen_idx[tax[sid][:2]] for sid, _ in bloque])
+        np.add.at(fam_sum, fams, X)
+        np.add.at(gen_sum, gens, X)
+        n += len(bloque)
+    if n == 0:
+        raise SystemExit("ERROR: Ninguna secuencia del FASTA tiene taxonomía en la metadata.")
+
+    def normalizar(M):
+        return (M / np.maximum(np.linalg.norm(M, axis=1, keepdims=True), 1e-12)).astype(np.float32)
+
+    np.savez(
+        out,
+        k=k,
+        families=np.array(families),
+        fam_centroids=normalizar(fam_sum),
+        genera=np.array([g for _, g in genera]),
+        genus_family=np.array([fam_idx[f] for f, _ in genera], dtype=np.int64),
+        genus_centroids=normalizar(gen_sum),
+    )
+    print(f"Secuencias de entrenamiento: {n} en {time.perf_counter() - t0:.1f} s")
+    print(f"Familias: {len(families)}, géneros: {len(genera)}")
+    print(f"Modelo escrito en: {out}")
+
+# ==========================
+# BARCODE POR FAMILIA
+# ==========================
+
+def one_hot(codes):
+    """codes (n, L) -> (n, L*4) float32 y máscara (n, L) de posiciones con base."""
+    n, L = codes.shape
+    valid = codes < 4
+    oh = np.zeros((n, L, 4), dtype=np.float32)
+    r, c = np.nonzero(valid)
+    oh[r, c, codes[r, c]] = 1.0
+    return oh.reshape(n, L * 4), valid.astype(np.float32)
+
+
+def cargar_barcode_familia(aln_file, start, end, tax):
+    """
+    Referencias de barcode de una familia, el consenso de contexto para
+    ubicarlo y, por género, sus especies y haplotipos (tax: seq_id ->
+    (family, genus, species)).
+    """
+    ids = []
+    seqs = []
+    for sid, s in leer_fasta(aln_file):
+        ids.append(sid)
+        seqs.append(s)
+    if not seqs:
+        raise SystemExit(f"ERROR: No se leyeron secuencias de {aln_file}.")
+    W = len(seqs[0])
+    for sid, s in zip(ids, seqs):
+        if len(s) != W:
+            raise SystemExit(f"ERROR: La secuencia {sid} de {aln_file} tiene longitud {len(s)} distinta de {W}.")
+    codes = LUT[np.frombuffer("".join(seqs).encode("ascii"), dtype=np.uint8)].reshape(len(seqs), W)
+    gap = np.frombuffer("".join(seqs).encode("ascii"), dtype=np.uint8).reshape(len(seqs), W) == ord("-")
+
+    # Consenso de las columnas del contexto que no son mayormente gap
+    context_cols = np.flatnonzero(gap.mean(axis=0) <= CONTEXT_MAX_GAP)
+    counts = np.stack([(codes[:, context_cols] == b).sum(axis=0) for b in range(4)])
+    context_cons = counts.argmax(axis=0).astype(np.uint8)
+
+    # Un representante por par (haplotipo de barcode, especie), ordenados por especie
+    first_by_pair = {}
+    bc_rows = {}
+    genus_by_sp = {}
+    for i, sid in enumerate(ids):
+        t = tax.get(sid)
+        if t is None:
+            continue
+        genus_by_sp.setdefault(t[2], t[1])
+        key = (t[2], seqs[i][start:end].upper())
+        if key not in first_by_pair:
+            first_by_pair[key] = sid
+            bc_rows[key] = i
+    if not first_by_pair:
+        raise SystemExit(f"ERROR: Ninguna secuencia de {aln_file} tiene especie en la metadata.")
+    pairs = sorted(first_by_pair)
+    species = [p[0] for p in pairs]
+    starts = [0] + [i for i in range(1, len(species)) if species[i] != species[i - 1]]
+    bc_codes = codes[[bc_rows[p] for p in pairs], start:end]
+    oh, valid = one_hot(bc_codes)
+
+    # Consenso de barcode por especie (mayoría por columna; sin bases -> inválida)
+    sp_of_pair = np.repeat(np.arange(len(starts)), np.diff(starts + [len(pairs)]))
+    cons_counts = np.zeros((len(starts), end - start, 4), dtype=np.int64)
+    r, c = np.nonzero(bc_codes < 4)
+    np.add.at(cons_counts, (sp_of_pair[r], c, bc_codes[r, c]), 1)
+    sp_cons = np.where(cons_counts.sum(axis=2) > 0, cons_counts.argmax(axis=2), 4).astype(np.uint8)
+    cons_oh, cons_valid = one_hot(sp_cons)
+
+    # Por género: índices de sus especies y de sus haplotipos (con los inicios
+    # de cada especie dentro de esa selección, para el mínimo con reduceat)
+    sp_names = [species[i] for i in starts]
+    sp_ends = starts[1:] + [len(pairs)]
+    por_genero = {}
+    for k, sp in enumerate(sp_names):
+        por_genero.setdefault(genus_by_sp[sp], []).append(k)
+    genus_refs = {}
+    for genus, sp_idx in por_genero.items():
+        sizes = [sp_ends[k] - starts[k] for k in sp_idx]
+        genus_refs[genus] = {
+            "species": np.array(sp_idx, dtype=np.int64),
+            "haps": np.concatenate([np.arange(starts[k], sp_ends[k]) for k in sp_idx]),
+            "hap_starts": np.concatenate(([0], np.cumsum(sizes)[:-1])).astype(np.int64),
+        }
+
+    return {
+        "L": end - start,
+        "start": start,
+        "width": W,
+        "context_cols": context_cols,
+        "context_cons": context_cons,
+        "ids": [first_by_pair[p] for p in pairs],
+        "oh": oh,
+        "valid": valid,
+        "sp_starts": np.array(starts, dtype=np.int64),
+        "sp_names": sp_names,
+        "cons_oh": cons_oh,
+        "cons_valid": cons_valid,
+        "genus_refs": genus_refs,
+    }
+
+
+def cargar_barcodes(path, tax):
+    refs = {}
+    with open(path) as f:
+        for line in f:
+            if not line.strip() or line.startswith("#"):
+                continue
+            cols = line.rstrip("\n").split("\t")
+            if cols[0] == "family":
+                continue
+            family, aln_file, start, end = cols[0], cols[1], int(cols[2]), int(cols[3])
+            refs[family] = cargar_barcode_familia(aln_file, start, end, tax)
+    return refs
+
+
+def ubicar_barcode(ref, seq):
+    """
+    Desliza el consenso del contexto sobre la consulta (sin gaps) y devuelve
+    los códigos del barcode en las columnas del alineamiento de la familia.
+    """
+    q = LUT[np.frombuffer(seq.replace("-", "").encode("ascii"), dtype=np.uint8)]
+    cons = ref["context_cons"]
+    m = len(cons)
+    qpad = np.concatenate([np.full(m - 1, 4, dtype=np.uint8), q, np.full(m - 1, 4, dtype=np.uint8)])
+    win = np.lib.stride_tricks.sliding_window_view(qpad, m)
+    off = int(((win == cons[None, :]) & (win < 4)).sum(axis=1).argmax())
+    row = np.full(ref["width"], 4, dtype=np.uint8)
+    row[ref["context_cols"]] = qpad[off:off + m]
+    return row[ref["start"]:ref["start"] + ref["L"]]
+
+
+def distancias(q_oh, q_valid, oh, valid):
+    matches = q_oh @ oh.T
+    comparable = q_valid @ valid.T
+    dist = np.float32(1.0) - matches / np.maximum(comparable, np.float32(1.0))
+    dist[comparable < MIN_COMPARABLE] = 1.0
+    return dist
+
+
+def dos_mejores(per_sp):
+    rows = np.arange(len(per_sp))
+    s1 = per_sp.argmin(axis=1)
+    d1 = per_sp[rows, s1]
+    n_tied = (per_sp == d1[:, None]).sum(axis=1)
+    if per_sp.shape[1] > 1:
+        tmp = per_sp.copy()
+        tmp[rows, s1] = np.inf
+        d2 = tmp.min(axis=1)
+    else:
+        d2 = np.full(len(per_sp), np.inf, dtype=per_sp.dtype)
+    return s1, d1, d2, n_tied
+
+# ==========================
+# CASCADA
+# ==========================
+
+NIVELES = ("familia", "genero", "especie_consenso", "especie_referencias", "sin_datos")
+
+
+def margen(scores):
+    """
+    Mejor índice y margen entre la mejor y la segunda similitud. Con un solo
+    candidato el margen es su similitud (contra una segunda de 0), así una
+    consulta que apenas se parece no baja de nivel sólo por no tener rival.
+    """
+    best = scores.argmax(axis=1)
+    if scores.shape[1] == 1:
+        return best, scores[:, 0].astype(np.float64)
+    top2 = np.partition(scores, -2, axis=1)[:, -2:]
+    return best, top2[:, 1] - top2[:, 0]
+
+
+def clasificar_bloque(modelo, refs, bloque, tiempos, comparaciones):
+    n = len(bloque)
+    seqs = [s for _, s in bloque]
+    res = [{"family": "", "family_margin": 0.0, "genus": "", "genus_margin": 0.0,
+            "species": "", "species_distance": "", "exit_level": "familia"} for _ in range(n)]
+
+    # 1) Familia
+    t0 = time.perf_counter()
+    X = frecuencias_kmeros(seqs, int(modelo["k"]))
+    fam, fam_m = margen(X @ modelo["fam_centroids"].T)
+    tiempos["familia"] += time.perf_counter() - t0
+    comparaciones["familia"] += n * len(modelo["families"])
+
+    # Sin k-meros válidos (secuencia corta, vacía o toda N): no hay clasificación
+    sin_datos = ~X.any(axis=1)
+    for r in np.flatnonzero(sin_datos):
+        res[r].update(family="NA", genus="NA", species="NA", exit_level="sin_datos")
+
+    for f in np.unique(fam[~sin_datos]):
+        rows = np.flatnonzero((fam == f) & ~sin_datos)
+        family = str(modelo["families"][f])
+        for r in rows:
+            res[r]["family"] = family
+            res[r]["family_margin"] = float(fam_m[r])
+        rows = rows[fam_m[rows] >= MIN_FAMILY_MARGIN]
+        if len(rows) == 0:
+            continue
+
+        # 2) Género, sólo entre los de la familia
+        t0 = time.perf_counter()
+        gidx = np.flatnonzero(modelo["genus_family"] == f)
+        gen, gen_m = margen(X[rows] @ modelo["genus_centroids"][gidx].T)
+        for r, g, gm in zip(rows, gen, gen_m):
+            res[r]["genus"] = str(modelo["genera"][gidx[g]])
+            res[r]["genus_margin"] = float(gm)
+            res[r]["exit_level"] = "genero"
+        tiempos["genero"] += time.perf_counter() - t0
+        comparaciones["genero"] += len(rows) * len(gidx)
+
+        ref = refs.get(family)
+        if ref is None:
+            continue
+
+        confiables = gen_m >= MIN_GENUS_MARGIN
+        for g in np.unique(gen[confiables]):
+            genus = str(modelo["genera"][gidx[g]])
+            cand = ref["genus_refs"].get(genus)
+            if cand is None:
+                continue  # el género no tiene especies con barcode: se queda en género
+            rows_g = rows[confiables & (gen == g)]
+            sp_idx = cand["species"]
+
+            # 3a) Especie contra el consenso de cada especie del género
+            t0 = time.perf_counter()
+            bc = np.stack([ubicar_barcode(ref, seqs[r]) for r in rows_g])
+            q_oh, q_valid = one_hot(bc)
+            per_sp = distancias(q_oh, q_valid, ref["cons_oh"][sp_idx], ref["cons_valid"][sp_idx])
+            s1, d1, d2, n_tied = dos_mejores(per_sp)
+            salida = ((d1 == 0) & (n_tied == 1)) | (d2 - d1 >= EXIT_MARGIN)
+            for k in np.flatnonzero(salida):
+                res[rows_g[k]].update(species=ref["sp_names"][sp_idx[s1[k]]], species_distance=f"{d1[k]:.4f}",
+                                      exit_level="especie_consenso")
+            tiempos["especie_consenso"] += time.perf_counter() - t0
+            comparaciones["especie_consenso"] += len(rows_g) * len(sp_idx)
+
+            # 3b) El resto, 1-NN contra todos los haplotipos del género
+            resto = np.flatnonzero(~salida)
+            if len(resto) == 0:
+                continue
+            t0 = time.perf_counter()
+            haps = cand["haps"]
+            dist = distancias(q_oh[resto], q_valid[resto], ref["oh"][haps], ref["valid"][haps])
+            per_sp = np.minimum.reduceat(dist, cand["hap_starts"], axis=1)
+            s1, d1, _, _ = dos_mejores(per_sp)
+            for k, r in enumerate(rows_g[resto]):
+                res[r].update(species=ref["sp_names"][sp_idx[s1[k]]], species_distance=f"{d1[k]:.4f}",
+                              exit_level="especie_referencias")
+            tiempos["especie_referencias"] += time.perf_counter() - t0
+            comparaciones["especie_referencias"] += len(resto) * len(haps)
+    return res
+
+# ==========================
+# PROGRAMA PRINCIPAL
+# ==========================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Clasificador en cascada familia -> género -> especie.")
+    parser.add_argument("modo", choices=["train", "classify"])
+    parser.add_argument("--fasta", default=TRAIN_FASTA, help="(train) FASTA de entrenamiento")
+    parser.add_argument("--meta", default=TRAIN_META, help="metadata con seq_id, family, genus, species")
+    parser.add_argument("--model", default=MODEL_FILE)
+    parser.add_argument("--barcodes", default=BARCODES_FILE)
+    parser.add_argument("--in", dest="in_file", default=IN_FILE)
+    parser.add_argument("--out", default=OUT_FILE)
+    parser.add_argument("--k", type=int, default=K_MER)
+    args = parser.parse_args()
+
+    if args.modo == "train":
+        entrenar(args.fasta, args.meta, args.k, args.model)
+        raise SystemExit(0)
+
+    modelo = dict(np.load(args.model))
+    tax = leer_taxonomia(args.meta)
+    refs = cargar_barcodes(args.barcodes, tax)
+    n_refs = sum(len(r["ids"]) for r in refs.values())
+    print(f"Modelo: {args.model} (k = {int(modelo['k'])}, {len(modelo['families'])} familias, "
+          f"{len(modelo['genera'])} géneros)")
+    print(f"Familias con barcode: {len(refs)} ({n_refs} haplotipos de referencia en total)")
+
+    tiempos = dict.fromkeys(NIVELES, 0.0)
+    comparaciones = dict.fromkeys(NIVELES, 0)
+    salidas = dict.fromkeys(NIVELES, 0)
+    n = 0
+    t0 = time.perf_counter()
+    with open(args.out, "w") as out:
+        out.write("seq_id\tfamily\tfamily_margin\tgenus\tgenus_margin\tspecies\tspecies_distance\texit_level\n")
+        for bloque in en_bloques(leer_fasta(args.in_file), CHUNK):
+            for (sid, _), r in zip(bloque, clasificar_bloque(modelo, refs, bloque, tiempos, comparaciones)):
+                out.write(f"{sid}\t{r['family']}\t{r['family_margin']:.4f}\t{r['genus']}\t"
+                          f"{r['genus_margin']:.4f}\t{r['species']}\t{r['species_distance']}\t{r['exit_level']}\n")
+                salidas[r["exit_level"]] += 1
+            n += len(bloque)
+    dt = time.perf_counter() - t0
+
+    print(f"Consultas clasificadas: {n} en {dt:.1f} s ({n / max(dt, 1e-9):.0f} consultas/s)")
+    print("Tiempo y comparaciones por nivel:")
+    for nivel in NIVELES:
+        print(f"  {nivel:20s} {tiempos[nivel]:8.2f} s  {comparaciones[nivel] / max(n, 1):10.1f} comparaciones/consulta"
+              f"  salidas: {salidas[nivel]}")
+    print(f"Resultados escritos en: {args.out}")
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+"""
+Colisiones de haplotipos entre especies para todas las ventanas.
+
+Una ventana no sirve como barcode para dos especies que comparten un
+haplotipo idéntico en ella, y el cociente de distancias medias de
+01_core_por_cobertura.py no lo muestra. Este script agrupa, para cada
+ventana, las secuencias con el mismo haplotipo y cuenta:
+  - haplotipos distintos,
+  - fracción de especies identificables sin ambigüedad (ninguno de sus
+    haplotipos aparece en otra especie),
+  - pares de especies que colisionan (comparten al menos un haplotipo).
+
+En vez de recortar y comparar strings, se calculan una vez los hashes
+polinomiales de todos los prefijos de cada secuencia (dos módulos primos, para
+que una colisión de hash sea despreciable). El hash de cualquier ventana sale
+de dos prefijos en O(1), así que cada ventana cuesta O(n) y todo un tamaño de
+ventana O(n·L). El gap y las bases ambiguas (todas como un mismo símbolo)
+son parte del haplotipo; las secuencias con más de MAX_MISSING de la ventana
+sin base no se usan en esa ventana.
+"""
+
+import time
+
+import numpy as np
+
+# ==========================
+# CONFIGURACIÓN
+# ==========================
+
+ALN_FILE = "formicidae_core_aln.fasta"
+META_FILE = "Formicidae.metadata.tsv"   # metadata con columnas seq_id y species
+
+WINDOW_SIZES = [20, 30, 40, 50, 60]
+MAX_MISSING = 0.1          # fracción máxima de la ventana con gap/ambigüedad
+MAX_PAIRS_PER_WINDOW = 500  # pares listados por ventana (los que comparten más haplotipos)
+
+OUT_FILE = "colisiones_por_ventana.tsv"
+PAIRS_FILE = "colisiones_pares.tsv"
+
+BASES = "ACGT"
+MOD1, MOD2 = 2147483647, 2147483629   # primos < 2^31: los productos entran en int64
+BASE1, BASE2 = 911382323, 972663749
+
+print(f"Usando alineamiento: {ALN_FILE}")
+print(f"Usando metadata: {META_FILE}")
+print(f"Tamaños de ventana: {WINDOW_SIZES}")
+
+# ==========================
+# 1) LEER METADATA Y ALINEAMIENTO
+# ==========================
+
+species_by_id = {}
+with open(META_FILE) as meta:
+    header = meta.readline().rstrip("\n").split("\t")
+    try:
+        id_idx = header.index("seq_id")
+        sp_idx = header.index("species")
+    except ValueError:
+        raise SystemExit("ERROR: La metadata debe tener columnas 'seq_id' y 'species' separadas por TAB.")
+    for line in meta:
+        if not line.strip():
+            continue
+        cols = line.rstrip("\n").split("\t")
+        if len(cols) <= max(id_idx, sp_idx):
+            continue
+        species_by_id[cols[id_idx]] = cols[sp_idx]
+
+ids = []
+seqs = []
+
+with open(ALN_FILE) as f:
+    current_id = None
+    current_seq = []
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith(">"):
+            if current_id is not None:
+                seqs.append("".join(current_seq))
+            current_id = line[1:].split()[0]
+            ids.append(current_id)
+            current_seq = []
+        else:
+            current_seq.append(line)
+    if current_id is not None:
+        seqs.append("".join(current_seq))
+
+if not seqs:
+    raise SystemExit("ERROR: No se leyeron secuencias del alineamiento.")
+
+L = len(seqs[0])
+for sid, s in zip(ids, seqs):
+    if len(s) != L:
+        raise SystemExit(f"ERROR: La secuencia {sid} tiene longitud {len(s)} distinta de {L}.")
+
+print(f"Secuencias en el alineamiento: {len(seqs)}, longitud: {L} columnas")
+
+# ==========================
+# 2) CODIFICACIÓN Y HASHES DE PREFIJOS
+# ==========================
+
+rows = [i for i, sid in enumerate(ids) if sid in species_by_id]
+if not rows:
+    raise SystemExit("ERROR: Ninguna secuencia del alineamiento tiene especie en la metadata.")
+
+sp_names = sorted({species_by_id[ids[i]] for i in rows})
+sp_code = {sp: k for k, sp in enumerate(sp_names)}
+labels = np.array([sp_code[species_by_id[ids[i]]] for i in rows], dtype=np.int64)
+n = len(rows)
+S = len(sp_names)
+
+# Símbolos 1..6: A C G T, gap y cualquier otra cosa (0 queda fuera para que
+# "A" y "" no tengan el mismo hash)
+lut = np.full(256, 6, dtype=np.int64)
+for code, b in enumerate(BASES):
+    lut[ord(b)] = code + 1
+    lut[ord(b.lower())] = code + 1
+lut[ord("-")] = 5
+sym = lut[np.frombuffer("".join(seqs[i] for i in rows).encode("ascii"), dtype=np.uint8)].reshape(n, L)
+
+print(f"Secuencias con especie: {n} de {S} especies")
+
+t0 = time.perf_counter()
+H1 = np.zeros((n, L + 1), dtype=np.int64)
+H2 = np.zeros((n, L + 1), dtype=np.int64)
+for j in range(L):
+    H1[:, j + 1] = (H1[:, j] * BASE1 + sym[:, j]) % MOD1
+    H2[:, j + 1] = (H2[:, j] * BASE2 + sym[:, j]) % MOD2
+
+# Sin base (gap o ambigüedad) acumulado, para filtrar por ventana también en O(1)
+missing = np.zeros((n, L + 1), dtype=np.int32)
+np.cumsum(sym >= 5, axis=1, out=missing[:, 1:])
+
+print(f"Hashes de prefijos calculados ({time.perf_counter() - t0:.1f} s)")
+
+
+def hash_ventana(start, W, pow1, pow2):
+    """Hash de 62 bits de la ventana [start, start+W) de cada secuencia."""
+    h1 = (H1[:, start + W] - H1[:, start] * pow1) % MOD1
+    h2 = (H2[:, start + W] - H2[:, start] * pow2) % MOD2
+    return (h1 << 31) | h2
+
+# ==========================
+# 3) COLISIONES POR VENTANA
+# ==========================
+
+def pares_que_colisionan(hap, sp):
+    """
+    (hap, sp) son pares haplotipo-especie únicos, ordenados por haplotipo.
+    Devuelve los pares de especies (a < b) que comparten haplotipo y cuántos.
+    """
+    starts = np.flatnonzero(np.r_[True, hap[1:] != hap[:-1]])
+    sizes = np.diff(np.r_[starts, len(hap)])
+    codes_ab = []
+    for k in np.unique(sizes[sizes >= 2]):
+        g = starts[sizes == k]
+        members = sp[g[:, None] + np.arange(k)[None, :]]  # (grupos, k), especies ordenadas
+        a, b = np.triu_indices(k, 1)
+        codes_ab.append((members[:, a] * S + members[:, b]).ravel())
+    if not codes_ab:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.unique(np.concatenate(codes_ab), return_counts=True)
+
+
+t0 = time.perf_counter()
+n_windows = 0
+with open(OUT_FILE, "w") as out, open(PAIRS_FILE, "w") as pairs_out:
+    out.write("win_size\tstart\tend\tn_seqs\tn_species\tn_haplotypes\t"
+              "frac_species_unique\tn_colliding_species\tn_colliding_pairs\n")
+    pairs_out.write("win_size\tstart\tend\tspecies_a\tspecies_b\tshared_haplotypes\n")
+
+    for W in WINDOW_SIZES:
+        if W > L:
+            print(f"Ventana de {W} columnas es mayor que la longitud ({L}), se omite.")
+            continue
+        pow1 = pow(BASE1, W, MOD1)
+        pow2 = pow(BASE2, W, MOD2)
+        max_missing = int(np.floor(MAX_MISSING * W))
+        best = None
+
+        for start in range(L - W + 1):
+            usable = (missing[:, start + W] - missing[:, start]) <= max_missing
+            h = hash_ventana(start, W, pow1, pow2)[usable]
+            lab = labels[usable]
+
+            # Pares (haplotipo, especie) únicos, ordenados por haplotipo y especie
+            order = np.lexsort((lab, h))
+            h, lab = h[order], lab[order]
+            first = np.r_[True, (h[1:] != h[:-1]) | (lab[1:] != lab[:-1])]
+            hap, sp = h[first], lab[first]
+
+            n_hap = int(np.count_nonzero(np.r_[True, hap[1:] != hap[:-1]])) if len(hap) else 0
+            present = np.zeros(S, dtype=bool)
+            present[sp] = True
+            shared = np.r_[hap[1:] == hap[:-1], False] | np.r_[False, hap[1:] == hap[:-1]]
+            colliding = np.zeros(S, dtype=bool)
+            colliding[sp[shared]] = True
+            n_present = int(present.sum())
+            n_coll = int(colliding.sum())
+            frac = (n_present - n_coll) / n_present if n_present else 0.0
+
+            pair_codes, pair_counts = pares_que_colisionan(hap, sp)
+            out.write(f"{W}\t{start}\t{start + W}\t{int(usable.sum())}\t{n_present}\t{n_hap}\t"
+                      f"{frac:.5f}\t{n_coll}\t{len(pair_codes)}\n")
+
+            top = np.argsort(-pair_counts, kind="stable")[:MAX_PAIRS_PER_WINDOW]
+            for code, cnt in zip(pair_codes[top], pair_counts[top]):
+                pairs_out.write(f"{W}\t{start}\t{start + W}\t{sp_names[code // S]}\t"
+                                f"{sp_names[code % S]}\t{cnt}\n")
+
+            if best is None or frac > best[0]:
+                best = (frac, start, n_hap, len(pair_codes))
+            n_windows += 1
+
+        frac, start, n_hap, n_pairs = best
+        print(f"  ventana {W}: mejor columnas {start}-{start + W}  especies identificables = {frac:.4f}  "
+              f"haplotipos = {n_hap}  pares que colisionan = {n_pairs}")
+
+print(f"Ventanas analizadas: {n_windows} ({time.perf_counter() - t0:.1f} s)")
+print(f"Resumen por ventana escrito en: {OUT_FILE}")
+print(f"Pares de especies que colisionan escritos en: {PAIRS_FILE}")
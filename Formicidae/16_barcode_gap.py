@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+
+"""
+Barcode gap exacto por especie y por ventana.
+
+01_core_por_cobertura.py y 10_precision_1nn_por_ventana.py miran distancias
+medias o la precisión 1-NN; el criterio clásico de DNA barcoding es el "gap":
+para cada especie, la mayor distancia intraespecífica contra la menor
+distancia a cualquier otra especie. Hay gap si min_inter > max_intra.
+
+Son estadísticos extremos (no salen de conteos por columna) y en forma
+ingenua piden los n² pares. Acá se evitan casi todos:
+  - Se trabaja con haplotipos únicos de la ventana, no con secuencias.
+  - Cada haplotipo se empaqueta en bits (un bitset por símbolo) y la
+    distancia es W - popcount(AND), sobre palabras de 64 bits.
+  - Pivotes (elegidos por el más lejano): con las distancias de cada
+    haplotipo a K pivotes, max_k |d(h,p_k) - d(g,p_k)| es una cota inferior
+    de d(h,g) (desigualdad triangular). Para la menor distancia inter de una
+    especie sólo se calculan los pares cuya cota es menor que la mejor
+    distancia ya encontrada para esa especie. Los haplotipos están ordenados
+    por distancia al primer pivote, así que los candidatos de un bloque de
+    consultas son un rango contiguo.
+  - Las distancias intra sólo se calculan dentro de cada especie.
+
+La distancia es Hamming sobre 5 símbolos (A, C, G, T y "sin base": gap o
+ambigüedad), dividida por W, para que sea una métrica y la poda sea exacta.
+Las secuencias con más de MAX_MISSING de la ventana sin base no se usan en
+esa ventana. nearest_species es una de las especies a distancia min_inter
+(con empates, la primera que se encontró).
+"""
+
+import time
+
+import numpy as np
+
+# ==========================
+# CONFIGURACIÓN
+# ==========================
+
+ALN_FILE = "formicidae_core_aln.fasta"
+META_FILE = "Formicidae.metadata.tsv"   # metadata con columnas seq_id y species
+
+WINDOW_SIZES = [30]
+STEP = 1
+MAX_MISSING = 0.1     # fracción máxima de la ventana con gap/ambigüedad
+N_PIVOTS = 8
+N_NEIGHBORS = 8       # vecinos en el orden por pivote para la cota inicial
+QUERY_BLOCK = 256     # haplotipos consulta por bloque
+SEED = 0
+
+SPECIES_FILE = "barcode_gap_por_especie.tsv"
+WINDOWS_FILE = "barcode_gap_por_ventana.tsv"
+
+BASES = "ACGT"
+
+print(f"Usando alineamiento: {ALN_FILE}")
+print(f"Usando metadata: {META_FILE}")
+print(f"Tamaños de ventana: {WINDOW_SIZES}, paso: {STEP}")
+
+# ==========================
+# 1) LEER METADATA Y ALINEAMIENTO
+# ==========================
+
+species_by_id = {}
+with open(META_FILE) as meta:
+    header = meta.readline().rstrip("\n").split("\t")
+    try:
+        id_idx = header.index("seq_id")
+        sp_idx = header.index("species")
+    except ValueError:
+        raise SystemExit("ERROR: La metadata debe tener columnas 'seq_id' y 'species' separadas por TAB.")
+    for line in meta:
+        if not line.strip():
+            continue
+        cols = line.rstrip("\n").split("\t")
+        if len(cols) <= max(id_idx, sp_idx):
+            continue
+        species_by_id[cols[id_idx]] = cols[sp_idx]
+
+ids = []
+seqs = []
+
+with open(ALN_FILE) as f:
+    current_id = None
+    current_seq = []
+    for line in f:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith(">"):
+            if current_id is not None:
+                seqs.append("".join(current_seq))
+            current_id = line[1:].split()[0]
+            ids.append(current_id)
+            current_seq = []
+        else:
+            current_seq.append(line)
+    if current_id is not None:
+        seqs.append("".join(current_seq))
+
+if not seqs:
+    raise SystemExit("ERROR: No se leyeron secuencias del alineamiento.")
+
+L = len(seqs[0])
+for sid, s in zip(ids, seqs):
+    if len(s) != L:
+        raise SystemExit(f"ERROR: La secuencia {sid} tiene longitud {len(s)} distinta de {L}.")
+
+print(f"Secuencias en el alineamiento: {len(seqs)}, longitud: {L} columnas")
+
+rows = [i for i, sid in enumerate(ids) if sid in species_by_id]
+if not rows:
+    raise SystemExit("ERROR: Ninguna secuencia del alineamiento tiene especie en la metadata.")
+
+sp_names = sorted({species_by_id[ids[i]] for i in rows})
+sp_code = {sp: k for k, sp in enumerate(sp_names)}
+labels = np.array([sp_code[species_by_id[ids[i]]] for i in rows], dtype=np.int64)
+n = len(rows)
+S = len(sp_names)
+
+lut = np.full(256, 4, dtype=np.uint8)
+for code, b in enumerate(BASES):
+    lut[ord(b)] = code
+    lut[ord(b.lower())] = code
+sym = lut[np.frombuffer("".join(seqs[i] for i in rows).encode("ascii"), dtype=np.uint8)].reshape(n, L)
+
+print(f"Secuencias con especie: {n} de {S} especies")
+
+# ==========================
+# 2) HAPLOTIPOS EMPAQUETADOS EN BITS
+# ==========================
+
+if hasattr(np, "bitwise_count"):
+    popcount = np.bitwise_count
+else:
+    _POP8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount(x):
+        return _POP8[x.view(np.uint8)].reshape(x.shape + (8,)).sum(axis=-1)
+
+
+def empaquetar(hap):
+    """(m, W) símbolos 0..4 -> (m, 5 * palabras) uint64, un bitset por símbolo."""
+    m, W = hap.shape
+    n_words = (W + 63) // 64
+    planes = []
+    for v in range(5):
+        bits = np.packbits(hap == v, axis=1, bitorder="little")
+        pad = np.zeros((m, n_words * 8 - bits.shape[1]), dtype=np.uint8)
+        planes.append(np.ascontiguousarray(np.hstack([bits, pad])).view(np.uint64))
+    return np.hstack(planes)
+
+
+def distancia(A, B, W):
+    """Hamming entre filas de A y B (misma forma, o B broadcast)."""
+    return W - popcount(A & B).sum(axis=-1, dtype=np.int64)
+
+
+def pares_dentro_de_grupos(starts, sizes):
+    """Índices (i, j), i < j, de todos los pares dentro de cada grupo contiguo."""
+    ii, jj = [], []
+    for k in np.unique(sizes[sizes >= 2]):
+        g = starts[sizes == k]
+        a, b = np.triu_indices(k, 1)
+        ii.append((g[:, None] + a[None, :]).ravel())
+        jj.append((g[:, None] + b[None, :]).ravel())
+    if not ii:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    return np.concatenate(ii), np.concatenate(jj)
+
+
+def actualizar_minimo(best_d, best_sp, esp, d, vecina):
+    """best_d[esp] = min(best_d[esp], d), guardando la especie vecina del mínimo."""
+    mejora = d < best_d[esp]
+    esp, d, vecina = esp[mejora], d[mejora], vecina[mejora]
+    if len(d) == 0:
+        return
+    order = np.lexsort((d, esp))
+    esp, d, vecina = esp[order], d[order], vecina[order]
+    first = np.r_[True, esp[1:] != esp[:-1]]
+    esp, d, vecina = esp[first], d[first], vecina[first]
+    mejor = d < best_d[esp]
+    best_d[esp[mejor]] = d[mejor]
+    best_sp[esp[mejor]] = vecina[mejor]
+
+
+def gap_ventana(start, W, rng):
+    """Barcode gap de todas las especies en la ventana [start, start+W)."""
+    max_missing = int(np.floor(MAX_MISSING * W))
+    usable = np.flatnonzero((sym[:, start:start + W] == 4).sum(axis=1) <= max_missing)
+    if len(usable) == 0:
+        # Ninguna secuencia con bases suficientes en la ventana: todo NA
+        vacio = np.zeros(S, dtype=np.int64)
+        return {
+            "n_usable": 0,
+            "n_haps": 0,
+            "present": vacio > 0,
+            "n_seqs": vacio,
+            "n_haps_sp": vacio,
+            "max_intra": vacio,
+            "min_inter": np.full(S, W + 1, dtype=np.int64),
+            "nearest": np.full(S, -1, dtype=np.int64),
+            "n_exact": 0,
+        }
+    lab = labels[usable]
+
+    # Haplotipos únicos: orden lexicográfico de las filas ya empaquetadas
+    packed_seq = empaquetar(sym[usable, start:start + W])
+    order = np.lexsort(packed_seq.T[::-1])
+    nuevo = np.r_[True, (packed_seq[order[1:]] != packed_seq[order[:-1]]).any(axis=1)]
+    hap_of_seq = np.empty(len(usable), dtype=np.int64)
+    hap_of_seq[order] = np.cumsum(nuevo) - 1
+    packed = packed_seq[order[nuevo]]
+    m = len(packed)
+
+    # Pares (haplotipo, especie) únicos
+    pair = np.unique(hap_of_seq * S + lab)
+    p_hap, p_sp = pair // S, pair % S
+    n_seqs = np.bincount(lab, minlength=S)
+    n_haps = np.bincount(p_sp, minlength=S)
+    hap_n_sp = np.bincount(p_hap, minlength=m)
+    first_sp = np.full(m, -1, dtype=np.int64)
+    first_sp[p_hap[::-1]] = p_sp[::-1]                       # especie menor de cada haplotipo
+    owner = np.where(hap_n_sp == 1, first_sp, -1)            # -1: haplotipo compartido
+
+    n_exact = 0
+
+    # Distancia máxima intra: pares dentro de cada especie (pares ordenados por especie)
+    order = np.argsort(p_sp, kind="stable")
+    hs, ss = p_hap[order], p_sp[order]
+    starts = np.flatnonzero(np.r_[True, ss[1:] != ss[:-1]])
+    sizes = np.diff(np.r_[starts, len(ss)])
+    ii, jj = pares_dentro_de_grupos(starts, sizes)
+    max_intra = np.zeros(S, dtype=np.int64)
+    if len(ii):
+        d = distancia(packed[hs[ii]], packed[hs[jj]], W)
+        np.maximum.at(max_intra, ss[ii], d)
+        n_exact += len(ii)
+
+    # Distancia mínima inter: 0 para las especies con un haplotipo compartido
+    best_d = np.full(S, W + 1, dtype=np.int64)
+    best_sp = np.full(S, -1, dtype=np.int64)
+    starts = np.flatnonzero(np.r_[True, p_hap[1:] != p_hap[:-1]])
+    sizes = np.diff(np.r_[starts, len(p_hap)])
+    ii, jj = pares_dentro_de_grupos(starts, sizes)
+    actualizar_minimo(best_d, best_sp, np.r_[p_sp[ii], p_sp[jj]], np.zeros(2 * len(ii), dtype=np.int64),
+                      np.r_[p_sp[jj], p_sp[ii]])
+
+    # Pivotes por el más lejano y orden por distancia al primero
+    piv = [int(rng.integers(m))]
+    dmin_piv = distancia(packed, packed[piv[0]][None, :], W)
+    piv = [int(dmin_piv.argmax())]
+    D = [distancia(packed, packed[piv[0]][None, :], W)]
+    dmin_piv = D[0].copy()
+    while len(piv) < min(N_PIVOTS, m):
+        piv.append(int(dmin_piv.argmax()))
+        D.append(distancia(packed, packed[piv[-1]][None, :], W))
+        np.minimum(dmin_piv, D[-1], out=dmin_piv)
+    n_exact += len(D) * m
+    D = np.stack(D, axis=1).astype(np.int16)
+    orden = np.argsort(D[:, 0], kind="stable")
+    D, packed, owner, first_sp = D[orden], packed[orden], owner[orden], first_sp[orden]
+    d0 = D[:, 0]
+
+    consultas = np.flatnonzero(owner >= 0)
+
+    # Cota inicial: vecinos en el orden por el primer pivote
+    offs = np.r_[np.arange(-N_NEIGHBORS, 0), np.arange(1, N_NEIGHBORS + 1)]
+    vec = np.clip(consultas[:, None] + offs[None, :], 0, m - 1)
+    q_rep = np.repeat(consultas, len(offs))
+    vec = vec.ravel()
+    ok = owner[vec] != owner[q_rep]
+    q_rep, vec = q_rep[ok], vec[ok]
+    d = distancia(packed[q_rep], packed[vec], W)
+    n_exact += len(d)
+    actualizar_minimo(best_d, best_sp, owner[q_rep], d, first_sp[vec])
+
+    # Búsqueda exacta con poda por pivotes
+    for b0 in range(0, len(consultas), QUERY_BLOCK):
+        q = consultas[b0:b0 + QUERY_BLOCK]
+        r = best_d[owner[q]]
+        q = q[r > 0]
+        r = r[r > 0]
+        if len(q) == 0:
+            continue
+        lo = np.searchsorted(d0, int(d0[q].min() - r.max() + 1), side="left")
+        hi = np.searchsorted(d0, int(d0[q].max() + r.max() - 1), side="right")
+        lb = np.abs(D[q, 0][:, None] - D[None, lo:hi, 0])
+        for k in range(1, D.shape[1]):
+            np.maximum(lb, np.abs(D[q, k][:, None] - D[None, lo:hi, k]), out=lb)
+        cand = (lb < r[:, None]) & (owner[None, lo:hi] != owner[q][:, None])
+        qi, ci = np.nonzero(cand)
+        ci += lo
+        d = distancia(packed[q[qi]], packed[ci], W)
+        n_exact += len(d)
+        actualizar_minimo(best_d, best_sp, owner[q[qi]], d, first_sp[ci])
+
+    present = n_seqs > 0
+    return {
+        "n_usable": len(usable),
+        "n_haps": m,
+        "present": present,
+        "n_seqs": n_seqs,
+        "n_haps_sp": n_haps,
+        "max_intra": max_intra,
+        "min_inter": best_d,
+        "nearest": best_sp,
+        "n_exact": n_exact,
+    }
+
+# ==========================
+# 3) RECORRER VENTANAS
+# ==========================
+
+rng = np.random.default_rng(SEED)
+t0 = time.perf_counter()
+total_exact = 0
+total_naive = 0
+n_windows = 0
+
+with open(SPECIES_FILE, "w") as sp_out, open(WINDOWS_FILE, "w") as win_out:
+    sp_out.write("win_size\tstart\tend\tspecies\tn_seqs\tn_haplotypes\tmax_intra\tmin_inter\t"
+                 "nearest_species\tgap\n")
+    win_out.write("win_size\tstart\tend\tn_seqs\tn_haplotypes\tn_species_eval\tn_gap_positive\t"
+                  "frac_gap_positive\tmean_gap\tmedian_gap\tn_distances\tn_naive_pairs\n")
+
+    for W in WINDOW_SIZES:
+        if W > L:
+            print(f"Ventana de {W} columnas es mayor que la longitud ({L}), se omite.")
+            continue
+        best = None
+        for start in range(0, L - W + 1, STEP):
+            res = gap_ventana(start, W, rng)
+            n_naive = res["n_usable"] * (res["n_usable"] - 1) // 2
+            total_exact += res["n_exact"]
+            total_naive += n_naive
+            n_windows += 1
+
+            # Evaluables: al menos 2 secuencias y alguna otra especie en la ventana
+            evaluable = (res["n_seqs"] >= 2) & (res["min_inter"] <= W)
+            gap = (res["min_inter"] - res["max_intra"]) / W
+            for s in np.flatnonzero(res["present"]):
+                tiene_inter = res["min_inter"][s] <= W
+                min_inter = f"{res['min_inter'][s] / W:.4f}" if tiene_inter else "NA"
+                nearest = sp_names[res["nearest"][s]] if tiene_inter else "NA"
+                max_intra = f"{res['max_intra'][s] / W:.4f}" if res["n_seqs"][s] >= 2 else "NA"
+                gap_s = f"{gap[s]:.4f}" if evaluable[s] else "NA"
+                sp_out.write(f"{W}\t{start}\t{start + W}\t{sp_names[s]}\t{res['n_seqs'][s]}\t"
+                             f"{res['n_haps_sp'][s]}\t{max_intra}\t{min_inter}\t{nearest}\t{gap_s}\n")
+
+            g = gap[evaluable]
+            n_pos = int((g > 0).sum())
+            frac = n_pos / len(g) if len(g) else 0.0
+            frac_s = f"{frac:.5f}" if len(g) else "NA"
+            mean_gap = f"{g.mean():.4f}" if len(g) else "NA"
+            median_gap = f"{np.median(g):.4f}" if len(g) else "NA"
+            win_out.write(f"{W}\t{start}\t{start + W}\t{res['n_usable']}\t{res['n_haps']}\t{len(g)}\t{n_pos}\t"
+                          f"{frac_s}\t{mean_gap}\t{median_gap}\t{res['n_exact']}\t{n_naive}\n")
+
+            if best is None or frac > best[0]:
+                best = (frac, start, n_pos, len(g))
+
+        frac, start, n_pos, n_eval = best
+        print(f"  ventana {W}: mejor columnas {start}-{start + W}  especies con gap = {n_pos}/{n_eval} ({frac:.4f})")
+
+print(f"Ventanas analizadas: {n_windows} ({time.perf_counter() - t0:.1f} s)")
+if total_naive:
+    print(f"Distancias calculadas: {total_exact} de {total_naive} pares de secuencias "
+          f"({100 * total_exact / total_naive:.2f}%)")
+print(f"Gap por especie escrito en: {SPECIES_FILE}")
+print(f"Gap por ventana escrito en: {WINDOWS_FILE}")
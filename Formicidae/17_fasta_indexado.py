@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+"""
+FASTA indexado (estilo samtools faidx) para extraer subconjuntos sin leer todo.
+
+Raw/ids_fasta.txt y formicidae_ge600.ids son listas de IDs que seleccionan
+registros del FASTA grande; sacar cualquier subconjunto (una familia, por
+ejemplo) obligaba a recorrer el archivo entero. Acá se indexa UNA vez:
+- fai.npy:    por registro, offset en bytes del inicio de la secuencia,
+              largo (bases), bases por línea y bytes por línea (con el \\n),
+- stat.npy:   tamaño y fecha del FASTA indexado (para detectar si cambió),
+- y la tabla de IDs de 11_tabla_ids.py (fila i del índice = registro i).
+
+La construcción recorre el archivo por bloques de registros completos con
+operaciones de NumPy sobre los bytes. Para extraer, los IDs se resuelven con
+la tabla hash, se ordenan por offset y cada registro se lee del FASTA mapeado
+en memoria (mmap): sólo se tocan las páginas de los registros pedidos, en
+orden de archivo.
+
+Como en faidx, todas las líneas de un registro salvo la última tienen que
+tener el mismo largo.
+
+Uso:
+  python 17_fasta_indexado.py index ../Raw/COI.fasta --index COI.fasta.idx
+  python 17_fasta_indexado.py fetch ../Raw/COI.fasta --index COI.fasta.idx --ids formicidae_ge600.ids --out sub.fasta
+  python 17_fasta_indexado.py fetch ../Raw/COI.fasta --index COI.fasta.idx --family Formicidae \\
+      --meta ../Raw/COI.metadata.tsv --out formicidae.fasta
+"""
+
+import argparse
+import importlib
+import mmap
+import os
+import time
+
+import numpy as np
+
+tabla_ids = importlib.import_module("11_tabla_ids")
+
+# ==========================
+# CONFIGURACIÓN
+# ==========================
+
+IN_FILE = "../Raw/COI.fasta"
+INDEX_DIR = "COI.fasta.idx"
+BLOCK_BYTES = 64 * 1024 ** 2   # bytes leídos por bloque al indexar
+LINE_WIDTH = 0                 # 0: secuencia en una sola línea al extraer
+
+FAI_DTYPE = np.dtype([
+    ("offset", np.uint64),
+    ("length", np.uint32),
+    ("line_bases", np.uint32),
+    ("line_width", np.uint32),
+])
+
+# ==========================
+# CONSTRUCCIÓN DEL ÍNDICE
+# ==========================
+
+def bloques_de_registros(path, size):
+    """(offset en el archivo, bytes) con registros completos (cortes antes de un '>')."""
+    with open(path, "rb") as f:
+        offset = 0
+        resto = b""
+        while True:
+            data = f.read(size)
+            if not data:
+                break
+            data = resto + data
+            cut = data.rfind(b"\n>")
+            while cut <= 0:
+                # Un registro más grande que el bloque: seguir leyendo
+                more = f.read(size)
+                if not more:
+                    break
+                data += more
+                cut = data.rfind(b"\n>")
+            if cut <= 0:
+                resto = data
+                break
+            yield offset, data[:cut + 1]
+            offset += cut + 1
+            resto = data[cut + 1:]
+        if resto:
+            if not resto.endswith(b"\n"):
+                resto += b"\n"
+            yield offset, resto
+
+
+def indexar_bloque(offset, data):
+    """IDs y filas de fai.npy de un bloque de registros completos."""
+    buf = np.frombuffer(data, dtype=np.uint8)
+    nl = np.flatnonzero(buf == 10)
+    starts = np.r_[0, nl[:-1] + 1]
+    is_header = buf[starts] == ord(">")
+    if len(starts) and not is_header[0]:
+        raise SystemExit(f"ERROR: Hay secuencia antes del primer encabezado (byte {offset}).")
+    line_len = nl - starts
+    line_len -= (line_len > 0) & (buf[np.maximum(nl - 1, 0)] == 13)  # \r\n
+    line_bytes = nl + 1 - starts
+
+    h = np.flatnonzero(is_header)
+    rec = np.cumsum(is_header) - 1
+    seq_line = ~is_header
+    n_rec = len(h)
+
+    fai = np.zeros(n_rec, dtype=FAI_DTYPE)
+    fai["length"] = np.bincount(rec[seq_line], weights=line_len[seq_line], minlength=n_rec).astype(np.uint32)
+    first = h + 1
+    tiene_seq = np.zeros(n_rec, dtype=bool)
+    dentro = first < len(starts)
+    tiene_seq[dentro] = seq_line[first[dentro]]
+    fl = np.where(tiene_seq, first, 0)
+    fai["offset"] = offset + np.where(tiene_seq, starts[fl], nl[h] + 1)
+    fai["line_bases"] = np.where(tiene_seq, line_len[fl], 0)
+    fai["line_width"] = np.where(tiene_seq, line_bytes[fl], 0)
+
+    # Todas las líneas salvo la última del registro con el mismo largo
+    ultima = np.r_[is_header[1:], True]
+    lb = fai["line_bases"][rec].astype(np.int64)
+    lw = fai["line_width"][rec].astype(np.int64)
+    mal = seq_line & (((~ultima) & ((line_len != lb) | (line_bytes != lw))) | (ultima & (line_len > lb)))
+    if mal.any():
+        i = int(np.flatnonzero(mal)[0])
+        r = int(rec[i])
+        sid = data[starts[h[r]] + 1:nl[h[r]]].split()[0].decode("ascii")
+        raise SystemExit(f"ERROR: El registro {sid} tiene líneas de largo distinto; reformatear el FASTA "
+                         f"con un largo de línea fijo antes de indexar.")
+
+    ids = [data[s + 1:e].split()[0].decode("ascii") for s, e in zip(starts[h].tolist(), nl[h].tolist())]
+    return ids, fai
+
+
+def construir_indice(path, index_dir):
+    t0 = time.perf_counter()
+    ids = []
+    partes = []
+    for offset, data in bloques_de_registros(path, BLOCK_BYTES):
+        b_ids, fai = indexar_bloque(offset, data)
+        ids.extend(b_ids)
+        partes.append(fai)
+    if not ids:
+        raise SystemExit(f"ERROR: No se encontraron registros en {path}.")
+    fai = np.concatenate(partes)
+
+    # La tabla de IDs guarda cada ID una vez: si hay repetidos vale el primero
+    tabla = tabla_ids.construir_tabla(ids)
+    n_unicos = len(tabla["offsets"]) - 1
+    if n_unicos < len(ids):
+        _, primero = np.unique(np.array(ids, dtype=object), return_index=True)
+        fai = fai[np.sort(primero)]
+        print(f"AVISO: {len(ids) - n_unicos} IDs repetidos; se indexa la primera aparición.")
+
+    tabla_ids.guardar_tabla(tabla, index_dir)
+    np.save(os.path.join(index_dir, "fai.npy"), fai)
+    st = os.stat(path)
+    np.save(os.path.join(index_dir, "stat.npy"), np.array([st.st_size, st.st_mtime_ns], dtype=np.int64))
+
+    nbytes = fai.nbytes + sum(tabla[k].nbytes for k in ("buf", "offsets", "hashes", "table"))
+    print(f"Registros indexados: {len(fai)} ({st.st_size / 1e9:.2f} GB de FASTA)")
+    print(f"Índice guardado en: {index_dir} ({nbytes / 1e6:.1f} MB, {time.perf_counter() - t0:.1f} s)")
+
+# ==========================
+# EXTRACCIÓN
+# ==========================
+
+def cargar_indice(path, index_dir):
+    try:
+        fai = np.load(os.path.join(index_dir, "fai.npy"), mmap_mode="r")
+        stat = np.load(os.path.join(index_dir, "stat.npy"))
+    except FileNotFoundError:
+        raise SystemExit(f"ERROR: No hay índice en {index_dir}; correr primero el modo 'index'.")
+    st = os.stat(path)
+    if int(stat[0]) != st.st_size or int(stat[1]) != st.st_mtime_ns:
+        raise SystemExit(f"ERROR: {path} cambió desde que se construyó {index_dir}; reindexar.")
+    return fai, tabla_ids.cargar_tabla(index_dir)
+
+
+def ids_de_familia(meta_file, family):
+    ids = []
+    with open(meta_file) as meta:
+        header = meta.readline().rstrip("\n").split("\t")
+        try:
+            id_idx = header.index("seq_id")
+            fam_idx = header.index("family")
+        except ValueError:
+            raise SystemExit("ERROR: La metadata debe tener columnas 'seq_id' y 'family' separadas por TAB.")
+        for line in meta:
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) > max(id_idx, fam_idx) and cols[fam_idx] == family:
+                ids.append(cols[id_idx])
+    return ids
+
+
+def extraer(path, fai, tabla, ids, out_file, line_width=LINE_WIDTH):
+    """Escribe los registros de 'ids' en orden de offset; devuelve (escritos, faltantes)."""
+    filas = tabla_ids.buscar(tabla, ids)
+    faltantes = [sid for sid, r in zip(ids, filas.tolist()) if r < 0]
+    filas = np.unique(filas[filas >= 0])
+    sel = fai[filas]
+    orden = np.argsort(sel["offset"], kind="stable")
+    filas, sel = filas[orden], sel[orden]
+
+    # Bytes a leer: todas las bases más los fin de línea intermedios
+    length = sel["length"].astype(np.int64)
+    lb = np.maximum(sel["line_bases"].astype(np.int64), 1)
+    eol = sel["line_width"].astype(np.int64) - sel["line_bases"].astype(np.int64)
+    span = length + np.maximum((length + lb - 1) // lb - 1, 0) * eol
+    offsets = sel["offset"].astype(np.int64)
+
+    with open(path, "rb") as f, open(out_file, "w") as out:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b""
+        try:
+            for r, o, s in zip(filas.tolist(), offsets.tolist(), span.tolist()):
+                seq = mm[o:o + s].translate(None, b"\r\n").decode("ascii")
+                sid = tabla_ids.id_de_fila(tabla, r)
+                if line_width > 0:
+                    seq = "\n".join(seq[i:i + line_width] for i in range(0, len(seq), line_width))
+                out.write(f">{sid}\n{seq}\n")
+        finally:
+            if isinstance(mm, mmap.mmap):
+                mm.close()
+    return len(filas), faltantes
+
+# ==========================
+# PROGRAMA PRINCIPAL
+# ==========================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FASTA indexado para extraer subconjuntos por ID.")
+    parser.add_argument("modo", choices=["index", "fetch"])
+    parser.add_argument("fasta", nargs="?", default=IN_FILE)
+    parser.add_argument("--index", default=INDEX_DIR)
+    parser.add_argument("--ids", default=None, help="(fetch) lista de IDs, FASTA o TSV (primera columna)")
+    parser.add_argument("--family", default=None, help="(fetch) extraer una familia según --meta")
+    parser.add_argument("--meta", default=None, help="(fetch) metadata con columnas seq_id y family")
+    parser.add_argument("--out", default="subconjunto.fasta")
+    parser.add_argument("--line-width", type=int, default=LINE_WIDTH)
+    args = parser.parse_args()
+
+    if args.modo == "index":
+        construir_indice(args.fasta, args.index)
+        raise SystemExit(0)
+
+    if (args.ids is None) == (args.family is None):
+        raise SystemExit("ERROR: Indicar --ids o --family (con --meta).")
+    if args.family is not None and args.meta is None:
+        raise SystemExit("ERROR: --family necesita --meta.")
+
+    t0 = time.perf_counter()
+    fai, tabla = cargar_indice(args.fasta, args.index)
+    ids = tabla_ids.leer_ids(args.ids) if args.ids else ids_de_familia(args.meta, args.family)
+    print(f"IDs pedidos: {len(ids)}")
+    escritos, faltantes = extraer(args.fasta, fai, tabla, ids, args.out, args.line_width)
+    print(f"Registros escritos: {escritos}, no encontrados en el índice: {len(faltantes)} "
+          f"({time.perf_counter() - t0:.2f} s)")
+    if faltantes:
+        print(f"  Primeros faltantes: {', '.join(faltantes[:5])}")
+    print(f"Subconjunto escrito en: {args.out}")
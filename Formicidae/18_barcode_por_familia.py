@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+
+"""
+Búsqueda de la ventana barcode para cada familia del dataset COI.
+
+El pipeline de Formicidae (alinear con la referencia -> recortar -> stats por
+columna -> ventanas -> barcode) se corrió a mano para una sola familia;
+Resultados/benchmark_intrafamily_species.csv ya lista otras (Chironomidae con
+854 especies, ...). Este script lo corre para todas:
+
+- Cada familia es una tarea de un Pool de procesos. Las tareas se reparten de
+  la más grande a la más chica (tamaños de la metadata), para que la última
+  en terminar no sea una familia enorme que arrancó tarde.
+- Cada proceso atiende UNA familia y se reemplaza (max_tasks_per_child=1), así
+  la memoria vuelve al sistema entre familias; --max-mem-gb fija además un
+  tope duro por proceso (RLIMIT_AS). Si el sistema mata un proceso (por
+  ejemplo por falta de memoria) la corrida no se cuelga: las familias que
+  estaban en curso quedan con error y se reintentan al relanzar. Las distancias por ventana se calculan por
+  bloques de filas (como en 12_barrido_parametros.py) y con a lo sumo
+  MAX_PER_SPECIES secuencias por especie.
+- Las secuencias de la familia se sacan del FASTA grande con el índice de
+  17_fasta_indexado.py (sin recorrer todo el archivo).
+- Cada familia terminada deja su carpeta con resultado.tsv (escrito al final,
+  de forma atómica) con los parámetros con que se corrió. Al relanzar, las
+  familias con resultado.tsv de los mismos parámetros se saltean y los
+  resúmenes se rearman con ellas: una corrida cortada sigue desde donde quedó.
+  Si cambiaron --win, --step, --min-cov o --max-per-species la familia se
+  rehace; si cambiaron el alineador o la referencia, también se realinea.
+
+Salida en OUT_DIR:
+  <familia>/<familia>_trimmed.fasta   alineamiento recortado por la referencia
+  <familia>/ventanas.tsv              ventanas rankeadas por cociente inter/intra
+  <familia>/barcode.fasta             mejor ventana (alineada)
+  resumen_familias.tsv                una fila por familia (también las fallidas)
+  barcodes_por_familia.tsv            familia, alineamiento, start, end
+                                      (entrada de 14_clasificador_cascada.py)
+
+Uso:
+  python 17_fasta_indexado.py index ../Raw/COI.fasta --index COI.fasta.idx
+  python 18_barcode_por_familia.py --fasta ../Raw/COI.fasta --index COI.fasta.idx --meta ../Raw/COI.metadata.tsv
+"""
+
+import argparse
+import importlib
+import os
+import re
+import resource
+import shlex
+import shutil
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+barrido = importlib.import_module("12_barrido_parametros")
+fasta_indexado = importlib.import_module("17_fasta_indexado")
+
+# ==========================
+# CONFIGURACIÓN
+# ==========================
+
+IN_FILE = "../Raw/COI.fasta"
+INDEX_DIR = "COI.fasta.idx"
+META_FILE = "../Raw/COI.metadata.tsv"   # columnas seq_id, family y species
+REF_FILE = "COI_ref.fasta"
+REF_ID = "COI_REF"
+OUT_DIR = "barcodes_familias"
+ALIGNER = "mafft --auto --thread 1 --quiet {entrada}"   # "none": las secuencias ya están alineadas
+
+MIN_SPECIES = 2          # especies con >= 2 secuencias para que la familia se procese
+TRIM_COVERAGE = 0.80     # como 01_trim_por_referencia.py
+WIN_SIZE = 30
+STEP = 5
+MIN_MEAN_COV = 0.70
+MAX_PER_SPECIES = 10
+N_PROCS = None           # None = todos los núcleos
+MAX_MEM_GB = None        # tope de memoria por proceso (None = sin tope)
+
+RESUMEN_COLS = ["family", "status", "n_seqs", "n_species", "aln_len", "trim_start", "trim_end",
+                "barcode_start", "barcode_end", "mean_intra", "mean_inter", "ratio", "seconds"]
+
+# ==========================
+# FAMILIAS Y TAREAS
+# ==========================
+
+def leer_familias(path):
+    """familia -> (IDs, especies), en el orden de la metadata."""
+    familias = {}
+    with open(path) as meta:
+        header = meta.readline().rstrip("\n").split("\t")
+        try:
+            id_idx = header.index("seq_id")
+            fam_idx = header.index("family")
+            sp_idx = header.index("species")
+        except ValueError:
+            raise SystemExit("ERROR: La metadata debe tener columnas 'seq_id', 'family' y 'species'.")
+        for line in meta:
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) <= max(id_idx, fam_idx, sp_idx) or not cols[fam_idx]:
+                continue
+            ids, species = familias.setdefault(cols[fam_idx], ([], []))
+            ids.append(cols[id_idx])
+            species.append(cols[sp_idx])
+    return familias
+
+
+def nombre_carpeta(family):
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", family)
+
+
+def leer_resultado(path):
+    with open(path) as f:
+        header = f.readline().rstrip("\n").split("\t")
+        values = f.readline().rstrip("\n").split("\t")
+    return dict(zip(header, values))
+
+
+def parametros(config):
+    """
+    Huella legible de los parámetros que cambian el resultado de una familia:
+    (alineamiento, ventanas). Se guarda en resultado.tsv.
+    """
+    aln = f"aligner={config['aligner']} ref={config['ref']}"
+    ventanas = (f"trim_coverage={config['trim_coverage']} win={config['win']} step={config['step']} "
+                f"min_cov={config['min_cov']} max_per_species={config['max_per_species']}")
+    return aln.replace("\t", " "), ventanas
+
+
+def fila_fallida(tarea, status):
+    family, ids, species = tarea
+    fila = dict.fromkeys(RESUMEN_COLS, "")
+    fila.update(family=family, status=status, n_seqs=len(ids), n_species=len(set(species)), seconds="NA")
+    return fila
+
+# ==========================
+# UNA FAMILIA (EN LOS PROCESOS)
+# ==========================
+
+CONFIG = None   # parámetros de la corrida (se cargan en el inicializador de cada proceso)
+INDICE = None   # (fai, tabla de IDs) del FASTA grande, abiertos con mmap
+
+
+def init_worker(config):
+    global CONFIG, INDICE
+    CONFIG = config
+    if config["max_mem_gb"]:
+        limite = int(config["max_mem_gb"] * 1024 ** 3)
+        resource.setrlimit(resource.RLIMIT_AS, (limite, limite))
+    INDICE = fasta_indexado.cargar_indice(config["fasta"], config["index"])
+
+
+def alinear(entrada, salida):
+    # Se escribe aparte y se renombra: un aln.fasta a medias nunca queda a la vista
+    tmp = f"{salida}.tmp"
+    if CONFIG["aligner"] == "none":
+        shutil.copyfile(entrada, tmp)
+        os.replace(tmp, salida)
+        return
+    cmd = [a.replace("{entrada}", entrada) for a in shlex.split(CONFIG["aligner"])]
+    with open(tmp, "w") as out:
+        proc = subprocess.run(cmd, stdout=out, stderr=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"el alineador terminó con código {proc.returncode}: {proc.stderr.strip()[:200]}")
+    os.replace(tmp, salida)
+
+
+def recortar(ids, mat):
+    """Bloque más largo con la referencia sin gap y cobertura >= TRIM_COVERAGE (01_trim_por_referencia.py)."""
+    coverage = (mat != barrido.GAP).mean(axis=0)
+    good = coverage >= CONFIG["trim_coverage"]
+    if REF_ID in ids:
+        good &= mat[ids.index(REF_ID)] != barrido.GAP
+    return barrido.core_por_cobertura(good.astype(np.float64), 1.0)
+
+
+def procesar_familia(tarea):
+    family, ids, species = tarea
+    t0 = time.perf_counter()
+    carpeta = os.path.join(CONFIG["out_dir"], nombre_carpeta(family))
+    os.makedirs(carpeta, exist_ok=True)
+    fila = dict.fromkeys(RESUMEN_COLS, "")
+    fila.update(family=family, n_seqs=len(ids), n_species=len(set(species)))
+    try:
+        # 1) Secuencias de la familia (+ referencia) y alineamiento
+        aln_file = os.path.join(carpeta, "aln.fasta")
+        if not os.path.exists(aln_file):
+            seqs_file = os.path.join(carpeta, "seqs.fasta")
+            fai, tabla = INDICE
+            fasta_indexado.extraer(CONFIG["fasta"], fai, tabla, ids, seqs_file)
+            if CONFIG["aligner"] != "none" and CONFIG["ref"]:
+                with open(seqs_file, "a") as out, open(CONFIG["ref"]) as ref:
+                    out.write(ref.read())
+            alinear(seqs_file, aln_file)
+            os.remove(seqs_file)
+
+        # 2) Recorte por la referencia
+        aln_ids, mat = barrido.leer_alineamiento(aln_file)
+        fila["aln_len"] = mat.shape[1]
+        ts, te = recortar(aln_ids, mat)
+        if te - ts < CONFIG["win"]:
+            raise RuntimeError(f"bloque recortado de {te - ts} columnas, menor que la ventana")
+        mat = np.ascontiguousarray(mat[:, ts:te])
+        fila.update(trim_start=ts, trim_end=te)
+        trimmed_file = os.path.join(carpeta, f"{nombre_carpeta(family)}_trimmed.fasta")
+        with open(trimmed_file, "w") as out:
+            for sid, row in zip(aln_ids, mat):
+                out.write(f">{sid}\n{row.tobytes().decode('ascii')}\n")
+
+        # 3) Stats por columna y ventanas (sin la referencia)
+        species_by_id = dict(zip(ids, species))
+        keep = [i for i, sid in enumerate(aln_ids) if sid in species_by_id]
+        sel_ids = [aln_ids[i] for i in keep]
+        sel_mat = mat[keep]
+        coverage, entropy = barrido.stats_columnas(barrido.conteos_por_columna(sel_mat), len(keep))
+        rows, codes = barrido.seleccion_por_especie(sel_ids, species_by_id, CONFIG["max_per_species"])
+        barrido.init_worker(sel_mat, {CONFIG["max_per_species"]: (rows, codes)})
+
+        W = CONFIG["win"]
+        ventanas = []
+        for start in range(0, mat.shape[1] - W + 1, CONFIG["step"]):
+            mean_cov = float(coverage[start:start + W].mean())
+            if mean_cov < CONFIG["min_cov"]:
+                continue
+            _, (s_intra, n_intra, s_inter, n_inter) = barrido.sumas_ventana(
+                (CONFIG["max_per_species"], start, start + W))
+            if not (n_intra and n_inter):
+                continue
+            mi, mx = s_intra / n_intra, s_inter / n_inter
+            ventanas.append((start, start + W, mean_cov, float(entropy[start:start + W].mean()), mi, mx,
+                             mx / (mi + 1e-6)))
+        if not ventanas:
+            raise RuntimeError("ninguna ventana con cobertura suficiente y pares intra e inter")
+        ventanas.sort(key=lambda v: v[6], reverse=True)
+        with open(os.path.join(carpeta, "ventanas.tsv"), "w") as out:
+            out.write("rank\tstart\tend\tmean_coverage\tmean_entropy\tmean_intra\tmean_inter\tratio\n")
+            for r, (s, e, mc, me, mi, mx, ratio) in enumerate(ventanas, 1):
+                out.write(f"{r}\t{s}\t{e}\t{mc:.5f}\t{me:.5f}\t{mi:.6f}\t{mx:.6f}\t{ratio:.4f}\n")
+
+        # 4) Barcode: la mejor ventana, alineada (como 04_extract_barcode_30bp.py)
+        bs, be, _, _, mi, mx, ratio = ventanas[0]
+        with open(os.path.join(carpeta, "barcode.fasta"), "w") as out:
+            for sid, row in zip(aln_ids, mat):
+                out.write(f">{sid}\n{row[bs:be].tobytes().decode('ascii')}\n")
+        fila.update(status="ok", barcode_start=bs, barcode_end=be, mean_intra=f"{mi:.6f}",
+                    mean_inter=f"{mx:.6f}", ratio=f"{ratio:.4f}")
+    except MemoryError:
+        fila["status"] = "error: sin memoria"
+    except (Exception, SystemExit) as e:
+        fila["status"] = f"error: {e}".replace("\t", " ").replace("\n", " ")
+    fila["seconds"] = f"{time.perf_counter() - t0:.1f}"
+
+    # resultado.tsv marca la familia como terminada (sólo si salió bien) y con qué parámetros
+    if fila["status"] == "ok":
+        path = os.path.join(carpeta, "resultado.tsv")
+        params_aln, params_ventanas = parametros(CONFIG)
+        with open(f"{path}.tmp", "w") as out:
+            out.write("\t".join(RESUMEN_COLS + ["params_aln", "params"]) + "\n")
+            out.write("\t".join([str(fila[c]) for c in RESUMEN_COLS] + [params_aln, params_ventanas]) + "\n")
+        os.replace(f"{path}.tmp", path)
+    return fila
+
+# ==========================
+# PROGRAMA PRINCIPAL
+# ==========================
+
+def escribir_fila(resumen, barcodes, fila, out_dir):
+    resumen.write("\t".join(str(fila[c]) for c in RESUMEN_COLS) + "\n")
+    resumen.flush()
+    if fila["status"] == "ok":
+        carpeta = nombre_carpeta(fila["family"])
+        trimmed = os.path.join(out_dir, carpeta, f"{carpeta}_trimmed.fasta")
+        barcodes.write(f"{fila['family']}\t{trimmed}\t{fila['barcode_start']}\t{fila['barcode_end']}\n")
+        barcodes.flush()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ventana barcode por familia sobre todo el dataset.")
+    parser.add_argument("--fasta", default=IN_FILE)
+    parser.add_argument("--index", default=INDEX_DIR, help="índice de 17_fasta_indexado.py")
+    parser.add_argument("--meta", default=META_FILE)
+    parser.add_argument("--ref", default=REF_FILE, help="FASTA con la referencia (vacío: sin referencia)")
+    parser.add_argument("--out-dir", default=OUT_DIR)
+    parser.add_argument("--aligner", default=ALIGNER)
+    parser.add_argument("--families", nargs="+", default=None, help="sólo estas familias")
+    parser.add_argument("--min-species", type=int, default=MIN_SPECIES)
+    parser.add_argument("--win", type=int, default=WIN_SIZE)
+    parser.add_argument("--step", type=int, default=STEP)
+    parser.add_argument("--min-cov", type=float, default=MIN_MEAN_COV)
+    parser.add_argument("--max-per-species", type=int, default=MAX_PER_SPECIES)
+    parser.add_argument("--procs", type=int, default=N_PROCS)
+    parser.add_argument("--max-mem-gb", type=float, default=MAX_MEM_GB)
+    args = parser.parse_args()
+
+    if args.aligner != "none":
+        binario = shlex.split(args.aligner)[0]
+        if shutil.which(binario) is None:
+            raise SystemExit(f"ERROR: No se encontró el alineador '{binario}' (o usar --aligner none "
+                             f"si las secuencias ya están alineadas).")
+    fasta_indexado.cargar_indice(args.fasta, args.index)  # falla temprano si falta o está viejo
+
+    # 1) Familias por tamaño, de mayor a menor
+    familias = leer_familias(args.meta)
+    if args.families:
+        faltan = [f for f in args.families if f not in familias]
+        if faltan:
+            raise SystemExit(f"ERROR: Familias que no están en la metadata: {', '.join(faltan)}")
+        familias = {f: familias[f] for f in args.families}
+    tareas = []
+    for family, (ids, species) in familias.items():
+        sp, cnt = np.unique(species, return_counts=True)
+        if int((cnt >= 2).sum()) >= args.min_species:
+            tareas.append((family, ids, species))
+    tareas.sort(key=lambda t: len(t[1]), reverse=True)
+    print(f"Familias en la metadata: {len(familias)}, con al menos {args.min_species} especies "
+          f"con 2+ secuencias: {len(tareas)}")
+
+    config = {
+        "fasta": args.fasta, "index": args.index, "ref": args.ref, "out_dir": args.out_dir,
+        "aligner": args.aligner, "trim_coverage": TRIM_COVERAGE, "win": args.win, "step": args.step,
+        "min_cov": args.min_cov, "max_per_species": args.max_per_species, "max_mem_gb": args.max_mem_gb,
+    }
+    params_aln, params_ventanas = parametros(config)
+
+    # 2) Reanudar: las familias con resultado.tsv de estos mismos parámetros ya están hechas
+    os.makedirs(args.out_dir, exist_ok=True)
+    hechas = []
+    pendientes = []
+    n_rehacer = 0
+    for tarea in tareas:
+        carpeta = os.path.join(args.out_dir, nombre_carpeta(tarea[0]))
+        path = os.path.join(carpeta, "resultado.tsv")
+        if os.path.exists(path):
+            previo = leer_resultado(path)
+            if previo.get("params_aln") == params_aln and previo.get("params") == params_ventanas:
+                hechas.append(previo)
+                continue
+            n_rehacer += 1
+            os.remove(path)
+            aln_file = os.path.join(carpeta, "aln.fasta")
+            if previo.get("params_aln") != params_aln and os.path.exists(aln_file):
+                os.remove(aln_file)
+        pendientes.append(tarea)
+    print(f"Familias ya terminadas: {len(hechas)}, pendientes: {len(pendientes)} "
+          f"({n_rehacer} con parámetros distintos, se rehacen)")
+    resumen_file = os.path.join(args.out_dir, "resumen_familias.tsv")
+    barcodes_file = os.path.join(args.out_dir, "barcodes_por_familia.tsv")
+
+    # 3) Resúmenes: se rearman con las hechas y se agrega cada familia al terminar
+    t0 = time.perf_counter()
+    n_ok = n_err = 0
+    with open(resumen_file, "w") as resumen, open(barcodes_file, "w") as barcodes:
+        resumen.write("\t".join(RESUMEN_COLS) + "\n")
+        barcodes.write("family\taln_fasta\tstart\tend\n")
+        for fila in hechas:
+            escribir_fila(resumen, barcodes, fila, args.out_dir)
+        if pendientes:
+            with ProcessPoolExecutor(args.procs, initializer=init_worker, initargs=(config,),
+                                     max_tasks_per_child=1) as pool:
+                futuros = {pool.submit(procesar_familia, tarea): tarea for tarea in pendientes}
+                for k, futuro in enumerate(as_completed(futuros), 1):
+                    try:
+                        fila = futuro.result()
+                    except BrokenProcessPool:
+                        # Un proceso murió sin avisar (típicamente el OOM killer): la familia no
+                        # tiene resultado.tsv y se reintenta al relanzar, con --max-mem-gb si hace falta
+                        fila = fila_fallida(futuros[futuro], "error: el proceso terminó de golpe "
+                                                              "(¿sin memoria? probá --max-mem-gb)")
+                    escribir_fila(resumen, barcodes, fila, args.out_dir)
+                    if fila["status"] == "ok":
+                        n_ok += 1
+                    else:
+                        n_err += 1
+                    estado = fila["status"]
+                    if estado == "ok":
+                        estado = f"ventana {fila['barcode_start']}-{fila['barcode_end']}"
+                    print(f"  [{k}/{len(pendientes)}] {fila['family']} ({fila['n_seqs']} secuencias): {estado} "
+                          f"({fila['seconds']} s; total {time.perf_counter() - t0:.1f} s)")
+
+    print(f"Familias procesadas en esta corrida: {n_ok} ok, {n_err} con error")
+    print(f"Resumen escrito en: {resumen_file}")
+    print(f"Barcodes por familia escritos en: {barcodes_file}")
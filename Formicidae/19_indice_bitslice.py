@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+"""
+Índice bit-sliced del alineamiento para stats por columna de cualquier subconjunto.
+
+Preguntas como "cobertura/entropía por columna sólo para el género X" o "sólo
+para estos 500 IDs" obligaban a filtrar y recorrer de nuevo el alineamiento
+(02_identidad_por_columna.py). Acá se construye UNA vez, por columna, un
+bitset por base y uno de gaps sobre todas las secuencias:
+
+  bits.npy       uint64 (palabras, columnas, símbolos): el bit r de la palabra
+                 r // 64 dice si la secuencia r tiene ese símbolo en esa columna
+  simbolos.npy   los símbolos de cada bitset: las letras de ACGTacgt que aparecen
+                 en el alineamiento y, al final, el gap
+
+más la tabla de IDs de 11_tabla_ids.py (fila i = secuencia i del alineamiento).
+Un subconjunto es una máscara de bits sobre las secuencias; los conteos por
+columna salen de AND + popcount, y sólo sobre las palabras de la máscara que
+no son cero (un género chico toca unas pocas palabras). Ni el alineamiento ni
+las secuencias se vuelven a leer.
+
+Las stats son las de 02_identidad_por_columna.py (cobertura, identidad =
+fracción de la base más común, entropía en bits sin gaps). Como en 02, las
+mayúsculas y minúsculas son símbolos distintos ("a" no suma con "A"). Las
+ambigüedades (ni ACGTacgt ni gap) cuentan juntas como un solo símbolo; sin
+ambigüedades el resultado es idéntico al de 02.
+
+Uso:
+  python 19_indice_bitslice.py build formicidae_trimmed_ref.fasta --index formicidae_bits.idx
+  python 19_indice_bitslice.py stats --index formicidae_bits.idx --meta Formicidae.metadata.tsv --rank genus
+  python 19_indice_bitslice.py stats --index formicidae_bits.idx --ids lista1.ids lista2.ids --out stats.tsv
+
+Uso interactivo:
+  bits, tabla = cargar_indice("formicidae_bits.idx")
+  counts = conteos_subconjunto(bits, mascara(tabla, ids, bits.shape[0]))
+"""
+
+import argparse
+import importlib
+import os
+import time
+
+import numpy as np
+
+tabla_ids = importlib.import_module("11_tabla_ids")
+barrido = importlib.import_module("12_barrido_parametros")
+
+# ==========================
+# CONFIGURACIÓN
+# ==========================
+
+ALN_FILE = "formicidae_trimmed_ref.fasta"
+INDEX_DIR = "formicidae_bits.idx"
+OUT_FILE = "stats_subconjuntos.tsv"
+MIN_SUBSET = 1            # tamaño mínimo de un subconjunto de --rank
+COL_BLOCK = 256           # columnas por bloque al construir
+
+BASES = b"ACGTacgt"         # candidatas a bitset propio; el resto (sin el gap) son ambigüedades
+GAP = ord("-")
+
+if hasattr(np, "bitwise_count"):
+    popcount = np.bitwise_count
+else:
+    _POP8 = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+    def popcount(x):
+        return _POP8[x.view(np.uint8)].reshape(x.shape + (8,)).sum(axis=-1)
+
+# ==========================
+# CONSTRUCCIÓN
+# ==========================
+
+def simbolos_presentes(mat):
+    """Las letras de BASES que aparecen en el alineamiento, más el gap al final (uint8)."""
+    presentes = np.zeros(256, dtype=bool)
+    presentes[np.unique(mat)] = True
+    return np.array([b for b in BASES if presentes[b]] + [GAP], dtype=np.uint8)
+
+
+def bitsets(mat, simbolos):
+    """(n, L) bytes del alineamiento -> (palabras, L, len(simbolos)) uint64."""
+    n, L = mat.shape
+    n_words = (n + 63) // 64
+    bits = np.zeros((n_words, L, len(simbolos)), dtype=np.uint64)
+    for c0 in range(0, L, COL_BLOCK):
+        c1 = min(c0 + COL_BLOCK, L)
+        for k, sym in enumerate(simbolos):
+            hit = mat[:, c0:c1] == sym
+            packed = np.packbits(hit, axis=0, bitorder="little")           # (ceil(n/8), columnas)
+            packed = np.vstack([packed, np.zeros((n_words * 8 - len(packed), c1 - c0), dtype=np.uint8)])
+            words = np.ascontiguousarray(packed.reshape(n_words, 8, c1 - c0).transpose(0, 2, 1))
+            bits[:, c0:c1, k] = words.view(np.uint64)[:, :, 0]
+    return bits
+
+
+def construir_indice(aln_file, index_dir):
+    t0 = time.perf_counter()
+    ids, mat = barrido.leer_alineamiento(aln_file)
+    if len(set(ids)) != len(ids):
+        raise SystemExit("ERROR: El alineamiento tiene IDs repetidos; no se puede indexar por ID.")
+    simbolos = simbolos_presentes(mat)
+    bits = bitsets(mat, simbolos)
+    tabla = tabla_ids.construir_tabla(ids)
+    tabla_ids.guardar_tabla(tabla, index_dir)
+    np.save(os.path.join(index_dir, "bits.npy"), bits)
+    np.save(os.path.join(index_dir, "simbolos.npy"), simbolos)
+    print(f"Secuencias: {mat.shape[0]}, columnas: {mat.shape[1]}, "
+          f"bases: {bytes(simbolos[:-1]).decode()}")
+    print(f"Índice guardado en: {index_dir} ({bits.nbytes / 1e6:.1f} MB de bitsets, "
+          f"{time.perf_counter() - t0:.1f} s)")
+
+# ==========================
+# CONSULTAS
+# ==========================
+
+def cargar_indice(index_dir):
+    try:
+        bits = np.load(os.path.join(index_dir, "bits.npy"), mmap_mode="r")
+    except FileNotFoundError:
+        raise SystemExit(f"ERROR: No hay índice en {index_dir}; correr primero el modo 'build'.")
+    if not os.path.exists(os.path.join(index_dir, "simbolos.npy")):
+        raise SystemExit(f"ERROR: El índice {index_dir} es de una versión anterior (sin simbolos.npy); "
+                         f"volvé a correr el modo 'build'.")
+    return bits, tabla_ids.cargar_tabla(index_dir)
+
+
+def mascara(tabla, ids, n_words):
+    """Máscara (palabras,) uint64 de las filas de 'ids'; los IDs que no están se ignoran."""
+    filas = tabla_ids.buscar(tabla, ids)
+    hit = np.zeros(n_words * 64, dtype=bool)
+    hit[filas[filas >= 0]] = True
+    return np.packbits(hit, bitorder="little").view(np.uint64)
+
+
+def conteos_subconjunto(bits, mask):
+    """(columnas, símbolos) cantidad de cada base y de gaps del subconjunto, y su tamaño."""
+    nz = np.flatnonzero(mask)
+    m = mask[nz]
+    n_sub = int(popcount(m).sum())
+    counts = np.zeros(bits.shape[1:], dtype=np.int64)
+    for w0 in range(0, len(nz), 256):
+        sel = nz[w0:w0 + 256]
+        counts += popcount(bits[sel] & m[w0:w0 + 256, None, None]).sum(axis=0, dtype=np.int64)
+    return counts, n_sub
+
+
+def stats_columnas(counts, n_sub):
+    """Cobertura, identidad y entropía (bits, sin gaps) por columna, como 02_identidad_por_columna.py."""
+    nongap = n_sub - counts[:, -1]
+    simbolos = np.column_stack([counts[:, :-1], nongap - counts[:, :-1].sum(axis=1)])
+    total = np.maximum(nongap, 1)
+    coverage = nongap / max(n_sub, 1)
+    identity = np.where(nongap > 0, simbolos.max(axis=1) / total, 0.0)
+    p = simbolos / total[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        logp = np.where(p > 0, np.log2(p), 0.0)
+    entropy = 0.0 - (p * logp).sum(axis=1)
+    return coverage, identity, entropy
+
+
+def subconjuntos_por_rango(meta_file, rank, taxa=None):
+    """nombre del taxón -> IDs, leyendo la columna 'rank' de la metadata."""
+    grupos = {}
+    with open(meta_file) as meta:
+        header = meta.readline().rstrip("\n").split("\t")
+        try:
+            id_idx = header.index("seq_id")
+            rank_idx = header.index(rank)
+        except ValueError:
+            raise SystemExit(f"ERROR: La metadata debe tener columnas 'seq_id' y '{rank}' separadas por TAB.")
+        for line in meta:
+            cols = line.rstrip("\n").split("\t")
+            if len(cols) <= max(id_idx, rank_idx):
+                continue
+            if taxa is None or cols[rank_idx] in taxa:
+                grupos.setdefault(cols[rank_idx], []).append(cols[id_idx])
+    return grupos
+
+# ==========================
+# PROGRAMA PRINCIPAL
+# ==========================
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Índice bit-sliced para stats por columna de subconjuntos.")
+    parser.add_argument("modo", choices=["build", "stats"])
+    parser.add_argument("aln", nargs="?", default=ALN_FILE, help="(build) alineamiento")
+    parser.add_argument("--index", default=INDEX_DIR)
+    parser.add_argument("--ids", nargs="+", default=None, help="(stats) listas de IDs, una por subconjunto")
+    parser.add_argument("--meta", default=None, help="(stats) metadata con seq_id y la columna de --rank")
+    parser.add_argument("--rank", default=None, help="(stats) un subconjunto por valor: genus, species, ...")
+    parser.add_argument("--taxa", nargs="+", default=None, help="(stats) sólo estos taxones de --rank")
+    parser.add_argument("--min-size", type=int, default=MIN_SUBSET)
+    parser.add_argument("--out", default=OUT_FILE)
+    args = parser.parse_args()
+
+    if args.modo == "build":
+        construir_indice(args.aln, args.index)
+        raise SystemExit(0)
+
+    if args.ids is None and args.rank is None:
+        raise SystemExit("ERROR: Indicar --ids o --rank (con --meta).")
+    if args.rank is not None and args.meta is None:
+        raise SystemExit("ERROR: --rank necesita --meta.")
+
+    bits, tabla = cargar_indice(args.index)
+    n_words, L, _ = bits.shape
+    subconjuntos = {}
+    for path in args.ids or []:
+        subconjuntos[os.path.basename(path)] = tabla_ids.leer_ids(path)
+    if args.rank is not None:
+        subconjuntos.update(subconjuntos_por_rango(args.meta, args.rank, args.taxa))
+
+    t0 = time.perf_counter()
+    n_out = 0
+    with open(args.out, "w") as out:
+        out.write("subset\tn_seqs\tcolumna\tcobertura\tidentidad\tentropia\n")
+        for nombre, ids in subconjuntos.items():
+            counts, n_sub = conteos_subconjunto(bits, mascara(tabla, ids, n_words))
+            if n_sub < max(args.min_size, 1):
+                continue
+            coverage, identity, entropy = stats_columnas(counts, n_sub)
+            for col in range(L):
+                out.write(f"{nombre}\t{n_sub}\t{col}\t{coverage[col]:.4f}\t{identity[col]:.4f}\t{entropy[col]:.4f}\n")
+            n_out += 1
+    dt = time.perf_counter() - t0
+
+    print(f"Subconjuntos: {n_out} de {len(subconjuntos)} (tamaño >= {max(args.min_size, 1)}), "
+          f"{L} columnas ({dt:.2f} s, {1000 * dt / max(n_out, 1):.1f} ms por subconjunto)")
+    print(f"Stats escritas en: {args.out}")
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+"""
+Base de perfiles por especie (PSSM + consenso) sobre la ventana barcode.
+
+07_servidor_clasificacion.py compara cada consulta con todos los haplotipos de
+referencia de formicidae_barcode_30bp.fasta; la mayoría de las especies tienen
+muchos registros casi idénticos, así que gran parte de ese trabajo se repite.
+Acá cada especie se resume UNA vez en:
+  profiles  float32 (especies, posiciones, 4): frecuencia de A, C, G, T,
+  n_obs     (especies, posiciones): secuencias con base en esa posición,
+  consensus (especies, posiciones): base más frecuente ('N' si no hay datos),
+guardados en un .npz.
+
+Para clasificar, todas las consultas del lote se comparan contra todas las
+especies con productos de matrices (one-hot de las consultas (Q, L*4) contra
+(L*4, especies)); el costo por consulta depende de la cantidad de especies, no
+de registros. Gaps y ambigüedades de la consulta no cuentan.
+- El orden lo da la p-distancia al consenso de cada especie (posiciones con
+  base en ambos, al menos MIN_COMPARABLE).
+- A igual distancia desempata el puntaje PSSM: log-odds contra un fondo
+  uniforme, con PSEUDOCOUNT (una posición sin datos en la especie pesa 0).
+Rankear sólo por PSSM castiga a las especies con pocas secuencias: con
+PSEUDOCOUNT fijo, una especie con una sola secuencia suma a lo sumo
+log2(2.5) ~ 1.32 por posición contra ~2 de una especie grande, y sus propias
+secuencias terminaban asignadas a una especie vecina grande.
+
+Si ninguna especie tiene MIN_COMPARABLE posiciones comparables con la
+consulta, o la consulta no es válida (largo distinto, caracteres fuera de
+bases/IUPAC/gaps), la especie sale NA. En la salida, margin es la distancia
+de la segunda especie menos la de la elegida.
+
+Uso:
+  python 20_perfiles_especie.py build --ref formicidae_barcode_30bp.fasta --meta metadata_ge600.tsv
+  python 20_perfiles_especie.py classify --in consultas_barcode.fasta --out clasificacion_perfiles.tsv
+"""
+
+import argparse
+import importlib
+import time
+
+import numpy as np
+
+servidor = importlib.import_module("07_servidor_clasificacion")
+
+# ==========================
+# CONFIGURACIÓN
+# ==========================
+
+REF_FASTA = "formicidae_barcode_30bp.fasta"
+META_FILE = "metadata_ge600.tsv"   # sin encabezado; seq_id primero, especie última
+PROFILES_FILE = "perfiles_especie_30bp.npz"
+IN_FILE = "consultas_barcode.fasta"
+OUT_FILE = "clasificacion_perfiles.tsv"
+
+PSEUDOCOUNT = 1.0      # repartido en partes iguales entre las 4 bases (desempate PSSM)
+BATCH_SIZE = 4096      # consultas por producto de matrices
+MIN_COMPARABLE = servidor.MIN_COMPARABLE
+
+BASES = servidor.BASES
+
+# ==========================
+# CONSTRUCCIÓN
+# ==========================
+
+def construir_perfiles(fasta, meta):
+    ids, seqs = servidor.leer_fasta(fasta)
+    species_by_id = servidor.leer_especies(meta)
+    if not seqs:
+        raise SystemExit(f"ERROR: No se leyeron secuencias de {fasta}.")
+    L = len(seqs[0])
+    for sid, s in zip(ids, seqs):
+        if len(s) != L:
+            raise SystemExit(f"ERROR: La referencia {sid} tiene longitud {len(s)} distinta de {L}.")
+
+    keep = [i for i, sid in enumerate(ids) if sid in species_by_id]
+    if not keep:
+        raise SystemExit("ERROR: Ninguna secuencia de referencia tiene especie en la metadata.")
+    for i in keep:
+        error = servidor.validar_secuencia(seqs[i], L)
+        if error is not None:
+            raise SystemExit(f"ERROR: La referencia {ids[i]} no es válida: {error}.")
+    sp_names = sorted({species_by_id[ids[i]] for i in keep})
+    sp_code = {sp: k for k, sp in enumerate(sp_names)}
+    labels = np.array([sp_code[species_by_id[ids[i]]] for i in keep], dtype=np.int64)
+    S = len(sp_names)
+
+    codes = servidor.LUT[np.frombuffer("".join(seqs[i] for i in keep).encode("ascii"),
+                                       dtype=np.uint8)].reshape(len(keep), L)
+    r, c = np.nonzero(codes < 4)
+    key = (labels[r] * L + c) * 4 + codes[r, c]
+    counts = np.bincount(key, minlength=S * L * 4).reshape(S, L, 4)
+    n_obs = counts.sum(axis=2)
+    profiles = (counts / np.maximum(n_obs, 1)[:, :, None]).astype(np.float32)
+    consensus = np.where(n_obs > 0, np.array(list(BASES))[counts.argmax(axis=2)], "N")
+
+    return {
+        "species": np.array(sp_names),
+        "n_seqs": np.bincount(labels, minlength=S).astype(np.int64),
+        "profiles": profiles,
+        "n_obs": n_obs.astype(np.uint32),
+        "consensus": np.array(["".join(row) for row in consensus]),
+    }
+
+# ==========================
+# CLASIFICACIÓN
+# ==========================
+
+def matriz_log_odds(db, pseudocount=PSEUDOCOUNT):
+    """(L*4, especies) float32: log2(P(base | especie, posición) / 0.25)."""
+    n_obs = db["n_obs"].astype(np.float32)[:, :, None]
+    p = (db["profiles"] * n_obs + pseudocount / 4) / (n_obs + pseudocount)
+    S, L, _ = p.shape
+    return np.ascontiguousarray((np.log2(p) + 2.0).reshape(S, L * 4).T.astype(np.float32))
+
+
+def dos_primeras(dist, scores):
+    """
+    Primera y segunda especie por distancia al consenso (menor primero) y, a
+    igual distancia, por puntaje PSSM (mayor primero). -1 si no hay especie
+    con distancia válida.
+    """
+    rows = np.arange(len(dist))
+    dist = dist.copy()
+    empate = np.empty(dist.shape, dtype=scores.dtype)
+    out = []
+    for _ in range(2):
+        dmin = dist.min(axis=1, initial=np.inf)
+        empate.fill(-np.inf)
+        np.copyto(empate, scores, where=dist == dmin[:, None])
+        s = np.where(np.isfinite(dmin), empate.argmax(axis=1), -1)
+        out.append(s)
+        ok = s >= 0
+        dist[rows[ok], s[ok]] = np.inf
+    return out
+
+
+def clasificar(db, log_odds, cons_oh, cons_valid, seqs):
+    """
+    Por consulta: especie elegida y segunda (índices, -1 = NA), sus puntajes
+    PSSM, sus p-distancias al consenso y las posiciones comparables con la
+    elegida.
+    """
+    L = db["profiles"].shape[1]
+    q_oh, q_valid = servidor.one_hot(seqs, L)
+    scores = q_oh @ log_odds                      # (Q, especies)
+    comparable = q_valid @ cons_valid.T
+    dist = q_oh @ cons_oh.T                        # coincidencias -> p-distancia, en el lugar
+    dist /= np.maximum(comparable, np.float32(1.0))
+    np.subtract(np.float32(1.0), dist, out=dist)
+    dist[comparable < MIN_COMPARABLE] = np.inf
+    s1, s2 = dos_primeras(dist, scores)
+    rows = np.arange(len(seqs))
+
+    def tomar(m, s, vacio):
+        return np.where(s >= 0, m[rows, np.maximum(s, 0)], vacio)
+
+    return (s1, tomar(scores, s1, np.nan), s2, tomar(scores, s2, np.nan),
+            tomar(dist, s1, np.nan), tomar(dist, s2, np.nan), tomar(comparable, s1, 0))
+
+
+def formato(x, fmt):
+    return "NA" if np.isnan(x) else format(x, fmt)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Perfiles por especie sobre el barcode y clasificación.")
+    parser.add_argument("modo", choices=["build", "classify"])
+    parser.add_argument("--ref", default=REF_FASTA, help="(build) barcode alineado de referencia")
+    parser.add_argument("--meta", default=META_FILE, help="(build) metadata sin encabezado")
+    parser.add_argument("--profiles", default=PROFILES_FILE)
+    parser.add_argument("--in", dest="in_file", default=IN_FILE, help="(classify) consultas alineadas")
+    parser.add_argument("--out", default=OUT_FILE)
+    parser.add_argument("--pseudocount", type=float, default=PSEUDOCOUNT)
+    args = parser.parse_args()
+
+    if args.modo == "build":
+        t0 = time.perf_counter()
+        db = construir_perfiles(args.ref, args.meta)
+        np.savez(args.profiles, **db)
+        S, L, _ = db["profiles"].shape
+        print(f"Usando referencia: {args.ref}")
+        print(f"Secuencias con especie: {int(db['n_seqs'].sum())}, especies: {S}, posiciones: {L}")
+        print(f"Perfiles escritos en: {args.profiles} ({db['profiles'].nbytes / 1e6:.1f} MB, "
+              f"{time.perf_counter() - t0:.1f} s)")
+        raise SystemExit(0)
+
+    with np.load(args.profiles) as data:
+        db = {k: data[k] for k in data.files}
+    S, L, _ = db["profiles"].shape
+    log_odds = matriz_log_odds(db, args.pseudocount)
+    cons_oh, cons_valid = servidor.one_hot(list(db["consensus"]), L)
+    print(f"Perfiles: {args.profiles} ({S} especies de {int(db['n_seqs'].sum())} secuencias, {L} posiciones)")
+
+    ids, seqs = servidor.leer_fasta(args.in_file)
+    invalidas = {}
+    for sid, s in zip(ids, seqs):
+        error = servidor.validar_secuencia(s, L)
+        if error is not None:
+            invalidas[sid] = error
+    validas = [(sid, s) for sid, s in zip(ids, seqs) if sid not in invalidas]
+    species = np.append(db["species"], "NA")   # índice -1 = NA
+
+    t0 = time.perf_counter()
+    n_na = 0
+    with open(args.out, "w") as out:
+        out.write("seq_id\tspecies\tscore\tsecond_species\tsecond_score\tconsensus_distance\t"
+                  "second_distance\tmargin\tn_comparable\n")
+        for sid in invalidas:
+            out.write(f"{sid}\tNA\tNA\tNA\tNA\tNA\tNA\tNA\t0\n")
+        for b0 in range(0, len(validas), BATCH_SIZE):
+            lote = validas[b0:b0 + BATCH_SIZE]
+            s1, sc1, s2, sc2, d1, d2, comp = clasificar(db, log_odds, cons_oh, cons_valid, [s for _, s in lote])
+            n_na += int((s1 < 0).sum())
+            for k, (sid, _) in enumerate(lote):
+                out.write(f"{sid}\t{species[s1[k]]}\t{formato(sc1[k], '.3f')}\t{species[s2[k]]}\t"
+                          f"{formato(sc2[k], '.3f')}\t{formato(d1[k], '.4f')}\t{formato(d2[k], '.4f')}\t"
+                          f"{formato(d2[k] - d1[k], '.4f')}\t{int(comp[k])}\n")
+    dt = time.perf_counter() - t0
+
+    print(f"Consultas clasificadas: {len(validas)} en {dt:.2f} s ({len(validas) / max(dt, 1e-9):.0f} consultas/s)")
+    print(f"Sin especie (NA) por tener menos de {MIN_COMPARABLE} posiciones comparables: {n_na}")
+    if invalidas:
+        sid, error = next(iter(invalidas.items()))
+        print(f"Consultas no válidas (NA): {len(invalidas)} (ej: {sid}: {error})")
+    print(f"Resultados escritos en: {args.out}")
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+"""
+Cache en disco de resultados intermedios, direccionado por contenido.
+
+Cada entrada es un .npz con arreglos de NumPy (matrices de conteos, sumas
+crudas por ventana, bloques de distancias, ...). La clave es un hash de todo
+lo que determina el resultado: el contenido del alineamiento, las etiquetas de
+especie usadas y los parámetros de la etapa. Si cambia cualquiera de ellos la
+clave cambia sola; si sólo cambia el orden de salida o un filtro posterior,
+el intermedio se reutiliza.
+
+El tamaño total está acotado: al guardar se borran las entradas usadas hace
+más tiempo (LRU, según la fecha de modificación, que se actualiza en cada
+acierto) hasta quedar bajo MAX_BYTES.
+
+Uso desde un script:
+  from cache_resultados import CacheResultados, huella_archivo
+
+  cache = CacheResultados()
+  clave = cache.clave("ventana_intra_inter", aln=huella_archivo(aln_file), start=0, end=60)
+  res = cache.memo(clave, lambda: {"sumas": calcular()})
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# ==========================
+# CONFIGURACIÓN
+# ==========================
+
+CACHE_DIR = os.environ.get("FORMICIDAE_CACHE_DIR", ".cache_resultados")
+MAX_BYTES = int(os.environ.get("FORMICIDAE_CACHE_MAX_BYTES", 2 * 1024 ** 3))  # 2 GB
+
+# ==========================
+# HUELLAS
+# ==========================
+
+_huellas = {}  # (path, tamaño, mtime) -> sha256, para no rehashear en el mismo proceso
+
+
+def huella_archivo(path):
+    """sha256 del contenido de un archivo."""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if key not in _huellas:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        _huellas[key] = h.hexdigest()
+    return _huellas[key]
+
+
+def huella(obj):
+    """sha256 de un objeto serializable a JSON (listas, dicts, números, str)."""
+    texto = json.dumps(obj, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+# ==========================
+# CACHE
+# ==========================
+
+class CacheResultados:
+    def __init__(self, directorio=CACHE_DIR, max_bytes=MAX_BYTES):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self.aciertos = 0
+        self.fallos = 0
+        os.makedirs(directorio, exist_ok=True)
+
+    def clave(self, etapa, **partes):
+        """Clave legible: nombre de la etapa + hash de todas sus entradas."""
+        return f"{etapa}-{huella(partes)[:40]}"
+
+    def _path(self, clave):
+        return os.path.join(self.directorio, f"{clave}.npz")
+
+    def obtener(self, clave):
+        """dict de arreglos guardado bajo 'clave', o None si no está."""
+        path = self._path(clave)
+        try:
+            with np.load(path) as data:
+                res = {k: data[k] for k in data.files}
+        except (FileNotFoundError, OSError, ValueError):
+            self.fallos += 1
+            return None
+        try:
+            os.utime(path)  # marca de uso reciente para el LRU
+        except FileNotFoundError:
+            pass
+        self.aciertos += 1
+        return res
+
+    def guardar(self, clave, **arreglos):
+        path = self._path(clave)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **arreglos)
+        os.replace(tmp, path)
+        self.evictar(conservar=path)
+
+    def memo(self, clave, calcular):
+        """Devuelve lo guardado bajo 'clave' o lo calcula (dict de arreglos) y lo guarda."""
+        res = self.obtener(clave)
+        if res is None:
+            res = {k: np.asarray(v) for k, v in calcular().items()}
+            self.guardar(clave, **res)
+        return res
+
+    def evictar(self, conservar=None):
+        """Borra las entradas menos usadas hasta quedar bajo max_bytes."""
+        entradas = []
+        total = 0
+        for name in os.listdir(self.directorio):
+            if not name.endswith(".npz"):
+                continue
+            path = os.path.join(self.directorio, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue  # otro proceso la borró
+            entradas.append((st.st_mtime_ns, st.st_size, path))
+            total += st.st_size
+        entradas.sort()
+        for _, size, path in entradas:
+            if total <= self.max_bytes:
+                break
+            if path == conservar:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
+
+    def resumen(self):
+        return f"cache {self.directorio}: {self.aciertos} aciertos, {self.fallos} fallos"
@@ -0,0 +1,61 @@
+"""Pruebas de 20_perfiles_especie.py: especies con una sola secuencia y consultas sin datos."""
+
+import importlib
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+perfiles = importlib.import_module("20_perfiles_especie")
+servidor = perfiles.servidor
+
+
+def mutar(seq, posiciones):
+    otra = {"A": "C", "C": "G", "G": "T", "T": "A"}
+    return "".join(otra[b] if i in posiciones else b for i, b in enumerate(seq))
+
+
+def escribir_referencia(tmp_path, registros):
+    fasta = tmp_path / "ref.fasta"
+    meta = tmp_path / "meta.tsv"
+    fasta.write_text("".join(f">{sid}\n{seq}\n" for sid, _, seq in registros))
+    meta.write_text("".join(f"{sid}\tFormicidae\t{sp}\n" for sid, sp, _ in registros))
+    return str(fasta), str(meta)
+
+
+def clasificar(db, seqs):
+    L = db["profiles"].shape[1]
+    log_odds = perfiles.matriz_log_odds(db)
+    cons_oh, cons_valid = servidor.one_hot(list(db["consensus"]), L)
+    return perfiles.clasificar(db, log_odds, cons_oh, cons_valid, seqs)
+
+
+def test_especie_con_una_secuencia(tmp_path):
+    # Una especie grande a 2 posiciones de una especie con una sola secuencia:
+    # con el puntaje PSSM solo, la grande ganaba también para la secuencia de
+    # la chica (1.32 bits por posición contra ~2).
+    rng = random.Random(0)
+    base = "".join(rng.choice("ACGT") for _ in range(30))
+    registros = [(f"g{i}", "Aaa grande", mutar(base, {3, 17})) for i in range(50)]
+    registros.append(("s0", "Bbb solitaria", base))
+    db = perfiles.construir_perfiles(*escribir_referencia(tmp_path, registros))
+
+    s1, _, s2, _, d1, d2, comp = clasificar(db, [base, mutar(base, {3, 17})])
+    assert list(db["species"][s1]) == ["Bbb solitaria", "Aaa grande"]
+    assert list(db["species"][s2]) == ["Aaa grande", "Bbb solitaria"]
+    assert d1[0] == 0.0 and abs(d2[0] - 2 / 30) < 1e-6
+    assert comp[0] == 30
+
+
+def test_consulta_sin_posiciones_comparables(tmp_path):
+    rng = random.Random(1)
+    base = "".join(rng.choice("ACGT") for _ in range(30))
+    registros = [("a0", "Aaa primera", base), ("b0", "Bbb segunda", mutar(base, {0}))]
+    db = perfiles.construir_perfiles(*escribir_referencia(tmp_path, registros))
+
+    corta = base[:10] + "-" * 20   # menos de MIN_COMPARABLE bases
+    s1, _, s2, _, _, _, comp = clasificar(db, [corta])
+    assert s1[0] == -1 and s2[0] == -1
+    assert comp[0] == 0
+    assert servidor.validar_secuencia(base[:29] + "ñ", 30) is not None